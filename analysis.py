@@ -1,105 +1,217 @@
-from collections import Counter
-from datetime import datetime
-import openai
-import os
+import asyncio
+import random
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+import threading
 
-from dotenv import load_dotenv
+import metrics
+from llm_cache import ResponseCache
+from llm_provider import ProviderError, RetryableProviderError, default_provider
+from prompts import build_intake_summary
 
-load_dotenv()
+GYM_MAX_TOKENS = 150
+EATING_MAX_TOKENS = 300
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+RETRYABLE_ERRORS = (asyncio.TimeoutError, RetryableProviderError)
+
+_default_response_cache = None
+_default_response_cache_lock = threading.Lock()
+
+
+def default_response_cache():
+    # Shared by every Analysis in the process; opened on first schedule request
+    global _default_response_cache
+    with _default_response_cache_lock:
+        if _default_response_cache is None:
+            _default_response_cache = ResponseCache()
+    return _default_response_cache
+
+
+def calorie_status(food_log, user_profile, date_str=None):
+    # Needs only the log's per-day totals, so callers can skip building an Analysis
+    if date_str is None:
+        date_str = datetime.now().strftime("%Y-%m-%d")
+    total_calories = food_log.get_daily_calories(date_str)
+    limit = user_profile["daily_calorie_limit"]
+    return {
+        "date": date_str,
+        "total_calories": total_calories,
+        "daily_calorie_limit": limit,
+        "remaining": limit - total_calories,
+        "exceeded": total_calories > limit,
+    }
 
 
 class Analysis:
-    def __init__(self, food_log):
+    def __init__(
+        self,
+        food_log,
+        response_cache=None,
+        intake_token_budget=600,
+        recommender=None,
+        provider=None,
+        report_cache_size=32,
+    ):
         self.food_log = food_log
+        self.response_cache = response_cache
+        # Chat backend; the shared OpenAI provider is created on first use
+        self.provider = provider
+        # Optional catalog recommender used for offline eating schedules
+        self.recommender = recommender
+        # Upper bound (estimated tokens) for the intake history in eating prompts
+        self.intake_token_budget = intake_token_budget
+        # Rolling per-day counters so reports merge daily buckets instead of rescanning
+        self.report_cache_size = report_cache_size
+        self._report_cache = OrderedDict()
+        self._rebuild_daily_counters()
+        food_log.add_listener(self._on_log_entry)
+
+    def _rebuild_daily_counters(self):
+        self._report_cache.clear()
+        self._daily_categories = self.food_log.log.daily_counts("category")
+        self._daily_foods = self.food_log.log.daily_counts("food")
+
+    def _count_entry(self, entry):
+        self._daily_categories[entry["date"]][entry["category"]] += 1
+        self._daily_foods[entry["date"]][entry["food"]] += 1
+
+    def category_counts(self, date_str):
+        return self._daily_categories.get(date_str, Counter())
+
+    def _on_log_entry(self, entry):
+        if entry is None:
+            self._rebuild_daily_counters()
+            return
+        self._count_entry(entry)
+        # Drop only the cached reports whose window covers the new entry
+        date_str = entry["date"]
+        self._report_cache = OrderedDict(
+            (window, report)
+            for window, report in self._report_cache.items()
+            if not window[0] <= date_str <= window[1]
+        )
+
+    def calorie_status(self, user_profile, date_str=None):
+        return calorie_status(self.food_log, user_profile, date_str)
 
     def check_calorie_limit(self, user_profile):
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        total_calories = self.food_log.get_daily_calories(date_str)
-        limit = user_profile["daily_calorie_limit"]
-        if total_calories > limit:
+        status = self.calorie_status(user_profile)
+        if status["exceeded"]:
             print("\nWarning: You have exceeded your daily calorie limit!")
         else:
-            remaining = limit - total_calories
-            print(f"\nYou have {remaining} kcal remaining for today.")
+            print(f"\nYou have {status['remaining']} kcal remaining for today.")
+        return status["remaining"]
 
-    def generate_weekly_report(self):
-        logs = self.food_log.get_logs_in_date_range()  # Changed from get_weekly_logs()
-        if not logs:
-            print("\nNo data available for the report.")
-            return
+    def suggest_foods(self, user_profile, recommender, k=10):
+        # Catalog foods that fit today's remaining calories, without an LLM call
+        remaining = self.calorie_status(user_profile)["remaining"]
+        if remaining <= 0:
+            return []
+        return recommender.recommend(user_profile, remaining, k)
+
+    @metrics.timed("analysis.get_report")
+    def get_report(self, end_date=None, days=7):
+        """Aggregate the `days` daily buckets ending at `end_date` (default today).
+
+        Reports are cached per window and must be treated as read-only.
+        """
+        if days < 1:
+            raise ValueError("days must be at least 1")
+        if end_date is None:
+            end_date = datetime.now()
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d")
+        dates = [
+            (end_date - timedelta(days=offset)).strftime("%Y-%m-%d")
+            for offset in range(days - 1, -1, -1)
+        ]
+        window = (dates[0], dates[-1])
+        if window in self._report_cache:
+            metrics.increment("analysis.report_cache.hits")
+            self._report_cache.move_to_end(window)
+            return self._report_cache[window]
+        metrics.increment("analysis.report_cache.misses")
 
-        categories = [entry["category"] for entry in logs]
-        foods = [entry["food"] for entry in logs]
+        category_counts = Counter()
+        food_counts = Counter()
+        for date_str in dates:
+            if date_str in self._daily_categories:
+                category_counts.update(self._daily_categories[date_str])
+                food_counts.update(self._daily_foods[date_str])
 
-        category_counts = Counter(categories)
-        food_counts = Counter(foods)
+        report = {
+            "start_date": window[0],
+            "end_date": window[1],
+            "total_entries": sum(category_counts.values()),
+            "total_calories": sum(
+                self.food_log.get_daily_calories(date_str) for date_str in dates
+            ),
+            "categories": category_counts.most_common(),
+            "foods": food_counts.most_common(),
+        }
+        self._report_cache[window] = report
+        if len(self._report_cache) > self.report_cache_size:
+            self._report_cache.popitem(last=False)
+        return report
+
+    def generate_weekly_report(self):
+        report = self.get_report()
+        if not report["total_entries"]:
+            print("\nNo data available for the report.")
+            return report
 
         print("\n-- Weekly Eating Habits Report --")
         print("\nMost Consumed Categories:")
-        for category, count in category_counts.most_common():
+        for category, count in report["categories"]:
             print(f"{category}: {count} times")
 
         print("\nMost Consumed Foods:")
-        for food, count in food_counts.most_common():
+        for food, count in report["foods"]:
             print(f"{food}: {count} times")
+        return report
 
-    def generate_gym_schedule(self, user_profile):
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a fitness expert."},
-                {
-                    "role": "user",
-                    "content": f"Create a gym schedule for this profile: {user_profile}",
-                },
-            ],
-            max_tokens=150,
-        )
-        schedule = response.choices[0].message["content"]
-        print("Generated Gym Schedule:")
-        print(schedule)
+    def _backends(self):
+        if self.provider is None:
+            self.provider = default_provider()
+        if self.response_cache is None:
+            self.response_cache = default_response_cache()
+        return self.provider, self.response_cache
 
-        # Ask for user confirmation or modifications
-        user_input = (
-            input("\nWould you like to modify this schedule? (yes/no): ")
-            .strip()
-            .lower()
-        )
-        if user_input == "yes":
-            modification_prompt = input(
-                "Describe your preferred modifications: "
-            ).strip()
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a fitness expert."},
-                    {
-                        "role": "user",
-                        "content": f"Create a gym schedule for this profile: {user_profile}. Adjust as follows: {modification_prompt}",
-                    },
-                ],
-                max_tokens=150,
-            )
-            schedule = response.choices[0].message["content"]
-            print("Modified Gym Schedule:")
-            print(schedule)
+    @metrics.timed("analysis.chat")
+    def _chat(self, messages, max_tokens, timeout=None):
+        provider, cache = self._backends()
 
-        return schedule
+        def create():
+            return provider.complete(messages, max_tokens, timeout)
 
-    def generate_eating_schedule(self, user_profile):
-        # Extract recent food logs (past 7 days)
-        recent_logs = self.food_log.get_logs_in_date_range()
-        recent_logs_text = "\n".join(
-            [
-                f"- {log['date']}: {log['food']} ({log['calories']} kcal)"
-                for log in recent_logs
-            ]
+        return cache.get_or_create(provider.model, messages, max_tokens, create)
+
+    def _stream_chat(self, messages, max_tokens, timeout=None):
+        provider, cache = self._backends()
+
+        def create_stream():
+            return provider.stream(messages, max_tokens, timeout)
+
+        return cache.stream(provider.model, messages, max_tokens, create_stream)
+
+    def gym_schedule_messages(self, user_profile, modification=None):
+        content = f"Create a gym schedule for this profile: {user_profile}"
+        if modification:
+            content += f". Adjust as follows: {modification}"
+        return [
+            {"role": "system", "content": "You are a fitness expert."},
+            {"role": "user", "content": content},
+        ]
+
+    @metrics.timed("analysis.eating_schedule_prompt")
+    def eating_schedule_prompt(self, user_profile):
+        # Past 7 days in full, older history as per-day aggregates, within budget
+        recent_logs_text = build_intake_summary(
+            self, token_budget=self.intake_token_budget
         )
 
         # Construct the prompt
-        prompt = f"""
+        return f"""
         You are a nutrition expert. Based on the user's profile and their recent food intake logs, create a balanced eating schedule for them.
 
         User Profile:
@@ -116,20 +228,43 @@ class Analysis:
         Generate a detailed eating schedule for one day, ensuring the user stays within their calorie limit and avoids blocked foods and categories.
         """
 
-        # Call OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a nutrition expert."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=300,
+    def eating_schedule_messages(self, user_profile, modification=None):
+        prompt = self.eating_schedule_prompt(user_profile)
+        if modification:
+            prompt = f"{prompt}\nAdjust as follows: {modification}"
+        return [
+            {"role": "system", "content": "You are a nutrition expert."},
+            {"role": "user", "content": prompt},
+        ]
+
+    async def agenerate_gym_schedule(
+        self, user_profile, modification=None, timeout=None
+    ):
+        # Non-interactive; the blocking call runs in a worker thread
+        messages = self.gym_schedule_messages(user_profile, modification)
+        return await asyncio.wait_for(
+            asyncio.to_thread(self._chat, messages, GYM_MAX_TOKENS, timeout), timeout
         )
 
-        schedule = response.choices[0].message["content"]
-        print("Generated Eating Schedule:")
-        print(schedule)
+    async def agenerate_eating_schedule(
+        self, user_profile, modification=None, timeout=None
+    ):
+        messages = self.eating_schedule_messages(user_profile, modification)
+        return await asyncio.wait_for(
+            asyncio.to_thread(self._chat, messages, EATING_MAX_TOKENS, timeout),
+            timeout,
+        )
+
+    def stream_gym_schedule(self, user_profile, modification=None, timeout=None):
+        """Yield the gym schedule in text chunks as the provider produces them."""
+        messages = self.gym_schedule_messages(user_profile, modification)
+        return self._stream_chat(messages, GYM_MAX_TOKENS, timeout)
+
+    def stream_eating_schedule(self, user_profile, modification=None, timeout=None):
+        messages = self.eating_schedule_messages(user_profile, modification)
+        return self._stream_chat(messages, EATING_MAX_TOKENS, timeout)
 
+    def _ask_for_modification(self):
         # Ask for user confirmation or modifications
         user_input = (
             input("\nWould you like to modify this schedule? (yes/no): ")
@@ -137,22 +272,102 @@ class Analysis:
             .lower()
         )
         if user_input == "yes":
-            modification_prompt = input(
-                "Describe your preferred modifications: "
-            ).strip()
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a nutrition expert."},
-                    {
-                        "role": "user",
-                        "content": f"{prompt}\nAdjust as follows: {modification_prompt}",
-                    },
-                ],
-                max_tokens=300,
+            return input("Describe your preferred modifications: ").strip()
+        return None
+
+    def generate_gym_schedule(self, user_profile):
+        print("Generated Gym Schedule:")
+        schedule = print_stream(self.stream_gym_schedule(user_profile))
+
+        modification_prompt = self._ask_for_modification()
+        if modification_prompt is not None:
+            print("Modified Gym Schedule:")
+            schedule = print_stream(
+                self.stream_gym_schedule(user_profile, modification_prompt)
             )
-            schedule = response.choices[0].message["content"]
-            print("Modified Eating Schedule:")
+
+        return schedule
+
+    def offline_eating_schedule(self, user_profile):
+        if self.recommender is None:
+            raise ValueError("A food catalog recommender is required offline")
+        # Deferred so numpy is only imported when the planner actually runs
+        from meal_planner import format_plan, plan_day
+
+        return format_plan(plan_day(self.recommender, user_profile, self.food_log))
+
+    def _eating_schedule(self, user_profile, modification=None):
+        try:
+            return print_stream(self.stream_eating_schedule(user_profile, modification))
+        except ProviderError:
+            # Fall back to the local meal planner when the API is unavailable
+            if self.recommender is None:
+                raise
+            print(
+                "The schedule service is unavailable; using the offline meal planner."
+            )
+            schedule = self.offline_eating_schedule(user_profile)
             print(schedule)
+            return schedule
+
+    def generate_eating_schedule(self, user_profile):
+        print("Generated Eating Schedule:")
+        schedule = self._eating_schedule(user_profile)
+
+        modification_prompt = self._ask_for_modification()
+        if modification_prompt is not None:
+            print("Modified Eating Schedule:")
+            schedule = self._eating_schedule(user_profile, modification_prompt)
 
         return schedule
+
+
+def print_stream(chunks, file=None):
+    """Print text chunks as they arrive and return the whole text."""
+    parts = []
+    for chunk in chunks:
+        print(chunk, end="", file=file, flush=True)
+        parts.append(chunk)
+    text = "".join(parts)
+    if not text.endswith("\n"):
+        print(file=file)
+    return text
+
+
+def describe_error(error):
+    # Provider errors already name the underlying client error
+    if isinstance(error, ProviderError):
+        return str(error)
+    return f"{type(error).__name__}: {error}"
+
+
+async def generate_schedules(
+    jobs, kind="gym", concurrency=8, retries=3, timeout=60.0, backoff=1.0
+):
+    """Generate schedules for many `(analysis, user_profile)` pairs concurrently.
+
+    Returns one result per job, in order: `{"schedule": ...}` or `{"error": ...}`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(analysis, user_profile):
+        generate = (
+            analysis.agenerate_gym_schedule
+            if kind == "gym"
+            else analysis.agenerate_eating_schedule
+        )
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    return {"schedule": await generate(user_profile, timeout=timeout)}
+                except RETRYABLE_ERRORS as error:
+                    if attempt == retries:
+                        return {"error": describe_error(error)}
+                    # Exponential backoff with full jitter
+                    await asyncio.sleep(random.uniform(0, backoff * 2**attempt))
+                except Exception as error:
+                    return {"error": describe_error(error)}
+
+    if kind not in ("gym", "eating"):
+        raise ValueError(f"Unknown schedule kind: {kind}")
+    return await asyncio.gather(*(run(analysis, profile) for analysis, profile in jobs))
@@ -0,0 +1,478 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from food_log import FoodLog
+from storage import JSONFileStorage
+
+FOODS = [
+    ("banana", "en:fruits", 89),
+    ("brown rice", "en:grains", 112),
+    ("greek yogurt", "en:dairy", 59),
+    ("salmon fillet", "en:fish", 208),
+    ("almonds", "en:nuts", 579),
+    ("egg", "en:eggs", 155),
+]
+
+QUICK_LOG_SIZES = (1_000, 10_000, 100_000)
+FULL_LOG_SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUICK_CATALOG_ROWS = (100_000,)
+FULL_CATALOG_ROWS = (100_000, 1_000_000, 5_000_000)
+
+PROFILE = {
+    "weight": 70.0,
+    "height": 175.0,
+    "age": 30,
+    "daily_calorie_limit": 2000,
+    "block_list": {"foods": ["almonds"], "categories": []},
+}
+
+
+def make_entries(count, entries_per_day=5, seed=42):
+    # Synthetic history ending today, `entries_per_day` meals per day
+    rng = random.Random(seed)
+    days = max(1, count // entries_per_day)
+    start = date.today() - timedelta(days=days - 1)
+    entries = []
+    for i in range(count):
+        food, category, calories = rng.choice(FOODS)
+        entries.append(
+            {
+                "date": (start + timedelta(days=i // entries_per_day)).isoformat(),
+                "food": food,
+                "category": category,
+                "calories": calories,
+            }
+        )
+    return entries
+
+
+def make_catalog_frame(rows, seed=42):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    words = np.array(
+        ["apple", "rice", "chicken", "yogurt", "bread", "salmon", "oat", "bean"]
+    )
+    first = words[rng.integers(0, len(words), rows)]
+    second = words[rng.integers(0, len(words), rows)]
+    names = pd.Series(first).str.cat(
+        [pd.Series(second), pd.Series(np.arange(rows).astype(str))], sep=" "
+    )
+    return pd.DataFrame(
+        {
+            "Food": names,
+            "Category": pd.Series(rng.integers(0, 200, rows)).map("en:cat{}".format),
+            "Calories": rng.integers(1, 900, rows).astype(float),
+        }
+    )
+
+
+def time_call(func, repeat=5, min_seconds=0.05, max_number=100_000):
+    """Median seconds per call over `repeat` runs of an auto-sized loop."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds or number >= max_number:
+            break
+        number *= 10
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def single_run(seconds):
+    return {"seconds": seconds, "min_seconds": seconds, "number": 1, "repeat": 1}
+
+
+def result(name, params, timing, **extra):
+    return {"name": name, "params": params, **timing, **extra}
+
+
+def bench_food_log_queries(sizes=QUICK_LOG_SIZES):
+    today = date.today()
+    week_ago = today - timedelta(days=6)
+    results = []
+    for size in sizes:
+        food_log = FoodLog("benchmark", log=make_entries(size))
+        params = {"entries": size}
+        results.append(
+            result(
+                "food_log.get_daily_calories",
+                params,
+                time_call(lambda: food_log.get_daily_calories(today.isoformat())),
+            )
+        )
+        results.append(
+            result(
+                "food_log.get_logs_in_date_range_7d",
+                params,
+                time_call(lambda: food_log.get_logs_in_date_range(week_ago, today)),
+            )
+        )
+    return results
+
+
+def bench_food_log_storage(sizes=QUICK_LOG_SIZES):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = JSONFileStorage(tmp_dir)
+        for size in sizes:
+            food_log = FoodLog("benchmark", log=make_entries(size), storage=storage)
+            params = {"entries": size}
+            repeat = 3 if size >= 1_000_000 else 5
+            save = time_call(food_log.save_log, repeat=repeat, min_seconds=0)
+            results.append(
+                result(
+                    "food_log.save_log",
+                    params,
+                    save,
+                    entries_per_second=size / save["seconds"],
+                )
+            )
+            load = time_call(food_log.load_log, repeat=repeat, min_seconds=0)
+            results.append(
+                result(
+                    "food_log.load_log",
+                    params,
+                    load,
+                    entries_per_second=size / load["seconds"],
+                )
+            )
+    return results
+
+
+def retained_bytes(build):
+    # Memory still allocated once `build()` returns, while its result is alive
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = build()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del value
+    return retained
+
+
+def bench_food_log_memory(sizes=QUICK_LOG_SIZES):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = JSONFileStorage(tmp_dir)
+        for size in sizes:
+            storage.log("benchmark").compact(make_entries(size))
+            # Entries as parsed from the journal: one dict and fresh strings each
+            dicts = retained_bytes(storage.log("benchmark").load)
+            start = time.perf_counter()
+            compact = retained_bytes(lambda: FoodLog("benchmark", storage=storage))
+            elapsed = time.perf_counter() - start
+            results.append(
+                result(
+                    "food_log.memory",
+                    {"entries": size},
+                    single_run(elapsed),
+                    bytes_per_entry=compact / size,
+                    dict_bytes_per_entry=dicts / size,
+                )
+            )
+    return results
+
+
+def bench_bulk_import(size=100_000):
+    import pandas as pd
+
+    entries = pd.DataFrame(make_entries(size))
+    # Make every row unique so nothing is dropped as a duplicate
+    entries["food"] = entries["food"] + " " + entries.index.astype(str)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        food_log = FoodLog("benchmark", storage=JSONFileStorage(tmp_dir))
+        start = time.perf_counter()
+        counts = food_log.import_entries(entries)
+        elapsed = time.perf_counter() - start
+    return [
+        result(
+            "food_log.import_entries",
+            {"entries": size},
+            single_run(elapsed),
+            imported=counts["imported"],
+            entries_per_second=size / elapsed,
+        )
+    ]
+
+
+def bench_analysis(sizes=QUICK_LOG_SIZES):
+    from analysis import Analysis
+
+    results = []
+    for size in sizes:
+        analysis = Analysis(FoodLog("benchmark", log=make_entries(size)))
+        params = {"entries": size}
+
+        def weekly_report():
+            # Measure aggregation, not the per-window cache
+            analysis._report_cache.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                analysis.generate_weekly_report()
+
+        results.append(
+            result("analysis.generate_weekly_report", params, time_call(weekly_report))
+        )
+        results.append(
+            result(
+                "analysis.eating_schedule_messages",
+                params,
+                time_call(lambda: analysis.eating_schedule_messages(PROFILE)),
+            )
+        )
+    return results
+
+
+def bench_catalog(rows_list=QUICK_CATALOG_ROWS):
+    from food_catalog import FoodCatalog
+
+    results = []
+    for rows in rows_list:
+        frame = make_catalog_frame(rows)
+        params = {"rows": rows}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "catalog")
+            start = time.perf_counter()
+            FoodCatalog.build(frame, path)
+            elapsed = time.perf_counter() - start
+            results.append(
+                result(
+                    "catalog.build",
+                    params,
+                    single_run(elapsed),
+                    rows_per_second=rows / elapsed,
+                )
+            )
+            catalog = FoodCatalog(path)
+            name = frame["Food"].iloc[rows // 2]
+            results.append(
+                result(
+                    "catalog.lookup", params, time_call(lambda: catalog.lookup(name))
+                )
+            )
+            results.append(
+                result(
+                    "catalog.prefix", params, time_call(lambda: catalog.prefix("salm"))
+                )
+            )
+            results.append(
+                result(
+                    "catalog.search",
+                    params,
+                    time_call(lambda: catalog.search("chiken yogrt"), repeat=3),
+                )
+            )
+            results.append(
+                result(
+                    "catalog.match",
+                    params,
+                    time_call(lambda: catalog.match("chiken yogrt")),
+                )
+            )
+            del catalog
+    return results
+
+
+def bench_dataset_preparation(rows=200_000, workers=None, changed=0.001):
+    import dataset_preparation
+
+    rng = random.Random(42)
+
+    def write_dump(path, edited=()):
+        with open(path, "w") as file:
+            file.write("code\tproduct_name\tmain_category\tenergy_100g\n")
+            for i in range(rows):
+                food, category, calories = FOODS[i % len(FOODS)]
+                if i in edited:
+                    calories += 1
+                file.write(f"{i}\t{food} {i}\t{category}\t{calories * 4.184:.1f}\n")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, "products.csv")
+        out_dir = os.path.join(tmp_dir, "shards")
+        write_dump(source)
+        stats = dataset_preparation.prepare(
+            source, out_dir, chunk_size=50_000, workers=workers
+        )
+        # A refresh after editing a small share of the products
+        write_dump(source, set(rng.sample(range(rows), int(rows * changed))))
+        refresh = dataset_preparation.prepare(
+            source, out_dir, chunk_size=50_000, workers=workers
+        )
+    return [
+        result(
+            "dataset_preparation.prepare",
+            {"rows": rows},
+            single_run(stats["seconds"]),
+            rows_per_second=stats["rows_per_second"],
+            peak_rss_mb=stats["peak_rss_mb"],
+        ),
+        result(
+            "dataset_preparation.refresh",
+            {"rows": rows, "changed": changed},
+            single_run(refresh["seconds"]),
+            rows_per_second=refresh["rows_per_second"],
+            rows_changed=refresh["rows_changed"],
+        ),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(log_sizes=QUICK_LOG_SIZES, catalog_rows=QUICK_CATALOG_ROWS, only=None):
+    suites = {
+        "queries": lambda: bench_food_log_queries(log_sizes),
+        "storage": lambda: bench_food_log_storage(log_sizes),
+        # tracemalloc makes loading ~5x slower, so memory stops at 1M entries
+        "memory": lambda: bench_food_log_memory(
+            [size for size in log_sizes if size <= 1_000_000]
+        ),
+        "import": lambda: bench_bulk_import(max(log_sizes)),
+        "analysis": lambda: bench_analysis(log_sizes),
+        "catalog": lambda: bench_catalog(catalog_rows),
+        "preparation": lambda: bench_dataset_preparation(max(catalog_rows)),
+    }
+    results = []
+    for name, suite in suites.items():
+        if only is None or name in only:
+            results.extend(suite())
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """Per-benchmark time ratios (current / baseline); `regressed` beyond `threshold`."""
+
+    def keyed(report):
+        return {
+            (row["name"], json.dumps(row["params"], sort_keys=True)): row
+            for row in report["results"]
+        }
+
+    old, new = keyed(baseline), keyed(current)
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]["seconds"] / old[key]["seconds"]
+        rows.append(
+            {
+                "name": key[0],
+                "params": new[key]["params"],
+                "baseline_seconds": old[key]["seconds"],
+                "seconds": new[key]["seconds"],
+                "ratio": ratio,
+                "regressed": ratio > 1 + threshold,
+            }
+        )
+    return rows
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+def format_params(row):
+    return ", ".join(f"{key}={value}" for key, value in row["params"].items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tracker hot paths")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Logs of 1k-10M entries and catalogs of up to 5M rows",
+    )
+    parser.add_argument("--sizes", help="Comma-separated log sizes")
+    parser.add_argument("--catalog-rows", help="Comma-separated catalog sizes")
+    parser.add_argument(
+        "--only",
+        help="Comma-separated suites: queries, storage, memory, import, "
+        "analysis, catalog, preparation",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    def sizes(text, default):
+        return tuple(int(size) for size in text.split(",")) if text else default
+
+    report = run_suite(
+        sizes(args.sizes, FULL_LOG_SIZES if args.full else QUICK_LOG_SIZES),
+        sizes(
+            args.catalog_rows, FULL_CATALOG_ROWS if args.full else QUICK_CATALOG_ROWS
+        ),
+        set(args.only.split(",")) if args.only else None,
+    )
+    for row in report["results"]:
+        print(
+            f"{row['name']:<40} {format_params(row):<18} "
+            f"{format_seconds(row['seconds'])}"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+        rows = compare(baseline, report, args.threshold)
+        print(f"\nCompared with {baseline.get('commit') or args.compare}:")
+        for row in rows:
+            flag = "  REGRESSED" if row["regressed"] else ""
+            print(
+                f"{row['name']:<40} {format_params(row):<18} {row['ratio']:.2f}x{flag}"
+            )
+        if any(row["regressed"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,166 @@
+import argparse
+import glob
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from recommend import BlockFilter
+from storage import LogJournal
+
+SUFFIXES = ("_profile.json", "_food_log.jsonl", "_food_log.json")
+
+
+def discover_users(directory="."):
+    """Usernames with a profile or food log file in `directory`."""
+    usernames = set()
+    for suffix in SUFFIXES:
+        for path in glob.glob(os.path.join(glob.escape(directory), f"*{suffix}")):
+            usernames.add(os.path.basename(path)[: -len(suffix)])
+    return sorted(usernames)
+
+
+def analyze_user(directory, username):
+    """Map step: per-user aggregates, computed in a worker process."""
+    profile = None
+    profile_path = os.path.join(directory, f"{username}_profile.json")
+    if os.path.exists(profile_path):
+        with open(profile_path, "r") as file:
+            profile = json.load(file)
+
+    journal = LogJournal(
+        os.path.join(directory, f"{username}_food_log.jsonl"),
+        legacy_path=os.path.join(directory, f"{username}_food_log.json"),
+    )
+    # Read-only: never migrate or compact files while analyzing
+    entries, _ = journal.read()
+
+    daily_calories = defaultdict(int)
+    categories = Counter()
+    violations = 0
+    block_filter = None
+    if profile is not None:
+        block_filter = BlockFilter(profile["block_list"])
+    for entry in entries:
+        daily_calories[entry["date"]] += entry["calories"]
+        categories[entry["category"]] += 1
+        if block_filter and not block_filter.allows(entry["food"], entry["category"]):
+            violations += 1
+
+    result = {
+        "username": username,
+        "has_profile": profile is not None,
+        "entries": len(entries),
+        "days_logged": len(daily_calories),
+        "total_calories": sum(daily_calories.values()),
+        "categories": categories,
+        "blocked_violations": violations,
+        "days_over_limit": None,
+    }
+    if profile is not None:
+        limit = profile["daily_calorie_limit"]
+        result["days_over_limit"] = sum(
+            1 for total in daily_calories.values() if total > limit
+        )
+    return result
+
+
+def _analyze(args):
+    # One unreadable user must not abort the whole report
+    try:
+        return analyze_user(*args)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        return {"username": args[1], "error": f"{type(error).__name__}: {error}"}
+
+
+def reduce_results(results, top=10):
+    """Reduce step: fold per-user aggregates into one cohort report.
+
+    Users whose files could not be analyzed are listed under `failed_users`
+    and left out of every other figure.
+    """
+    report = {
+        "users": 0,
+        "users_with_profile": 0,
+        "entries": 0,
+        "days_logged": 0,
+        "total_calories": 0,
+        "profiled_days": 0,
+        "days_over_limit": 0,
+        "blocked_violations": 0,
+        "users_with_violations": 0,
+    }
+    failed = {}
+    categories = Counter()
+    adherence = []
+    for result in results:
+        if "error" in result:
+            failed[result["username"]] = result["error"]
+            continue
+        report["users"] += 1
+        report["entries"] += result["entries"]
+        report["days_logged"] += result["days_logged"]
+        report["total_calories"] += result["total_calories"]
+        report["blocked_violations"] += result["blocked_violations"]
+        report["users_with_violations"] += bool(result["blocked_violations"])
+        categories.update(result["categories"])
+        if result["has_profile"]:
+            report["users_with_profile"] += 1
+            report["profiled_days"] += result["days_logged"]
+            report["days_over_limit"] += result["days_over_limit"]
+            if result["days_logged"]:
+                adherence.append(1 - result["days_over_limit"] / result["days_logged"])
+
+    # Share of logged days within the limit, averaged per user and over all days
+    report["mean_user_adherence"] = (
+        sum(adherence) / len(adherence) if adherence else None
+    )
+    profiled_days = report.pop("profiled_days")
+    report["overall_adherence"] = (
+        1 - report["days_over_limit"] / profiled_days if profiled_days else None
+    )
+    report["top_categories"] = categories.most_common(top)
+    report["failed_users"] = failed
+    return report
+
+
+def cohort_report(directory=".", workers=None, top=10):
+    """Analyze every user in `directory` across a process pool.
+
+    Each worker loads one user's files at a time and returns only small
+    aggregates, so no process ever holds every log in memory.
+    """
+    usernames = discover_users(directory)
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(usernames) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _analyze,
+            ((directory, username) for username in usernames),
+            chunksize=chunksize,
+        )
+        return reduce_results(results, top)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analytics across all users")
+    parser.add_argument("directory", nargs="?", default=".")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    report = cohort_report(args.directory, args.workers, args.top)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+from array import array
+from collections import Counter, defaultdict
+from collections.abc import MutableSequence
+from datetime import date
+from functools import lru_cache
+
+# Calories are held in a signed 64-bit column
+MAX_CALORIES = 2**63 - 1
+
+
+@lru_cache(maxsize=4096)
+def date_ordinal(date_str):
+    return date.fromisoformat(date_str).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def ordinal_date(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+class Vocabulary:
+    """Dictionary encoding: each distinct string is stored once and gets an ID."""
+
+    __slots__ = ("ids", "names")
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def encode(self, name):
+        index = self.ids.get(name)
+        if index is None:
+            index = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+
+class CompactLog(MutableSequence):
+    """Food log entries stored as parallel typed arrays.
+
+    Dates are int32 day ordinals, foods/categories int32 IDs into per-log
+    vocabularies and calories int64, so an entry costs 20 bytes instead of a
+    dict and its strings. Items are read and written as plain entry dicts; a
+    returned dict is a copy, so assign it back (`log[i] = entry`) to change an
+    entry.
+    """
+
+    def __init__(self, entries=()):
+        self.clear()
+        self.extend(entries)
+
+    def _encode(self, entry):
+        return (
+            date_ordinal(entry["date"]),
+            self.food_names.encode(entry["food"]),
+            self.category_names.encode(entry["category"]),
+            entry["calories"],
+        )
+
+    def _entry(self, index):
+        return {
+            "date": ordinal_date(self.dates[index]),
+            "food": self.food_names.names[self.foods[index]],
+            "category": self.category_names.names[self.categories[index]],
+            "calories": self.calories[index],
+        }
+
+    def _columns(self):
+        return (self.dates, self.foods, self.categories, self.calories)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("log index out of range")
+        return self._entry(index)
+
+    def __setitem__(self, index, entry):
+        if isinstance(index, slice):
+            raise TypeError("CompactLog does not support slice assignment")
+        day, food, category, calories = self._encode(entry)
+        self.calories[index] = calories
+        self.dates[index] = day
+        self.foods[index] = food
+        self.categories[index] = category
+
+    def __delitem__(self, index):
+        for column in self._columns():
+            del column[index]
+
+    def insert(self, index, entry):
+        day, food, category, calories = self._encode(entry)
+        self.calories.insert(index, calories)
+        self.dates.insert(index, day)
+        self.foods.insert(index, food)
+        self.categories.insert(index, category)
+
+    def append(self, entry):
+        self.extend((entry,))
+
+    def extend(self, entries):
+        if entries is self:
+            entries = list(entries)
+        dates, foods, categories, calories = self._columns()
+        encode_food = self.food_names.encode
+        encode_category = self.category_names.encode
+        for entry in entries:
+            day = date_ordinal(entry["date"])
+            # Calories first: a non-integer value must not leave columns uneven
+            calories.append(entry["calories"])
+            dates.append(day)
+            foods.append(encode_food(entry["food"]))
+            categories.append(encode_category(entry["category"]))
+
+    def clear(self):
+        self.dates = array("i")
+        self.foods = array("i")
+        self.categories = array("i")
+        self.calories = array("q")
+        self.food_names = Vocabulary()
+        self.category_names = Vocabulary()
+
+    def __iter__(self):
+        foods = self.food_names.names
+        categories = self.category_names.names
+        days = {}
+        for day, food, category, calories in zip(*self._columns()):
+            date_str = days.get(day)
+            if date_str is None:
+                date_str = days[day] = ordinal_date(day)
+            yield {
+                "date": date_str,
+                "food": foods[food],
+                "category": categories[category],
+                "calories": calories,
+            }
+
+    def daily_counts(self, field):
+        """{date: Counter(name: entries)} for "food" or "category", counted on IDs."""
+        codes, vocabulary = {
+            "food": (self.foods, self.food_names),
+            "category": (self.categories, self.category_names),
+        }[field]
+        counts = defaultdict(Counter)
+        for (day, code), count in Counter(zip(self.dates, codes)).items():
+            counts[ordinal_date(day)][vocabulary.names[code]] = count
+        return counts
+
+    def __eq__(self, other):
+        if not isinstance(other, (CompactLog, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            mine == theirs for mine, theirs in zip(self, other)
+        )
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"CompactLog({list(self)!r})"
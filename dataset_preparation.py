@@ -1,47 +1,51 @@
-import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
+import argparse
+import glob
+import heapq
+import importlib.util
+import itertools
 import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
+import numpy as np
+import pandas as pd
 
-# File path to the large dataset
-file_path = "en.openfoodfacts.org.products.csv"
+from food_log import normalize_names
 
-# Define columns to retain
-columns_to_keep = ["product_name", "main_category", "energy_100g"]
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
-# Load dataset in chunks to handle large file size
-chunk_size = 1000
-relevant_data = []
 
-print("Processing dataset in chunks...")
+# Define columns to retain
+COLUMNS_TO_KEEP = ["product_name", "main_category", "energy_100g"]
 
-# Initialize counter and download required NLTK data
-total_rows = 0
-for chunk in pd.read_csv(
-    file_path, sep="\t", usecols=columns_to_keep, chunksize=chunk_size, low_memory=False
-):
-    chunk = chunk.dropna(subset=columns_to_keep)
-    chunk = chunk[chunk["energy_100g"] >= 0]
-    relevant_data.append(chunk)
+# Products are identified by barcode, or by name where the barcode is missing
+KEY_COLUMN = "code"
 
-    # Keep track of total valid rows
-    total_rows += len(chunk)
+# Shard rows carry the product key hash and code; delta shards add a Deleted flag
+SHARD_COLUMNS = ["Key", "Code", "Food", "Category", "Calories"]
 
-    # Stop if we have 10000 or more rows
-    if total_rows >= 1000:
-        break
+# Sorted product key hashes with their content hashes and whether the row is valid
+MANIFEST_DIR = "manifest"
+MANIFEST_ARRAYS = ("keys", "hashes", "valid")
 
-# Combine all relevant chunks and take first 10000 rows
-data = pd.concat(relevant_data)
-data = data.head(1000)
+# Rename columns to align with application schema
+COLUMN_NAMES = {
+    "product_name": "Food",
+    "main_category": "Category",
+    "energy_100g": "Calories",
+}
 
-# Further reduce the dataset size by sampling a smaller subset
-data = data.sample(n=1000, random_state=42)  # Adjust n as needed
+# Open Food Facts reports energy_100g in kJ
+KJ_PER_KCAL = 4.184
 
-# Add some manually labeled test data
-test_data = pd.DataFrame(
+# Manually labeled foods appended to every catalog (already in kcal)
+MANUAL_FOODS = pd.DataFrame(
     {
-        "product_name": [
+        "Food": [
             "Grilled Chicken Breast",
             "Brown Rice",
             "Salmon Fillet",
@@ -53,7 +57,7 @@ test_data = pd.DataFrame(
             "Avocado",
             "Egg",
         ],
-        "main_category": [
+        "Category": [
             "en:poultry",
             "en:grains",
             "en:fish",
@@ -65,7 +69,7 @@ test_data = pd.DataFrame(
             "en:fruits",
             "en:eggs",
         ],
-        "energy_100g": [
+        "Calories": [
             165,  # calories per 100g
             112,
             208,
@@ -80,34 +84,480 @@ test_data = pd.DataFrame(
     }
 )
 
-# Append test data
-data = pd.concat([data, test_data], ignore_index=True)
 
-# Rename columns to align with application schema
-data.rename(
-    columns={
-        "product_name": "Food",
-        "main_category": "Category",
-        "energy_100g": "Calories",
-    },
-    inplace=True,
-)
+def clean_rows(chunk):
+    """Valid rows of `chunk` in the catalog schema, keeping the chunk's index."""
+    chunk = chunk[COLUMNS_TO_KEEP].dropna()
+    chunk = chunk[chunk["energy_100g"] >= 0]
+    chunk = chunk.rename(columns=COLUMN_NAMES)
+    chunk["Calories"] = (chunk["Calories"] / KJ_PER_KCAL).round(1)
+
+    # Normalize text columns
+    for col in ["Food", "Category"]:
+        chunk[col] = normalize_names(chunk[col].astype(str))
+    return chunk[chunk["Food"] != ""]
+
+
+def dedupe_foods(data):
+    """Collapse rows with the same normalized Food and Category into one.
+
+    The kept row sits where the first duplicate was and carries the median
+    calories of the group.
+    """
+    data = data[data["Food"] != ""]
+    return data.groupby(["Food", "Category"], sort=False, as_index=False).agg(
+        Calories=("Calories", "median")
+    )
+
+
+def product_codes(chunk):
+    codes = chunk["product_name"]
+    if KEY_COLUMN in chunk.columns:
+        codes = chunk[KEY_COLUMN].fillna(codes)
+    return codes.fillna("")
+
+
+def product_keys(chunk):
+    # Most values are distinct, so hashing directly beats factorizing first
+    return pd.util.hash_pandas_object(
+        product_codes(chunk), index=False, categorize=False
+    ).to_numpy()
+
+
+def content_hashes(chunk):
+    return pd.util.hash_pandas_object(
+        chunk[COLUMNS_TO_KEEP], index=False, categorize=False
+    ).to_numpy()
+
+
+def load_manifest(manifest_dir, mmap_mode=None):
+    """The manifest arrays and metadata of the last run, or None."""
+    meta_path = os.path.join(manifest_dir, "manifest.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as file:
+        manifest = json.load(file)
+    for name in MANIFEST_ARRAYS:
+        path = os.path.join(manifest_dir, f"{name}.npy")
+        manifest[name] = np.load(path, mmap_mode=mmap_mode)
+    return manifest
+
+
+def write_manifest(manifest_dir, keys, hashes, valid, generation):
+    # Sorted by key; a product listed twice keeps its last row
+    order = np.argsort(keys, kind="stable")
+    keys, hashes, valid = keys[order], hashes[order], valid[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    arrays = {"keys": keys[last], "hashes": hashes[last], "valid": valid[last]}
+
+    os.makedirs(manifest_dir, exist_ok=True)
+    for name, array in arrays.items():
+        path = os.path.join(manifest_dir, f"{name}.npy")
+        with open(f"{path}.tmp", "wb") as file:
+            np.save(file, array)
+        os.replace(f"{path}.tmp", path)
+    # Written last: a run interrupted before this point looks like the old one
+    meta_path = os.path.join(manifest_dir, "manifest.json")
+    with open(f"{meta_path}.tmp", "w") as file:
+        json.dump({"generation": generation, "products": int(last.sum())}, file)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+
+def diff_manifest(keys, hashes, previous):
+    """Masks of new or modified rows, of unchanged rows known to be valid and of
+    rows whose product had a valid row in the previous run."""
+    if previous is None or not len(previous["keys"]):
+        none = np.zeros(len(keys), dtype=bool)
+        return ~none, none, none
+    # Sorted needles walk the memory-mapped keys in order
+    order = np.argsort(keys)
+    positions = np.empty(len(keys), dtype=np.intp)
+    positions[order] = np.searchsorted(previous["keys"], keys[order])
+    positions = positions.clip(max=len(previous["keys"]) - 1)
+    known = (previous["keys"][positions] == keys) & previous["valid"][positions]
+    unchanged = (previous["keys"][positions] == keys) & (
+        previous["hashes"][positions] == hashes
+    )
+    return ~unchanged, unchanged & previous["valid"][positions], known
+
+
+# Manifest of the previous run, memory-mapped once per worker process
+_previous = None
+
+
+def _init_worker(manifest_dir):
+    global _previous
+    _previous = None
+    if manifest_dir is not None:
+        _previous = load_manifest(manifest_dir, mmap_mode="r")
+
+
+def shard_rows(chunk, keys, cleaned):
+    """Cleaned rows with their product key and code, one row per product."""
+    rows = cleaned.assign(
+        Key=keys[cleaned.index], Code=product_codes(chunk.loc[cleaned.index])
+    )
+    # A product listed twice keeps its last row, as in the manifest
+    return rows.drop_duplicates("Key", keep="last")[SHARD_COLUMNS]
+
+
+def tombstones(keys, codes=None):
+    """Delta rows that delete the products with `keys` from earlier shards."""
+    return pd.DataFrame(
+        {
+            "Key": keys,
+            "Code": codes,
+            "Food": None,
+            "Category": None,
+            "Calories": np.nan,
+            "Deleted": True,
+        },
+        index=pd.RangeIndex(len(keys)),
+    )
+
+
+def write_shard(data, out_dir, index, fmt="jsonl", prefix="part"):
+    path = os.path.join(out_dir, f"{prefix}-{index:05d}.{fmt}")
+    tmp_path = f"{path}.tmp"
+    if fmt == "parquet":
+        data.to_parquet(tmp_path, index=False)
+    else:
+        data.to_json(tmp_path, orient="records", lines=True, force_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def process_chunk(index, chunk, out_dir, fmt, sample_size, seed, prefix="part"):
+    """Clean the new or changed rows of one chunk into a shard.
+
+    In a refresh, changed products whose row is no longer valid get a
+    tombstone so they are dropped from earlier shards.
+
+    Each product gets a pseudo-random priority derived from its key; keeping
+    the `sample_size` smallest priorities across all chunks yields a uniform
+    sample of the whole dump without holding it in memory. Because priorities
+    are stable, unchanged rows only need cleaning when they are sample
+    candidates. Returns row counts, the candidate sample and this chunk's
+    manifest arrays.
+    """
+    chunk = chunk.reset_index(drop=True)
+    keys = product_keys(chunk)
+    hashes = content_hashes(chunk)
+    changed, unchanged_valid, known = diff_manifest(keys, hashes, _previous)
+    priorities = pd.util.hash_array(keys ^ np.uint64(seed)) / 2.0**64
+
+    cleaned = clean_rows(chunk[changed])
+    valid = unchanged_valid.copy()
+    valid[cleaned.index] = True
+    written = shard_rows(chunk, keys, cleaned)
+    deleted = 0
+    if _previous is not None:
+        stale = np.flatnonzero(changed & known & ~valid)
+        deleted = len(stale)
+        written = pd.concat(
+            [
+                written.assign(Deleted=False),
+                tombstones(keys[stale], product_codes(chunk.iloc[stale]).to_numpy()),
+            ],
+            ignore_index=True,
+        )
+    if len(written) or _previous is None:
+        write_shard(written, out_dir, index, fmt, prefix)
+
+    # Unchanged rows that could still make the sample
+    candidates = np.flatnonzero(unchanged_valid)
+    candidates = candidates[np.argsort(priorities[candidates])[:sample_size]]
+    pool = pd.concat([cleaned, clean_rows(chunk.iloc[candidates])])
+    pool_priorities = priorities[pool.index.to_numpy()]
+    keep = np.argsort(pool_priorities)[:sample_size]
+    sample = list(zip(pool_priorities[keep], pool.iloc[keep].to_dict(orient="records")))
+    shards = int(bool(len(written)) or _previous is None)
+    return {
+        "index": index,
+        "rows_read": len(chunk),
+        "rows_changed": int(changed.sum()),
+        "rows_written": len(written) - deleted,
+        "rows_deleted": deleted,
+        "shards": shards,
+        "sample": sample,
+        "manifest": (keys, hashes, valid),
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in KiB on Linux
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(usage, children) / 1024
+
+
+def prepare(
+    source,
+    out_dir,
+    chunk_size=100_000,
+    workers=None,
+    fmt="jsonl",
+    sample_size=1000,
+    seed=42,
+    limit=None,
+    full=False,
+):
+    """Stream `source` through a process pool, writing cleaned shards.
+
+    The first run (or any run with `full`) cleans every row into one
+    `part-*` shard per chunk. Later runs compare each product's content hash
+    with the manifest in `out_dir` and only clean and write new or changed
+    rows, as `delta-<generation>-*` shards. Every row carries its product
+    `Key`; to apply deltas, read the `part-*` shards and then each
+    generation's deltas in order, letting a row replace any earlier row with
+    the same key and dropping keys whose latest row has `Deleted` set (changed
+    products that became invalid, and products missing from the dump).
+    Returns throughput statistics and the sampled rows for the app catalog,
+    which match a full rebuild.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_dir = os.path.join(out_dir, MANIFEST_DIR)
+    previous = None if full else load_manifest(manifest_dir)
+    if previous is None:
+        generation, prefix = 0, "part"
+        # Shards and deltas of earlier runs are superseded by a full rebuild
+        for pattern in ("part-*", "delta-*"):
+            for path in glob.glob(os.path.join(glob.escape(out_dir), pattern)):
+                os.remove(path)
+    else:
+        generation = previous["generation"] + 1
+        prefix = f"delta-{generation:04d}"
+    workers = workers or os.cpu_count() or 1
+    reader = pd.read_csv(
+        source,
+        sep="\t",
+        usecols=lambda column: column in COLUMNS_TO_KEEP or column == KEY_COLUMN,
+        dtype={KEY_COLUMN: str},
+        chunksize=chunk_size,
+        nrows=limit,
+        low_memory=False,
+        on_bad_lines="skip",
+    )
+
+    stats = {
+        "rows_read": 0,
+        "rows_changed": 0,
+        "rows_written": 0,
+        "rows_deleted": 0,
+        "shards": 0,
+    }
+    manifest_parts = []
+    sample = []  # max-heap on priority via negation
+    tiebreak = itertools.count()
+    start = time.perf_counter()
+
+    def collect(future):
+        result = future.result()
+        for name in stats:
+            stats[name] += result[name]
+        # Kept with the chunk index so the manifest follows the dump's row order
+        manifest_parts.append((result["index"], result["manifest"]))
+        for priority, row in result["sample"]:
+            if len(sample) < sample_size:
+                heapq.heappush(sample, (-priority, next(tiebreak), row))
+            elif -sample[0][0] > priority:
+                heapq.heapreplace(sample, (-priority, next(tiebreak), row))
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(None if previous is None else manifest_dir,),
+    ) as executor:
+        pending = set()
+        for index, chunk in enumerate(reader):
+            # Bound the chunks in flight so memory stays flat on multi-GB dumps
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            pending.add(
+                executor.submit(
+                    process_chunk,
+                    index,
+                    chunk,
+                    out_dir,
+                    fmt,
+                    sample_size,
+                    seed,
+                    prefix,
+                )
+            )
+        for future in pending:
+            collect(future)
+
+    manifest_parts.sort(key=lambda part: part[0])
+    arrays = [
+        np.concatenate([part[1][i] for part in manifest_parts] or [np.empty(0, dtype)])
+        for i, dtype in enumerate((np.uint64, np.uint64, bool))
+    ]
+    if previous is not None:
+        # Products that had a row before but are gone from this dump
+        removed = previous["keys"][
+            previous["valid"] & ~np.isin(previous["keys"], arrays[0])
+        ]
+        if len(removed):
+            write_shard(tombstones(removed), out_dir, len(manifest_parts), fmt, prefix)
+            stats["rows_deleted"] += len(removed)
+            stats["shards"] += 1
+    write_manifest(manifest_dir, *arrays, generation)
+
+    elapsed = time.perf_counter() - start
+    rows = [row for _, _, row in sorted(sample, reverse=True)]
+    return {
+        **stats,
+        "generation": generation,
+        "seconds": elapsed,
+        "rows_per_second": stats["rows_read"] / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "sample": pd.DataFrame(rows, columns=list(COLUMN_NAMES.values())),
+    }
+
+
+class CalorieScaler:
+    """Min-max scaling whose parameters persist alongside the catalog.
+
+    Reusing the stored parameters keeps previously written values stable when
+    only a delta of new products is processed; values outside the fitted range
+    simply fall outside [0, 1].
+    """
+
+    def __init__(self, data_min, data_max):
+        self.data_min = float(data_min)
+        self.data_max = float(data_max)
+
+    @classmethod
+    def fit(cls, values):
+        return cls(values.min(), values.max())
+
+    def transform(self, values):
+        span = self.data_max - self.data_min
+        if span == 0:
+            return values * 0.0
+        return (values - self.data_min) / span
+
+    def to_dict(self):
+        return {"min": self.data_min, "max": self.data_max}
+
+    @classmethod
+    def load(cls, meta_path):
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as file:
+            scaler = json.load(file)["calories_scaler"]
+        return cls(scaler["min"], scaler["max"])
+
+
+def write_if_changed(path, text):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            if file.read() == text:
+                return False
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        file.write(text)
+    return True
+
+
+def build_catalog(sample, csv_path, json_path, meta_path=None, refit=False):
+    """Write the app catalog with raw kcal plus a derived CaloriesScaled column.
+
+    Scaler parameters are read from `meta_path` when present (unless `refit`)
+    and written back there.
+    """
+    # Append manually labeled data and normalize as the app expects
+    data = pd.concat([sample, MANUAL_FOODS], ignore_index=True)
+    for col in ["Food", "Category"]:
+        data[col] = normalize_names(data[col].astype(str))
+    data = dedupe_foods(data)
+
+    # Normalize numerical columns into a derived feature, keeping kcal intact
+    scaler = None if refit or meta_path is None else CalorieScaler.load(meta_path)
+    if scaler is None:
+        scaler = CalorieScaler.fit(data["Calories"])
+    data["CaloriesScaled"] = scaler.transform(data["Calories"])
+
+    # Unchanged files are left alone so a no-op refresh rewrites nothing
+    write_if_changed(csv_path, data.to_csv(index=False))
+    write_if_changed(json_path, data.to_json(orient="records", indent=4))
+    if meta_path is not None:
+        write_if_changed(
+            meta_path,
+            json.dumps(
+                {"calories_unit": "kcal/100g", "calories_scaler": scaler.to_dict()},
+                indent=4,
+            ),
+        )
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Clean the Open Food Facts dump into shards and a sample catalog"
+    )
+    parser.add_argument(
+        "source", nargs="?", default="en.openfoodfacts.org.products.csv"
+    )
+    parser.add_argument("--out-dir", default="openfoodfacts_shards")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--sample-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--limit", type=int, default=None, help="Read at most N rows")
+    parser.add_argument("--csv", default="cleaned_sampled_food_dataset.csv")
+    parser.add_argument("--json", default="cleaned_sampled_food_dataset.json")
+    parser.add_argument("--meta", default="cleaned_sampled_food_dataset.meta.json")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Reprocess every row instead of only rows changed since the last run",
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help="Refit the calorie scaler instead of reusing the stored parameters",
+    )
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("--format parquet requires pyarrow (pip install pyarrow)")
 
-# Normalize text columns
-text_columns = ["Food", "Category"]
-for col in text_columns:
-    data[col] = data[col].str.lower().str.strip()
+    print("Processing dataset in chunks...")
+    stats = prepare(
+        args.source,
+        args.out_dir,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        fmt=args.format,
+        sample_size=args.sample_size,
+        seed=args.seed,
+        limit=args.limit,
+        full=args.full,
+    )
+    rss = stats["peak_rss_mb"]
+    if stats["generation"]:
+        print(
+            f"Refresh {stats['generation']}: {stats['rows_changed']} of "
+            f"{stats['rows_read']} rows are new or changed, "
+            f"{stats['rows_deleted']} products deleted"
+        )
+    print(
+        f"Cleaned {stats['rows_written']} of {stats['rows_read']} rows into "
+        f"{stats['shards']} shards in '{args.out_dir}' "
+        f"({stats['rows_per_second']:.0f} rows/sec"
+        + (f", peak RSS {rss:.0f} MB)" if rss is not None else ")")
+    )
 
-# Normalize numerical columns
-scaler = MinMaxScaler()
-data[["Calories"]] = scaler.fit_transform(data[["Calories"]])
+    build_catalog(stats["sample"], args.csv, args.json, args.meta, refit=args.refit)
+    print(f"Cleaned dataset saved as '{args.csv}'")
+    print(f"Cleaned dataset saved as '{args.json}'")
 
-# Save preprocessed dataset as CSV
-cleaned_csv_path = "cleaned_sampled_food_dataset.csv"
-data.to_csv(cleaned_csv_path, index=False)
-print(f"Cleaned dataset saved as '{cleaned_csv_path}'")
 
-# Save preprocessed dataset as JSON
-cleaned_json_path = "cleaned_sampled_food_dataset.json"
-data.to_json(cleaned_json_path, orient="records", indent=4)
-print(f"Cleaned dataset saved as '{cleaned_json_path}'")
+if __name__ == "__main__":
+    main()
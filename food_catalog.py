@@ -0,0 +1,357 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from food_log import normalize_name
+
+# Names are indexed on at most this many characters for trigram search
+TRIGRAM_NAME_LENGTH = 64
+TRIGRAM_BLOCK_ROWS = 100_000
+# Trigrams this common add little to ranking and are skipped when possible
+MAX_POSTINGS = 50_000
+# Minimum trigram Jaccard similarity for a fuzzy match to a canonical name
+MIN_SIMILARITY = 0.5
+# Upper bound on candidate rows scored per fuzzy match
+MAX_CANDIDATES = 10_000
+# Candidates whose exact similarity is computed per fuzzy match
+MATCH_SHORTLIST = 64
+
+ARRAYS = [
+    "name_bytes",
+    "name_offsets",
+    "name_order",
+    "category_bytes",
+    "category_offsets",
+    "category_codes",
+    "category_rows",
+    "category_row_offsets",
+    "calories",
+    "trigram_keys",
+    "trigram_offsets",
+    "trigram_rows",
+]
+
+
+def encode_strings(values):
+    # One UTF-8 blob plus offsets; string i is blob[offsets[i]:offsets[i + 1]]
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def trigram_keys(names):
+    """Return (keys, rows) for the distinct trigrams of each name.
+
+    A leading space is added so word starts produce their own trigrams, and
+    three code points are packed into one uint64 key.
+    """
+    padded = np.array(
+        [" " + name[: TRIGRAM_NAME_LENGTH - 1] for name in names],
+        dtype=f"<U{TRIGRAM_NAME_LENGTH}",
+    )
+    chars = padded.view(np.uint32).reshape(len(names), TRIGRAM_NAME_LENGTH)
+    chars = chars.astype(np.uint64)
+    keys = (chars[:, :-2] << np.uint64(42)) | (chars[:, 1:-1] << np.uint64(21))
+    keys |= chars[:, 2:]
+    valid = chars[:, 2:] != 0
+    rows = np.arange(len(names), dtype=np.int32)[:, None]
+    rows = np.broadcast_to(rows, keys.shape)[valid]
+    return keys[valid], rows
+
+
+def query_trigrams(text):
+    if not text:
+        return np.array([], dtype=np.uint64)
+    keys, _ = trigram_keys([text])
+    return np.unique(keys)
+
+
+class FoodCatalog:
+    """Read-only columnar food catalog backed by memory-mapped .npy files.
+
+    Opening a catalog only maps the arrays; name, prefix, trigram and category
+    lookups then touch just the pages they need.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for name in ARRAYS:
+            array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            # Plain ndarray views of the maps skip memmap's per-index overhead
+            setattr(self, name, array.view(np.ndarray))
+        self.categories = [
+            bytes(self.category_bytes[start:end]).decode("utf-8")
+            for start, end in zip(self.category_offsets[:-1], self.category_offsets[1:])
+        ]
+        self.category_index = {
+            category: code for code, category in enumerate(self.categories)
+        }
+
+    def __len__(self):
+        return len(self.calories)
+
+    @classmethod
+    def build(cls, data, path):
+        """Write a catalog for a DataFrame with Food, Category and Calories columns."""
+        os.makedirs(path, exist_ok=True)
+        names = data["Food"].astype(str).tolist()
+        codes, categories = data["Category"].astype(str).factorize(sort=True)
+        categories = list(categories)
+
+        arrays = {}
+        arrays["name_bytes"], arrays["name_offsets"] = encode_strings(names)
+        # UTF-8 byte order matches code point order, so this sort drives prefix search
+        encoded = np.array([name.encode("utf-8") for name in names], dtype=object)
+        arrays["name_order"] = np.argsort(encoded, kind="stable").astype(np.int32)
+        arrays["category_bytes"], arrays["category_offsets"] = encode_strings(
+            categories
+        )
+        arrays["category_codes"] = codes.astype(np.int32)
+        arrays["category_rows"] = np.argsort(codes, kind="stable").astype(np.int32)
+        arrays["category_row_offsets"] = np.zeros(len(categories) + 1, np.int64)
+        np.cumsum(
+            np.bincount(codes, minlength=len(categories)),
+            out=arrays["category_row_offsets"][1:],
+        )
+        arrays["calories"] = data["Calories"].to_numpy(dtype=np.float32)
+
+        key_blocks, row_blocks = [], []
+        for start in range(0, len(names), TRIGRAM_BLOCK_ROWS):
+            keys, rows = trigram_keys(names[start : start + TRIGRAM_BLOCK_ROWS])
+            key_blocks.append(keys)
+            row_blocks.append(rows + start)
+        keys = np.concatenate(key_blocks or [np.array([], np.uint64)])
+        rows = np.concatenate(row_blocks or [np.array([], np.int32)])
+        # Sort into postings lists and drop repeated trigrams within a name
+        order = np.lexsort((rows, keys))
+        keys, rows = keys[order], rows[order]
+        distinct = np.ones(len(keys), dtype=bool)
+        distinct[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+        keys, rows = keys[distinct], rows[distinct]
+        new_key = np.ones(len(keys), dtype=bool)
+        new_key[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(new_key)
+        arrays["trigram_keys"] = keys[starts]
+        arrays["trigram_offsets"] = np.append(starts, len(keys)).astype(np.int64)
+        arrays["trigram_rows"] = rows.astype(np.int32)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        return cls(path)
+
+    @classmethod
+    def build_from_csv(cls, csv_path, path):
+        import pandas as pd
+
+        return cls.build(pd.read_csv(csv_path), path)
+
+    def name(self, row):
+        start, end = self.name_offsets[row], self.name_offsets[row + 1]
+        return bytes(self.name_bytes[start:end]).decode("utf-8")
+
+    def row(self, row):
+        return {
+            "food": self.name(row),
+            "category": self.categories[self.category_codes[row]],
+            "calories": float(self.calories[row]),
+        }
+
+    def _lower_bound(self, key):
+        # First position in name_order whose name is >= key (as UTF-8 bytes)
+        low, high = 0, len(self.name_order)
+        while low < high:
+            middle = (low + high) // 2
+            row = self.name_order[middle]
+            start, end = self.name_offsets[row], self.name_offsets[row + 1]
+            if bytes(self.name_bytes[start:end]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def rows_named(self, food):
+        """Return the rows of every entry named exactly `food`."""
+        key = food.encode("utf-8")
+        start = self._lower_bound(key)
+        end = start
+        while end < len(self.name_order) and self.name(self.name_order[end]) == food:
+            end += 1
+        return self.name_order[start:end]
+
+    def find(self, food):
+        """Return the row of the first entry named exactly `food`, or None."""
+        position = self._lower_bound(food.encode("utf-8"))
+        if position < len(self.name_order):
+            row = int(self.name_order[position])
+            if self.name(row) == food:
+                return row
+        return None
+
+    def lookup(self, food):
+        row = self.find(food)
+        return None if row is None else self.row(row)
+
+    def calories_for(self, food):
+        row = self.find(food)
+        return None if row is None else float(self.calories[row])
+
+    def prefix(self, prefix, limit=10):
+        """Autocomplete: distinct names starting with `prefix`, alphabetically."""
+        # Normalized like catalog names; a trailing space still marks a word end
+        normalized = normalize_name(prefix)
+        if normalized and prefix[-1:].isspace():
+            normalized += " "
+        key = normalized.encode("utf-8")
+        position = self._lower_bound(key)
+        results, seen = [], set()
+        while position < len(self.name_order) and len(results) < limit:
+            row = int(self.name_order[position])
+            name = self.name(row)
+            if not name.encode("utf-8").startswith(key):
+                break
+            if name not in seen:
+                seen.add(name)
+                results.append(self.row(row))
+            position += 1
+        return results
+
+    def search(self, text, limit=10):
+        """Substring-tolerant search ranked by the number of shared trigrams."""
+        keys = query_trigrams(normalize_name(text))
+        positions = np.searchsorted(self.trigram_keys, keys)
+        postings = []
+        for key, position in zip(keys, positions):
+            if position < len(self.trigram_keys) and self.trigram_keys[position] == key:
+                start = self.trigram_offsets[position]
+                end = self.trigram_offsets[position + 1]
+                postings.append(self.trigram_rows[start:end])
+        if not postings:
+            return []
+        selective = [rows for rows in postings if len(rows) <= MAX_POSTINGS]
+        rows, counts = np.unique(
+            np.concatenate(selective or [min(postings, key=len)]), return_counts=True
+        )
+        best = rows[np.argsort(-counts, kind="stable")]
+        results, seen = [], set()
+        for row in best:
+            name = self.name(row)
+            if name not in seen:
+                seen.add(name)
+                results.append(self.row(row))
+                if len(results) == limit:
+                    break
+        return results
+
+    def _postings(self, key):
+        position = np.searchsorted(self.trigram_keys, key)
+        if position < len(self.trigram_keys) and self.trigram_keys[position] == key:
+            start = self.trigram_offsets[position]
+            return self.trigram_rows[start : self.trigram_offsets[position + 1]]
+        return None
+
+    def match(self, text, min_similarity=MIN_SIMILARITY):
+        """Map free text to the closest catalog entry, or None.
+
+        Exact matches on the normalized name win. Otherwise candidates come
+        from the postings of the rarest query trigrams (prefix filtering: a
+        name reaching `min_similarity` must share one of them), the best
+        `MATCH_SHORTLIST` by shared rare trigrams are kept, and those are
+        ranked by exact trigram Jaccard similarity. Candidate generation stops
+        once `MAX_CANDIDATES` rows are collected, which keeps matching fast on
+        millions of names at the cost of exactness when every query trigram
+        is very common.
+        """
+        name = normalize_name(text)
+        row = self.find(name)
+        if row is not None:
+            return {**self.row(row), "similarity": 1.0}
+
+        keys = np.unique(query_trigrams(name))
+        postings = sorted(
+            (rows for rows in map(self._postings, keys) if rows is not None), key=len
+        )
+        required = len(keys) - int(np.ceil(min_similarity * len(keys))) + 1
+        if not postings or required <= 0:
+            return None
+        selected, total = [], 0
+        for rows in postings[:required]:
+            if selected and total + len(rows) > MAX_CANDIDATES:
+                break
+            selected.append(rows)
+            total += len(rows)
+        rows, counts = np.unique(np.concatenate(selected), return_counts=True)
+        if len(rows) > MATCH_SHORTLIST:
+            rows = rows[np.argpartition(-counts, MATCH_SHORTLIST - 1)[:MATCH_SHORTLIST]]
+        shortlist = np.sort(rows)
+
+        # Exact Jaccard over the distinct trigrams of each shortlisted name
+        names = [self.name(row) for row in shortlist]
+        name_keys, owners = trigram_keys(names)
+        order = np.lexsort((name_keys, owners))
+        name_keys, owners = name_keys[order], owners[order]
+        distinct = np.ones(len(name_keys), dtype=bool)
+        distinct[1:] = (name_keys[1:] != name_keys[:-1]) | (owners[1:] != owners[:-1])
+        name_keys, owners = name_keys[distinct], owners[distinct]
+        sizes = np.bincount(owners, minlength=len(names))
+        shared = np.bincount(owners[np.isin(name_keys, keys)], minlength=len(names))
+        similarity = shared / (len(keys) + sizes - shared)
+
+        best = int(np.argmax(similarity))
+        if similarity[best] < min_similarity:
+            return None
+        return {**self.row(shortlist[best]), "similarity": float(similarity[best])}
+
+    def canonical_name(self, text, min_similarity=MIN_SIMILARITY):
+        """Catalog name for `text`, or the normalized text when nothing matches."""
+        match = self.match(text, min_similarity)
+        return normalize_name(text) if match is None else match["food"]
+
+    def rows_in_category(self, category):
+        code = self.category_index.get(category)
+        if code is None:
+            return np.array([], dtype=np.int32)
+        start, end = (
+            self.category_row_offsets[code],
+            self.category_row_offsets[code + 1],
+        )
+        return self.category_rows[start:end]
+
+    def by_category(self, category, limit=None):
+        rows = self.rows_in_category(category)
+        if limit is not None:
+            rows = rows[:limit]
+        return [self.row(row) for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a food catalog")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a catalog from a cleaned CSV")
+    build.add_argument("csv", nargs="?", default="cleaned_sampled_food_dataset.csv")
+    build.add_argument("catalog", nargs="?", default="food_catalog")
+    search = commands.add_parser("search", help="Autocomplete a food name")
+    search.add_argument("text")
+    search.add_argument("--catalog", default="food_catalog")
+    search.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        catalog = FoodCatalog.build_from_csv(args.csv, args.catalog)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Built catalog of {len(catalog)} foods in '{args.catalog}' ({elapsed:.2f}s)"
+        )
+    else:
+        catalog = FoodCatalog(args.catalog)
+        for entry in catalog.prefix(args.text, args.limit) or catalog.search(
+            args.text, args.limit
+        ):
+            print(f"{entry['food']} ({entry['category']}): {entry['calories']:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,231 @@
+import csv
 import json
-import os
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from datetime import datetime
 
+import metrics
+from compact_log import MAX_CALORIES, CompactLog, date_ordinal
+from persistence import get_persister
+from storage import get_storage
+
+ENTRY_FIELDS = ["date", "food", "category", "calories"]
+# Batches larger than this rebuild the index instead of inserting one by one
+REINDEX_THRESHOLD = 1000
+
 
 class FoodLog:
-    def __init__(self, username, log=None):
+    def __init__(self, username, log=None, storage=None, catalog=None, persister=None):
         self.username = username
-        self.log_path = f"{self.username}_food_log.json"
+        # Optional FoodCatalog used to map free-text names to canonical foods
+        self.catalog = catalog
+        self.storage = get_storage() if storage is None else storage
+        # The backend's entry log (a LogJournal for the default JSON storage)
+        self.journal = self.storage.log(username)
+        # Callbacks notified with each appended entry, or None after a full reindex
+        self.listeners = []
+        # Entries appended with flush=False that are not yet in the journal
+        self.pending = []
+        # Guards `pending` and journal writes against a background flush
+        self._flush_lock = threading.RLock()
+        # Write-behind for interactive logging; None appends every entry at once
+        self.persister = get_persister() if persister is None else persister
 
+        # Entries are kept column-wise; iterating yields plain entry dicts
         if log is not None:
             # Use the provided log (useful for testing)
-            self.log = log
+            self.log = CompactLog(log)
         else:
-            self.log = self.load_log()
+            self.log = CompactLog(self.load_log())
+        self.rebuild_index()
 
+    @metrics.timed("food_log.load_log")
     def load_log(self):
-        if os.path.exists(self.log_path):
-            with open(self.log_path, "r") as file:
-                return json.load(file)
-        else:
-            return []
+        return self.journal.load()
 
+    @metrics.timed("food_log.save_log")
     def save_log(self):
-        with open(self.log_path, "w") as file:
-            json.dump(self.log, file)
+        # Full atomic rewrite; only needed after editing `self.log` in place
+        self.rebuild_index()
+        with self._flush_lock:
+            self.journal.compact(self.log)
+            self.pending = []
+
+    def rebuild_index(self):
+        # Log positions sorted by date ordinal, plus running calorie totals per day
+        dates = self.log.dates
+        self._positions = array("i", sorted(range(len(dates)), key=dates.__getitem__))
+        self._dates = array("i", [dates[position] for position in self._positions])
+        self._daily_calories = defaultdict(int)
+        for day, calories in zip(dates, self.log.calories):
+            self._daily_calories[day] += calories
+        for listener in self.listeners:
+            listener(None)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _index_entry(self, position, entry):
+        day = date_ordinal(entry["date"])
+        if not self._dates or day >= self._dates[-1]:
+            # Common case: entries arrive in date order
+            self._dates.append(day)
+            self._positions.append(position)
+        else:
+            index = bisect_right(self._dates, day)
+            self._dates.insert(index, day)
+            self._positions.insert(index, position)
+        self._daily_calories[day] += entry["calories"]
+
+    def append_entry(self, entry, flush=True):
+        if self.catalog is not None:
+            entry["food"] = self.catalog.canonical_name(entry["food"])
+        self.log.append(entry)
+        self._index_entry(len(self.log) - 1, entry)
+        with self._flush_lock:
+            self.pending.append(entry)
+        if flush:
+            self.flush()
+        for listener in self.listeners:
+            listener(entry)
+
+    def flush(self):
+        with self._flush_lock:
+            if self.pending:
+                self.journal.append(self.pending)
+                self.pending = []
+
+    def flush_later(self):
+        # Appends now, or batches with other entries when a persister is set
+        if self.persister is None:
+            self.flush()
+        else:
+            # Keyed per instance: each FoodLog holds its own pending entries
+            self.persister.mark_dirty(
+                (self.storage, "log", self.username, id(self)), self.flush
+            )
+
+    def add_entry(self, food, category, calories, date_str=None, flush=True):
+        # Non-interactive counterpart of log_food; raises ValueError on bad input
+        entry = make_entry(food, category, calories, date_str)
+        self.append_entry(entry, flush=flush)
+        return entry
+
+    @metrics.timed("food_log.import_entries")
+    def import_entries(self, source, fmt=None):
+        """Bulk-append entries from a DataFrame, CSV/JSONL path or file, or dicts.
+
+        Rows are validated and normalized column-wise; invalid rows and
+        duplicates of (date, food, calories) — within the batch or already in
+        the log — are skipped. The whole batch is written to the journal with a
+        single append and fsync. Returns counts of imported, duplicate and
+        invalid rows.
+        """
+        import pandas as pd
+
+        batch = _read_entries(source, fmt)
+        missing = [field for field in ENTRY_FIELDS if field not in batch.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        total = len(batch)
+
+        batch = batch[ENTRY_FIELDS].copy()
+        for field in ("food", "category"):
+            batch[field] = normalize_names(batch[field].astype("string"))
+        calories = pd.to_numeric(batch["calories"], errors="coerce")
+        dates = pd.to_datetime(batch["date"], format="%Y-%m-%d", errors="coerce")
+        valid = (
+            batch["food"].fillna("").ne("")
+            & batch["category"].fillna("").ne("")
+            & calories.gt(0)
+            & calories.lt(MAX_CALORIES)
+            & calories.eq(calories.round())
+            & dates.notna()
+        )
+        batch = batch[valid]
+        batch["calories"] = calories[valid].astype("int64")
+        batch["date"] = dates[valid].dt.strftime("%Y-%m-%d")
+        invalid = total - len(batch)
+        if self.catalog is not None:
+            # One catalog match per distinct name rather than per row
+            canonical = {
+                name: self.catalog.canonical_name(name)
+                for name in batch["food"].unique()
+            }
+            batch["food"] = batch["food"].map(canonical)
+
+        keys = ["date", "food", "calories"]
+        batch = batch.drop_duplicates(subset=keys)
+        if self.log:
+            existing = {
+                (entry["date"], entry["food"], entry["calories"]) for entry in self.log
+            }
+            seen = pd.MultiIndex.from_frame(batch[keys]).isin(existing)
+            batch = batch[~seen]
+        duplicates = total - invalid - len(batch)
+
+        columns = [batch[field].tolist() for field in ENTRY_FIELDS]
+        entries = [
+            {"date": date, "food": food, "category": category, "calories": kcal}
+            for date, food, category, kcal in zip(*columns)
+        ]
+        with self._flush_lock:
+            self.flush()
+            if entries:
+                # Serialized column-wise by pandas rather than one json.dumps per entry
+                self.journal.append_lines(
+                    batch.to_json(orient="records", lines=True).rstrip("\n") + "\n"
+                )
+        start = len(self.log)
+        self.log.extend(entries)
+        if len(entries) > REINDEX_THRESHOLD:
+            self.rebuild_index()
+        else:
+            for position, entry in enumerate(entries, start):
+                self._index_entry(position, entry)
+                for listener in self.listeners:
+                    listener(entry)
+        return {"imported": len(entries), "duplicates": duplicates, "invalid": invalid}
+
+    def iter_export(self, fmt="jsonl", start_date=None, end_date=None):
+        """Yield the log (optionally a date range) as JSONL or CSV lines."""
+        entries = self.get_logs_in_date_range(start_date, end_date)
+        if fmt == "jsonl":
+            for entry in entries:
+                yield json.dumps(entry) + "\n"
+        elif fmt == "csv":
+            buffer = _LineBuffer()
+            writer = csv.DictWriter(buffer, fieldnames=ENTRY_FIELDS)
+            writer.writeheader()
+            yield buffer.pop()
+            for entry in entries:
+                writer.writerow({field: entry[field] for field in ENTRY_FIELDS})
+                yield buffer.pop()
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+
+    def export_entries(self, destination, fmt=None, start_date=None, end_date=None):
+        # Streams to a path or an open text file; returns the number of entries
+        if isinstance(destination, str):
+            fmt = fmt or ("csv" if destination.endswith(".csv") else "jsonl")
+            with open(destination, "w", newline="") as file:
+                return self.export_entries(file, fmt, start_date, end_date)
+        fmt = fmt or "jsonl"
+        lines = 0
+        for line in self.iter_export(fmt, start_date, end_date):
+            destination.write(line)
+            lines += 1
+        # The CSV header is not an entry
+        return lines - 1 if fmt == "csv" else lines
 
     def log_food(self, user_profile):
         date_str = datetime.now().strftime("%Y-%m-%d")
         print("\nLogging Food Intake:")
-        food_name = input("Enter food name: ").strip().lower()
-        category = input("Enter food category: ").strip().lower()
+        food_name = normalize_name(input("Enter food name: "))
+        category = normalize_name(input("Enter food category: "))
         calories = int(input("Enter calories (kcal): "))
 
         # Validate input
@@ -44,14 +240,99 @@ class FoodLog:
             "calories": calories,
         }
 
-        # Append to logs and save
-        self.log.append(entry)
-        self.save_log()
+        # Append to logs and journal
+        self.append_entry(entry, flush=False)
+        self.flush_later()
         print(f"Successfully logged {calories} kcal for {food_name}.")
 
     def get_daily_calories(self, date_str):
-        return sum(entry["calories"] for entry in self.log if entry["date"] == date_str)
+        return self._daily_calories.get(_day(date_str), 0)
 
     def get_logs_in_date_range(self, start_date=None, end_date=None):
-        # For simplicity, return all logs (expand as needed)
-        return self.log
+        # Inclusive on both ends; entries are returned in date order
+        low = 0 if start_date is None else bisect_left(self._dates, _day(start_date))
+        high = (
+            len(self._dates)
+            if end_date is None
+            else bisect_right(self._dates, _day(end_date))
+        )
+        return [self.log[position] for position in self._positions[low:high]]
+
+
+def normalize_name(text):
+    # NFKC, lower case and single spaces, so "Greek  Yogurt " == "greek yogurt"
+    return " ".join(unicodedata.normalize("NFKC", str(text)).lower().split())
+
+
+def normalize_names(series):
+    """Vectorized `normalize_name` for a pandas string Series."""
+    return (
+        series.str.normalize("NFKC")
+        .str.lower()
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def make_entry(food, category, calories, date_str=None):
+    food = normalize_name(food)
+    category = normalize_name(category)
+    calories = int(calories)
+    if not food or not category or calories <= 0:
+        raise ValueError("Food, category and positive calories are required")
+    if calories > MAX_CALORIES:
+        raise ValueError(f"Calories must be at most {MAX_CALORIES}")
+    if date_str is None:
+        date_str = datetime.now().strftime("%Y-%m-%d")
+    else:
+        # Validates the format as well as normalizing date objects
+        date_str = datetime.strptime(_date_key(date_str), "%Y-%m-%d").strftime(
+            "%Y-%m-%d"
+        )
+    return {"date": date_str, "food": food, "category": category, "calories": calories}
+
+
+class _LineBuffer:
+    # Minimal file-like sink so csv.writer output can be yielded line by line
+    def __init__(self):
+        self.data = []
+
+    def write(self, text):
+        self.data.append(text)
+
+    def pop(self):
+        text = "".join(self.data)
+        self.data = []
+        return text
+
+
+def _read_entries(source, fmt=None):
+    import pandas as pd
+
+    if isinstance(source, pd.DataFrame):
+        return source
+    if isinstance(source, str):
+        fmt = fmt or ("csv" if source.endswith(".csv") else "jsonl")
+    if fmt == "csv":
+        return pd.read_csv(source, dtype={"date": str})
+    if fmt == "jsonl":
+        return pd.read_json(
+            source, lines=True, dtype={"date": str}, convert_dates=False
+        )
+    if hasattr(source, "read"):
+        raise ValueError("Specify fmt='csv' or fmt='jsonl' for file objects")
+    return pd.DataFrame(list(source), columns=ENTRY_FIELDS)
+
+
+def _date_key(value):
+    # Accept `date`/`datetime` objects as well as "YYYY-MM-DD" strings
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def _day(value):
+    # Day ordinal of a `date`/`datetime` or a "YYYY-MM-DD" string
+    if hasattr(value, "toordinal"):
+        return value.toordinal()
+    return date_ordinal(value)
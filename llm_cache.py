@@ -0,0 +1,148 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+
+def normalize_messages(messages):
+    # Collapse whitespace so re-indented prompt templates hash identically
+    return [
+        {"role": message["role"], "content": " ".join(message["content"].split())}
+        for message in messages
+    ]
+
+
+def request_key(model, messages, max_tokens):
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": normalize_messages(messages),
+            "max_tokens": max_tokens,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent SQLite cache of chat completions with TTL and LRU eviction.
+
+    Concurrent `get_or_create` calls for the same request share a single
+    in-flight call to `create`.
+    """
+
+    def __init__(self, path="llm_cache.sqlite3", ttl=24 * 60 * 60, max_entries=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            content, created = row
+            if now - created > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            self._connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            return content
+
+    def put(self, key, content):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, content, now, now),
+            )
+            # Evict the least recently used entries beyond the size bound
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+
+    def get_or_create(self, model, messages, max_tokens, create):
+        key = request_key(model, messages, max_tokens)
+        content = self.get(key)
+        if content is not None:
+            metrics.increment("llm_cache.hits")
+            return content
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not owner:
+            metrics.increment("llm_cache.coalesced")
+            return future.result()
+
+        try:
+            # Another owner may have finished between our miss and registering
+            content = self.get(key)
+            if content is None:
+                metrics.increment("llm_cache.misses")
+                content = create()
+                self.put(key, content)
+            future.set_result(content)
+            return content
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stream(self, model, messages, max_tokens, create_stream):
+        """Generator counterpart of `get_or_create` for streamed completions.
+
+        A cached response is yielded whole; otherwise chunks pass through as
+        they arrive and the joined text is stored once the stream completes.
+        Streams are not coalesced.
+        """
+        key = request_key(model, messages, max_tokens)
+        content = self.get(key)
+        if content is not None:
+            metrics.increment("llm_cache.hits")
+            yield content
+            return
+
+        metrics.increment("llm_cache.misses")
+        parts = []
+        for chunk in create_stream():
+            parts.append(chunk)
+            yield chunk
+        self.put(key, "".join(parts))
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,257 @@
+import contextlib
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import metrics
+from prompts import estimate_tokens
+
+MODEL = "gpt-4"
+PROVIDER_ENV = "ASSISTANT_LLM_PROVIDER"
+
+
+class ProviderError(Exception):
+    """A chat provider could not produce a completion."""
+
+
+class RetryableProviderError(ProviderError):
+    """A transient provider failure (rate limit, timeout, connection) worth retrying."""
+
+
+class ChatProvider(ABC):
+    """Interface for chat completion backends used by `Analysis`.
+
+    `stream` yields the completion in text chunks as they are produced;
+    backends that cannot stream yield the whole completion once.
+    """
+
+    model = None
+
+    @abstractmethod
+    def complete(self, messages, max_tokens, timeout=None): ...
+
+    def stream(self, messages, max_tokens, timeout=None):
+        yield self.complete(messages, max_tokens, timeout)
+
+
+class OpenAIProvider(ChatProvider):
+    """OpenAI chat completions.
+
+    The SDK and `.env` configuration are loaded on the first completion, so
+    importing this module (and everything that only logs food) stays cheap.
+    """
+
+    def __init__(self, model=MODEL):
+        self.model = model
+        self._openai = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        with self._lock:
+            if self._openai is None:
+                import openai
+                from dotenv import load_dotenv
+
+                load_dotenv()
+                openai.api_key = os.getenv("OPENAI_API_KEY")
+                self._openai = openai
+        return self._openai
+
+    def _request(self, openai, messages, max_tokens, timeout, **options):
+        if timeout is not None:
+            options["request_timeout"] = timeout
+        return openai.ChatCompletion.create(
+            model=self.model, messages=messages, max_tokens=max_tokens, **options
+        )
+
+    def complete(self, messages, max_tokens, timeout=None):
+        openai = self._client()
+        metrics.increment("llm.requests")
+        with _provider_errors(openai):
+            with metrics.timer("llm.request"):
+                response = self._request(openai, messages, max_tokens, timeout)
+        content = response.choices[0].message["content"]
+        if metrics.enabled():
+            record_tokens(messages, content, getattr(response, "usage", None))
+        return content
+
+    def stream(self, messages, max_tokens, timeout=None):
+        openai = self._client()
+        metrics.increment("llm.requests")
+        start = time.perf_counter()
+        parts = []
+        with _provider_errors(openai):
+            response = self._request(openai, messages, max_tokens, timeout, stream=True)
+            for chunk in response:
+                text = chunk.choices[0].delta.get("content")
+                if not text:
+                    continue
+                if not parts:
+                    metrics.observe("llm.first_chunk", time.perf_counter() - start)
+                parts.append(text)
+                yield text
+        metrics.observe("llm.request", time.perf_counter() - start)
+        if metrics.enabled():
+            record_tokens(messages, "".join(parts))
+
+
+class LocalProvider(ChatProvider):
+    """Deterministic rule-based schedules; no network, SDK or API key.
+
+    Reads the profile figures out of the gym or eating prompt and fills
+    templates, so the same request always gets the same text. `delay` is
+    slept before each streamed line to mimic a remote model in load tests.
+    """
+
+    model = "local-rules"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def complete(self, messages, max_tokens, timeout=None):
+        return "".join(self.stream(messages, max_tokens, timeout))
+
+    def stream(self, messages, max_tokens, timeout=None):
+        metrics.increment("llm.requests")
+        text = " ".join(message["content"] for message in messages)
+        if "nutrition" in messages[0]["content"].lower():
+            lines = _eating_lines(text)
+        else:
+            lines = _gym_lines(text)
+        modification = re.search(r"Adjust as follows: (.+)", text)
+        if modification:
+            lines.append(f"Adjusted for: {modification.group(1).strip()}")
+
+        tokens = 0
+        parts = []
+        for line in lines:
+            tokens += estimate_tokens(line)
+            if tokens > max_tokens:
+                break
+            if self.delay:
+                time.sleep(self.delay)
+            parts.append(line + "\n")
+            yield line + "\n"
+        if metrics.enabled():
+            record_tokens(messages, "".join(parts))
+
+
+def _profile_number(text, *labels, default):
+    # Matches both the dict repr ('weight': 70.0) and "Weight: 70.0 kg"
+    for label in labels:
+        found = re.search(rf"{label}'?:\s*(-?[\d.]+)", text, re.IGNORECASE)
+        if found:
+            return float(found.group(1))
+    return default
+
+
+GYM_DAYS = {
+    "strength": [
+        "Monday: Full-body strength - squats 3x10, push-ups 3x12, rows 3x10",
+        "Tuesday: 30 minutes of brisk walking or cycling",
+        "Wednesday: Upper body - presses 3x10, pull-downs 3x10, planks 3x40 s",
+        "Thursday: Rest or 20 minutes of mobility work",
+        "Friday: Lower body - lunges 3x10, deadlifts 3x8, calf raises 3x15",
+        "Saturday: 40 minutes of steady cardio",
+        "Sunday: Rest",
+    ],
+    "low_impact": [
+        "Monday: 30 minutes of walking and light resistance bands",
+        "Tuesday: 25 minutes of swimming or stationary cycling",
+        "Wednesday: Chair squats 3x10, wall push-ups 3x10, balance work",
+        "Thursday: Rest or gentle stretching",
+        "Friday: 30 minutes of walking at a comfortable pace",
+        "Saturday: Light full-body circuit, 2 rounds",
+        "Sunday: Rest",
+    ],
+}
+
+# Meal name, share of the daily limit and candidate foods in order of preference
+MEALS = [
+    ("08:00 Breakfast", 0.25, ["oatmeal with banana", "greek yogurt with berries"]),
+    ("12:30 Lunch", 0.35, ["grilled chicken salad", "lentil soup with bread"]),
+    ("16:00 Snack", 0.10, ["apple with almonds", "carrots with hummus"]),
+    ("19:00 Dinner", 0.30, ["salmon with brown rice", "tofu stir-fry with rice"]),
+]
+
+
+def _gym_lines(text):
+    age = _profile_number(text, "age", default=30)
+    weight = _profile_number(text, "weight", default=70)
+    height = _profile_number(text, "height", default=175)
+    bmi = weight / (height / 100) ** 2 if height > 0 else 0
+    plan = "low_impact" if age >= 55 or bmi >= 30 else "strength"
+    return [f"Weekly gym schedule (BMI {bmi:.1f}, age {age:.0f}):", *GYM_DAYS[plan]]
+
+
+def _eating_lines(text):
+    limit = _profile_number(
+        text, "daily calorie limit", "daily_calorie_limit", default=2000
+    )
+    blocked = re.search(r"Blocked Foods: ([^\n]*)", text)
+    blocked = [
+        name.strip().lower()
+        for name in (blocked.group(1).split(",") if blocked else [])
+        if name.strip()
+    ]
+    lines = [f"Eating schedule for {limit:.0f} kcal:"]
+    for meal, share, foods in MEALS:
+        allowed = [food for food in foods if not any(name in food for name in blocked)]
+        food = allowed[0] if allowed else "a meal of your choice"
+        lines.append(f"{meal} ({limit * share:.0f} kcal): {food}")
+    return lines
+
+
+@contextlib.contextmanager
+def _provider_errors(openai):
+    # Translates OpenAI SDK errors into provider errors, counting them
+    retryable = (
+        openai.error.APIConnectionError,
+        openai.error.APIError,
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+    )
+    try:
+        yield
+    except retryable as error:
+        metrics.increment("llm.errors")
+        raise RetryableProviderError(f"{type(error).__name__}: {error}") from error
+    except openai.error.OpenAIError as error:
+        metrics.increment("llm.errors")
+        raise ProviderError(f"{type(error).__name__}: {error}") from error
+
+
+def record_tokens(messages, content, usage=None):
+    # Reported usage when the API returns it, otherwise local estimates
+    if usage:
+        prompt_tokens = usage["prompt_tokens"]
+        completion_tokens = usage["completion_tokens"]
+    else:
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        completion_tokens = estimate_tokens(content)
+    metrics.increment("llm.prompt_tokens", prompt_tokens)
+    metrics.increment("llm.completion_tokens", completion_tokens)
+
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+
+def open_provider(name):
+    if name == "openai":
+        return OpenAIProvider()
+    if name == "local":
+        return LocalProvider()
+    raise ValueError(f"Unknown chat provider: {name}")
+
+
+def default_provider():
+    # Chosen by ASSISTANT_LLM_PROVIDER ("openai" or "local")
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = open_provider(os.getenv(PROVIDER_ENV) or "openai")
+    return _default_provider
@@ -1,9 +1,24 @@
-from user import User
-from food_log import FoodLog
-from analysis import Analysis
+import argparse
+import json
+import sys
 
+import metrics
+
+from user import User, UserNotFound, load_user, new_profile
+from food_log import FoodLog, make_entry
+from storage import get_storage
+from llm_provider import ProviderError, open_provider
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_NOT_FOUND = 3
+EXIT_UNAVAILABLE = 4
+
+
+def interactive():
+    # Analysis is only needed by the menu and a few subcommands
+    from analysis import Analysis
 
-def main():
     print("Welcome to Eating Habits and Fitness Assistant!")
     username = input("Enter your username: ").strip()
     user = User(username)
@@ -47,5 +62,250 @@ def main():
             print("Invalid option. Please try again.")
 
 
+def cmd_log(args):
+    storage = get_storage()
+    if not storage.profile_exists(args.user):
+        raise UserNotFound(args.user)
+    # Appends to the log without reading it
+    entry = make_entry(args.food, args.category, args.calories, args.date)
+    storage.append_entries(args.user, [entry])
+    return entry
+
+
+def cmd_status(args):
+    from analysis import calorie_status
+
+    user = load_user(args.user)
+    return calorie_status(FoodLog(args.user), user.profile, args.date)
+
+
+def cmd_report(args):
+    from analysis import Analysis
+
+    if not get_storage().profile_exists(args.user):
+        raise UserNotFound(args.user)
+    analysis = Analysis(FoodLog(args.user))
+    return analysis.get_report(end_date=args.end_date, days=args.days)
+
+
+def cmd_profile_set(args):
+    fields = {
+        name: getattr(args, name)
+        for name in ("weight", "height", "age", "daily_calorie_limit")
+        if getattr(args, name) is not None
+    }
+    try:
+        user = load_user(args.user)
+        user.set_fields(**fields)
+    except UserNotFound:
+        if len(fields) < 4:
+            raise ValueError(
+                "A new profile needs --weight, --height, --age and "
+                "--daily-calorie-limit"
+            )
+        user = User(args.user, profile=new_profile(**fields))
+    user.save_profile()
+    return user.profile
+
+
+def cmd_block_add(args):
+    user = load_user(args.user)
+    kind = "foods" if args.kind == "food" else "categories"
+    user.block(kind, args.name)
+    user.save_profile()
+    return user.profile["block_list"]
+
+
+def cmd_schedule(args):
+    import asyncio
+
+    from analysis import Analysis
+
+    user = load_user(args.user)
+    recommender = None
+    if args.catalog:
+        from food_catalog import FoodCatalog
+        from recommend import Recommender
+
+        recommender = Recommender(FoodCatalog(args.catalog))
+    food_log = FoodLog(args.user) if args.kind == "eating" else FoodLog(args.user, [])
+    provider = open_provider(args.provider) if args.provider else None
+    analysis = Analysis(food_log, recommender=recommender, provider=provider)
+
+    if args.offline:
+        if args.kind != "eating":
+            raise ValueError("Only eating schedules can be generated offline")
+        schedule = analysis.offline_eating_schedule(user.profile)
+        return {"kind": args.kind, "source": "offline", "schedule": schedule}
+
+    if args.stream:
+        from analysis import print_stream
+
+        stream = (
+            analysis.stream_gym_schedule
+            if args.kind == "gym"
+            else analysis.stream_eating_schedule
+        )
+        try:
+            print_stream(stream(user.profile, args.modification, timeout=args.timeout))
+        except ProviderError:
+            if args.kind != "eating" or recommender is None:
+                raise
+            print(analysis.offline_eating_schedule(user.profile))
+        # The text is already on stdout
+        return None
+
+    generate = (
+        analysis.agenerate_gym_schedule
+        if args.kind == "gym"
+        else analysis.agenerate_eating_schedule
+    )
+    try:
+        try:
+            schedule = asyncio.run(
+                generate(user.profile, args.modification, timeout=args.timeout)
+            )
+        except asyncio.TimeoutError as error:
+            raise ProviderError(f"Timed out after {args.timeout} s") from error
+    except ProviderError:
+        if args.kind != "eating" or recommender is None:
+            raise
+        schedule = analysis.offline_eating_schedule(user.profile)
+        return {"kind": args.kind, "source": "offline", "schedule": schedule}
+    return {"kind": args.kind, "source": "llm", "schedule": schedule}
+
+
+def cmd_import(args):
+    if not get_storage().profile_exists(args.user):
+        raise UserNotFound(args.user)
+    return FoodLog(args.user).import_entries(args.source, fmt=args.format)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Eating Habits and Fitness Assistant. "
+        "Run without arguments for the interactive menu."
+    )
+    parser.add_argument("-u", "--user", required=True, help="Username")
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write timers and counters as JSON (Prometheus text for .prom)",
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE", help="Write cProfile stats for the command"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    log = commands.add_parser("log", help="Log a food entry")
+    log.add_argument("food")
+    log.add_argument("category")
+    log.add_argument("calories", type=int)
+    log.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    log.set_defaults(handler=cmd_log)
+
+    status = commands.add_parser("status", help="Calorie status for a day")
+    status.add_argument("--date", help="YYYY-MM-DD (default: today)")
+    status.set_defaults(handler=cmd_status)
+
+    report = commands.add_parser("report", help="Category and food report")
+    report.add_argument("--end-date", help="YYYY-MM-DD (default: today)")
+    report.add_argument("--days", type=int, default=7)
+    report.set_defaults(handler=cmd_report)
+
+    profile = commands.add_parser("profile", help="Manage the profile")
+    profile_commands = profile.add_subparsers(dest="action", required=True)
+    profile_set = profile_commands.add_parser(
+        "set", help="Create the profile or update fields"
+    )
+    profile_set.add_argument("--weight", type=float)
+    profile_set.add_argument("--height", type=float)
+    profile_set.add_argument("--age", type=int)
+    profile_set.add_argument("--daily-calorie-limit", type=int)
+    profile_set.set_defaults(handler=cmd_profile_set)
+
+    block = commands.add_parser("block", help="Manage the block list")
+    block_commands = block.add_subparsers(dest="action", required=True)
+    block_add = block_commands.add_parser("add", help="Block a food or category")
+    block_add.add_argument("kind", choices=["food", "category"])
+    block_add.add_argument("name")
+    block_add.set_defaults(handler=cmd_block_add)
+
+    schedule = commands.add_parser("schedule", help="Generate a schedule")
+    schedule.add_argument("kind", choices=["gym", "eating"])
+    schedule.add_argument("--modification")
+    schedule.add_argument("--timeout", type=float, default=60.0)
+    schedule.add_argument(
+        "--catalog", help="Food catalog directory for the offline meal planner"
+    )
+    schedule.add_argument(
+        "--offline", action="store_true", help="Use the meal planner, not the LLM"
+    )
+    schedule.add_argument(
+        "--provider",
+        choices=["openai", "local"],
+        help="Chat provider (default: $ASSISTANT_LLM_PROVIDER or openai)",
+    )
+    schedule.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the schedule as plain text while it is generated",
+    )
+    schedule.set_defaults(handler=cmd_schedule)
+
+    import_ = commands.add_parser("import", help="Bulk-import a CSV or JSONL file")
+    import_.add_argument("source")
+    import_.add_argument("--format", choices=["csv", "jsonl"])
+    import_.set_defaults(handler=cmd_import)
+    return parser
+
+
+def run(argv):
+    """Run one subcommand, print its JSON result and return an exit code."""
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    profiler = None
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        result = args.handler(args)
+    except UserNotFound as error:
+        code, message = EXIT_NOT_FOUND, f"User not found: {error}"
+    except ProviderError as error:
+        code, message = EXIT_UNAVAILABLE, str(error)
+    except (ValueError, OSError) as error:
+        code, message = EXIT_ERROR, str(error)
+    else:
+        code, message = EXIT_OK, None
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.metrics:
+            with open(args.metrics, "w") as file:
+                prometheus = args.metrics.endswith(".prom")
+                file.write(metrics.to_prometheus() if prometheus else metrics.to_json())
+
+    if code == EXIT_OK:
+        if result is not None:
+            print(json.dumps(result))
+    else:
+        print(json.dumps({"error": message}), file=sys.stderr)
+    return code
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        interactive()
+        return EXIT_OK
+    return run(argv)
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
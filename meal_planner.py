@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from recommend import PORTIONS
+
+# Share of the daily calorie limit each meal aims for
+MEALS = [("breakfast", 0.25), ("lunch", 0.35), ("dinner", 0.30), ("snack", 0.10)]
+# Penalties, in kcal-equivalents, that steer the solver towards variety
+REPEAT_CATEGORY_PENALTY = 150.0
+RECENT_CATEGORY_PENALTY = 50.0
+
+
+def _spread(rows, calories, limit):
+    # Deterministic subset covering the whole calorie range evenly
+    if len(rows) <= limit:
+        return rows
+    order = np.argsort(calories, kind="stable")
+    picks = np.linspace(0, len(rows) - 1, limit).astype(np.int64)
+    return rows[order[picks]]
+
+
+def plan_day(
+    recommender,
+    user_profile,
+    food_log=None,
+    today=None,
+    history_days=7,
+    max_candidates=2000,
+    max_iterations=20,
+):
+    """Build a one-day meal plan from the catalog without calling an LLM.
+
+    A greedy pass picks, per meal, the food and portion closest to that
+    meal's calorie share; a local search then swaps single meals while that
+    brings the total closer to `daily_calorie_limit` without exceeding it.
+    Blocked foods/categories are excluded, foods eaten in the last
+    `history_days` are skipped when alternatives exist, and repeated or
+    recently eaten categories are penalized.
+    """
+    catalog = recommender.catalog
+    limit = user_profile["daily_calorie_limit"]
+    rows = recommender.candidates(user_profile, limit)
+
+    recent_categories = set()
+    if food_log is not None:
+        if today is None:
+            today = datetime.now()
+        recent = food_log.get_logs_in_date_range(
+            today - timedelta(days=history_days), today
+        )
+        recent_categories = {entry["category"] for entry in recent}
+        recent_rows = [catalog.rows_named(entry["food"]) for entry in recent]
+        if recent_rows:
+            fresh = rows[~np.isin(rows, np.concatenate(recent_rows))]
+            if len(fresh) >= len(MEALS):
+                rows = fresh
+    if not len(rows):
+        return {"meals": [], "total_calories": 0, "daily_calorie_limit": limit}
+
+    rows = _spread(rows, np.asarray(catalog.calories[rows]), max_candidates)
+    calories = np.asarray(catalog.calories[rows], dtype=np.float64)
+    codes = np.asarray(catalog.category_codes[rows])
+    recent_codes = [
+        catalog.category_index[category]
+        for category in recent_categories
+        if category in catalog.category_index
+    ]
+    base_penalty = np.where(np.isin(codes, recent_codes), RECENT_CATEGORY_PENALTY, 0.0)
+    # kcal for every (candidate, portion) pair
+    options = calories[:, None] * PORTIONS[None, :]
+
+    def best_option(target, taken_codes, taken_rows, budget):
+        penalty = base_penalty + np.where(
+            np.isin(codes, taken_codes), REPEAT_CATEGORY_PENALTY, 0.0
+        )
+        cost = np.abs(options - target) + penalty[:, None]
+        cost[np.isin(rows, taken_rows)] = np.inf
+        cost[options > budget] = np.inf
+        index = np.argmin(cost)
+        if not np.isfinite(cost.flat[index]):
+            return None
+        return np.unravel_index(index, cost.shape)
+
+    # Greedy construction
+    chosen = []
+    for meal, share in MEALS:
+        budget = limit - sum(options[choice] for choice in chosen)
+        choice = best_option(
+            limit * share,
+            [codes[i] for i, _ in chosen],
+            [rows[i] for i, _ in chosen],
+            budget,
+        )
+        if choice is None:
+            break
+        chosen.append(choice)
+
+    # Local search: re-pick one meal at a time while the total improves
+    for _ in range(max_iterations):
+        improved = False
+        for position in range(len(chosen)):
+            others = chosen[:position] + chosen[position + 1 :]
+            other_total = sum(options[choice] for choice in others)
+            choice = best_option(
+                limit - other_total,
+                [codes[i] for i, _ in others],
+                [rows[i] for i, _ in others],
+                limit - other_total,
+            )
+            if choice is not None and options[choice] > options[chosen[position]]:
+                chosen[position] = choice
+                improved = True
+        if not improved:
+            break
+
+    meals = []
+    for (meal, _), (index, portion) in zip(MEALS, chosen):
+        entry = catalog.row(rows[index])
+        meals.append(
+            {
+                "meal": meal,
+                "food": entry["food"],
+                "category": entry["category"],
+                "grams": int(PORTIONS[portion] * 100),
+                "calories": int(options[index, portion]),
+            }
+        )
+    return {
+        "meals": meals,
+        "total_calories": sum(meal["calories"] for meal in meals),
+        "daily_calorie_limit": limit,
+    }
+
+
+def format_plan(plan):
+    lines = [
+        f"{meal['meal'].capitalize()}: {meal['food']} ({meal['grams']} g, "
+        f"{meal['calories']} kcal)"
+        for meal in plan["meals"]
+    ]
+    lines.append(
+        f"Total: {plan['total_calories']} of {plan['daily_calorie_limit']} kcal"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,157 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+METRICS_ENV = "ASSISTANT_METRICS"
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Thread-safe counters and timers.
+
+    While disabled every call returns immediately, so instrumented hot paths
+    pay one attribute check.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        # name -> [count, total seconds, max seconds]
+        self.timers = {}
+
+    def increment(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def timed(self, name):
+        """Decorator form of `timer`."""
+
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorate
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {
+                    name: {
+                        "count": count,
+                        "total_seconds": total,
+                        "mean_seconds": total / count,
+                        "max_seconds": longest,
+                    }
+                    for name, (count, total, longest) in self.timers.items()
+                },
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4, sort_keys=True)
+
+    def to_prometheus(self, prefix="assistant"):
+        """Prometheus text exposition format (counters and summaries)."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = _metric_name(prefix, name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            value = int(value) if value.is_integer() else value
+            lines.append(f"{metric} {value}")
+        for name, timer in sorted(snapshot["timers"].items()):
+            metric = _metric_name(prefix, name) + "_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {timer['count']}")
+            lines.append(f"{metric}_sum {timer['total_seconds']:.9f}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.append(f"{metric}_max {timer['max_seconds']:.9f}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(prefix, name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
+
+
+# Process-wide registry used by the instrumented modules
+metrics = Metrics(enabled=bool(os.getenv(METRICS_ENV)))
+
+
+def enabled():
+    return metrics.enabled
+
+
+def enable(on=True):
+    metrics.enabled = on
+
+
+increment = metrics.increment
+observe = metrics.observe
+timer = metrics.timer
+timed = metrics.timed
+reset = metrics.reset
+snapshot = metrics.snapshot
+to_json = metrics.to_json
+to_prometheus = metrics.to_prometheus
@@ -0,0 +1,135 @@
+import atexit
+import os
+import threading
+import time
+
+import metrics
+
+DURABILITY_ENV = "ASSISTANT_DURABILITY"
+FLUSH_DELAY_ENV = "ASSISTANT_FLUSH_DELAY"
+
+# strict: write and fsync every change before returning (the default)
+# debounced: coalesce changes and write them, fsynced, on a background thread
+# relaxed: like debounced, but without fsync (atomic rename only)
+DURABILITY_MODES = ("strict", "debounced", "relaxed")
+
+
+def durability():
+    mode = os.getenv(DURABILITY_ENV) or "strict"
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode: {mode}")
+    return mode
+
+
+class Persister:
+    """Debounced write-behind for objects that are saved as a whole.
+
+    `mark_dirty(key, write)` records the latest `write` callable for `key`;
+    repeated marks replace it, so a burst of edits costs one write. Pending
+    writes run on a background thread once no new mark has arrived for
+    `delay` seconds, or after at most `max_delay` seconds of continuous
+    marking, and synchronously on `flush()`/`close()`.
+    """
+
+    def __init__(self, delay=0.5, max_delay=5.0):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        # key -> latest write callable, in first-marked order
+        self._pending = {}
+        self._first_marked = None
+        self._last_marked = None
+        # Serializes writes between the background thread and flush()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="persister", daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self, key, write):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Persister is closed")
+            now = time.monotonic()
+            if not self._pending:
+                self._first_marked = now
+            else:
+                metrics.increment("persist.coalesced")
+            self._pending[key] = write
+            self._last_marked = now
+            self._condition.notify()
+
+    def _due(self):
+        # Seconds until the pending batch should be written (0 when due)
+        now = time.monotonic()
+        return max(
+            0.0,
+            min(
+                self._last_marked + self.delay - now,
+                self._first_marked + self.max_delay - now,
+            ),
+        )
+
+    def _run(self):
+        with self._condition:
+            while True:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                remaining = self._due()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                self._condition.release()
+                try:
+                    self.flush()
+                except Exception:
+                    pass  # Counted in flush(); failed writes are retried later
+                finally:
+                    self._condition.acquire()
+
+    def flush(self):
+        """Write everything pending now, in the calling thread."""
+        with self._write_lock:
+            with self._condition:
+                pending, self._pending = self._pending, {}
+            failed = {}
+            for key, write in pending.items():
+                try:
+                    with metrics.timer("persist.write"):
+                        write()
+                except Exception as error:
+                    metrics.increment("persist.errors")
+                    failed[key] = (write, error)
+            if not failed:
+                return
+            with self._condition:
+                # Retry after the delay unless a newer write was marked meanwhile
+                for key, (write, _) in failed.items():
+                    self._pending.setdefault(key, write)
+                self._first_marked = self._last_marked = time.monotonic()
+            raise next(iter(failed.values()))[1]
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+
+_default_persister = None
+_default_persister_lock = threading.Lock()
+
+
+def get_persister():
+    """Process-wide Persister for the debounced modes, or None in strict mode."""
+    global _default_persister
+    if durability() == "strict":
+        return None
+    with _default_persister_lock:
+        if _default_persister is None:
+            _default_persister = Persister(float(os.getenv(FLUSH_DELAY_ENV, "0.5")))
+            # Pending writes are flushed when the interpreter exits normally
+            atexit.register(_default_persister.close)
+    return _default_persister
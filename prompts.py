@@ -0,0 +1,72 @@
+import re
+from datetime import datetime, timedelta
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    # Words and punctuation marks track BPE token counts closely for English text
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def build_intake_summary(
+    analysis, today=None, recent_days=7, history_days=28, token_budget=600
+):
+    """Summarize a user's intake for the eating schedule prompt.
+
+    Entries from the last `recent_days` are listed individually; the
+    `history_days` before that are collapsed into one line per day with the
+    calorie total and top categories. Lines are kept newest first until
+    `token_budget` (estimated) is spent, so the prompt stays bounded no matter
+    how long the history is.
+    """
+    if today is None:
+        today = datetime.now()
+    if isinstance(today, str):
+        today = datetime.strptime(today, "%Y-%m-%d")
+    food_log = analysis.food_log
+    recent_start = today - timedelta(days=recent_days - 1)
+    history_start = recent_start - timedelta(days=history_days)
+
+    recent_lines = [
+        f"- {log['date']}: {log['food']} ({log['calories']} kcal)"
+        for log in food_log.get_logs_in_date_range(recent_start, today)
+    ]
+    history_lines = []
+    for offset in range(1, history_days + 1):
+        date_str = (recent_start - timedelta(days=offset)).strftime("%Y-%m-%d")
+        categories = analysis.category_counts(date_str)
+        if not categories:
+            continue
+        top = ", ".join(
+            f"{category} x{count}" for category, count in categories.most_common(3)
+        )
+        total = food_log.get_daily_calories(date_str)
+        history_lines.insert(0, f"- {date_str}: {total} kcal total; {top}")
+
+    # Spend the budget on the newest recent entries first, then older days
+    kept_recent, kept_history = [], []
+    remaining = token_budget
+    for lines, kept in ((recent_lines, kept_recent), (history_lines, kept_history)):
+        for line in reversed(lines):
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                break
+            remaining -= cost
+            kept.insert(0, line)
+        if len(kept) < len(lines):
+            break
+
+    sections = []
+    if kept_history:
+        sections.append(
+            f"Daily summary since {history_start.strftime('%Y-%m-%d')}:\n"
+            + "\n".join(kept_history)
+        )
+    if kept_recent:
+        omitted = len(recent_lines) - len(kept_recent)
+        header = f"Last {recent_days} days"
+        if omitted:
+            header += f" ({omitted} earlier entries omitted)"
+        sections.append(f"{header}:\n" + "\n".join(kept_recent))
+    return "\n\n".join(sections) or "No food logged recently."
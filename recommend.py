@@ -0,0 +1,124 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from food_log import normalize_name
+
+# Portion sizes in multiples of 100 g (catalog calories are per 100 g)
+PORTIONS = np.array([0.5, 1.0, 1.5, 2.0, 2.5, 3.0])
+# Score, in kcal-equivalents per kcal/100 g, that favours lighter foods at a
+# similar fit, so a large portion beats a spoonful of something dense
+DENSITY_PENALTY = 0.5
+
+
+class BlockFilter:
+    """A user's block list compiled into hashed sets (duplicates collapse)."""
+
+    def __init__(self, block_list):
+        self.foods = frozenset(normalize_name(food) for food in block_list["foods"])
+        self.categories = frozenset(
+            normalize_name(category) for category in block_list["categories"]
+        )
+
+    @property
+    def key(self):
+        return self.foods, self.categories
+
+    def allows(self, food, category):
+        return food not in self.foods and category not in self.categories
+
+    def mask(self, catalog):
+        """Boolean mask over catalog rows that are not blocked."""
+        allowed = np.ones(len(catalog), dtype=bool)
+        codes = [
+            catalog.category_index[category]
+            for category in self.categories
+            if category in catalog.category_index
+        ]
+        if codes:
+            allowed &= ~np.isin(catalog.category_codes, codes)
+        for food in self.foods:
+            allowed[catalog.rows_named(food)] = False
+        return allowed
+
+
+class Recommender:
+    """Vectorized "what can I eat" queries over a FoodCatalog."""
+
+    def __init__(self, catalog, cache_size=256):
+        self.catalog = catalog
+        self.cache_size = cache_size
+        self._masks = OrderedDict()
+
+    def allowed_mask(self, block_list):
+        # Compiled block-list masks are cached, so repeat queries skip recompiling
+        block_filter = BlockFilter(block_list)
+        mask = self._masks.get(block_filter.key)
+        if mask is None:
+            mask = block_filter.mask(self.catalog)
+            self._masks[block_filter.key] = mask
+            if len(self._masks) > self.cache_size:
+                self._masks.popitem(last=False)
+        else:
+            self._masks.move_to_end(block_filter.key)
+        return mask
+
+    def candidates(self, user_profile, max_calories, category=None):
+        """Rows that are allowed for the user and fit within `max_calories`."""
+        calories = self.catalog.calories
+        mask = self.allowed_mask(user_profile["block_list"])
+        mask = mask & (calories > 0) & (calories <= max_calories)
+        if category is not None:
+            in_category = np.zeros(len(self.catalog), dtype=bool)
+            in_category[self.catalog.rows_in_category(category)] = True
+            mask &= in_category
+        return np.flatnonzero(mask)
+
+    def recommend(
+        self,
+        user_profile,
+        remaining_calories,
+        k=10,
+        category=None,
+        target_calories=None,
+    ):
+        """Top-k distinct foods, each with the portion that best fills a meal.
+
+        A food scores the distance from its closest portion (see `PORTIONS`)
+        to `target_calories` (default: all remaining calories), never going
+        over the remaining calories, plus `DENSITY_PENALTY` per kcal/100 g.
+        Entries carry the catalog's per-100 g calories plus `grams` and
+        `portion_calories`.
+        """
+        if target_calories is None:
+            target_calories = remaining_calories
+        rows = self.candidates(user_profile, remaining_calories / PORTIONS[0], category)
+        if not len(rows):
+            return []
+        calories = np.asarray(self.catalog.calories[rows], dtype=np.float64)
+        # kcal for every (candidate, portion) pair, as in meal_planner
+        options = calories[:, None] * PORTIONS[None, :]
+        cost = np.abs(options - target_calories)
+        cost[options > remaining_calories] = np.inf
+        portions = np.argmin(cost, axis=1)
+        scores = cost[np.arange(len(rows)), portions] + DENSITY_PENALTY * calories
+        fits = np.flatnonzero(np.isfinite(scores))
+        # Over-select to leave room for duplicate names, then order the shortlist
+        shortlist = min(len(fits), k * 4)
+        if not shortlist:
+            return []
+        best = fits[np.argpartition(scores[fits], shortlist - 1)[:shortlist]]
+        best = best[np.argsort(scores[best], kind="stable")]
+
+        results, seen = [], set()
+        for index in best:
+            entry = self.catalog.row(rows[index])
+            if entry["food"] not in seen:
+                seen.add(entry["food"])
+                portion = PORTIONS[portions[index]]
+                entry["grams"] = int(portion * 100)
+                entry["portion_calories"] = round(float(calories[index] * portion), 1)
+                results.append(entry)
+                if len(results) == k:
+                    break
+        return results
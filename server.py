@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import re
+from collections import OrderedDict
+
+import metrics
+from analysis import Analysis
+from food_log import FoodLog
+from storage import get_storage
+from user import User, UserNotFound, load_user, new_profile
+
+# Usernames end up in file names, so only allow a conservative character set
+USERNAME_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+
+def check_username(username):
+    if (
+        not isinstance(username, str)
+        or not USERNAME_PATTERN.fullmatch(username)
+        or ".." in username
+        or username.startswith(".")
+    ):
+        raise ValueError(f"Invalid username: {username!r}")
+
+
+class UserSession:
+    """A loaded user with their food log, analysis and a lock guarding all three."""
+
+    def __init__(self, user, food_log):
+        self.user = user
+        self.food_log = food_log
+        self.analysis = Analysis(food_log)
+        self.lock = asyncio.Lock()
+        self.profile_dirty = False
+
+    def flush(self):
+        # Profile and log changes are committed together where the backend allows
+        with self.user.storage.transaction():
+            if self.profile_dirty:
+                self.user.save_profile()
+                self.profile_dirty = False
+            self.food_log.flush()
+
+
+def load_session(username, storage=None):
+    if storage is None:
+        storage = get_storage()
+    user = load_user(username, storage)
+    return UserSession(user, FoodLog(username, storage=storage))
+
+
+class SessionCache:
+    """Process-wide LRU of user sessions with write-behind flushing.
+
+    Writes only mark a session dirty; `flush()` (run periodically by
+    `run_flusher`) persists them off the event loop. Dirty sessions are never
+    evicted, so the cache may briefly exceed `capacity` until the next flush.
+    """
+
+    def __init__(self, capacity=1024, storage=None):
+        self.storage = get_storage() if storage is None else storage
+        self.capacity = capacity
+        self.sessions = OrderedDict()
+        self.dirty = set()
+        self._loading = {}
+
+    async def get(self, username):
+        session = self.sessions.get(username)
+        if session is not None:
+            self.sessions.move_to_end(username)
+            return session
+
+        # Coalesce concurrent cache misses for the same user into one load
+        task = self._loading.get(username)
+        if task is None:
+            task = asyncio.ensure_future(
+                asyncio.to_thread(load_session, username, self.storage)
+            )
+            self._loading[username] = task
+            try:
+                session = await task
+            finally:
+                del self._loading[username]
+            self.add(username, session)
+            return session
+        return await task
+
+    def add(self, username, session):
+        self.sessions[username] = session
+        self.sessions.move_to_end(username)
+        self._evict()
+
+    def _evict(self):
+        for username in list(self.sessions):
+            if len(self.sessions) <= self.capacity:
+                break
+            session = self.sessions[username]
+            if session in self.dirty or session.lock.locked():
+                continue
+            del self.sessions[username]
+
+    def mark_dirty(self, session):
+        self.dirty.add(session)
+
+    async def flush(self):
+        failed = set()
+        while self.dirty:
+            session = self.dirty.pop()
+            async with session.lock:
+                try:
+                    await asyncio.to_thread(session.flush)
+                except Exception:
+                    metrics.increment("server.flush_errors")
+                    failed.add(session)
+        # Failed sessions stay dirty (and cached) and are retried next flush
+        self.dirty |= failed
+        self._evict()
+
+    async def run_flusher(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+class AssistantService:
+    """JSON-RPC style methods routed to User, FoodLog and Analysis."""
+
+    def __init__(self, cache=None):
+        self.cache = cache or SessionCache()
+        self.methods = {
+            "profile.create": self.create_profile,
+            "profile.get": self.get_profile,
+            "profile.update": self.update_profile,
+            "block.add": self.add_block,
+            "log.add": self.add_log,
+            "log.range": self.log_range,
+            "status": self.status,
+            "report": self.report,
+        }
+
+    async def call(self, method, params):
+        if method not in self.methods:
+            raise KeyError(method)
+        if "username" in params:
+            check_username(params["username"])
+        with metrics.timer(f"rpc.{method}"):
+            return await self.methods[method](**params)
+
+    async def create_profile(self, username, weight, height, age, daily_calorie_limit):
+        storage = self.cache.storage
+        if username in self.cache.sessions or storage.profile_exists(username):
+            raise ValueError(f"User '{username}' already exists")
+        user = User(
+            username,
+            profile=new_profile(weight, height, age, daily_calorie_limit),
+            storage=storage,
+        )
+        session = UserSession(user, FoodLog(username, log=[], storage=storage))
+        # Reserve the name before awaiting so a concurrent create sees it taken;
+        # the held lock also keeps the session from being evicted mid-save
+        async with session.lock:
+            self.cache.add(username, session)
+            try:
+                await asyncio.to_thread(user.save_profile)
+            except BaseException:
+                if self.cache.sessions.get(username) is session:
+                    del self.cache.sessions[username]
+                raise
+        return user.profile
+
+    async def get_profile(self, username):
+        session = await self.cache.get(username)
+        return session.user.profile
+
+    async def update_profile(self, username, **fields):
+        session = await self.cache.get(username)
+        async with session.lock:
+            session.user.set_fields(**fields)
+            session.profile_dirty = True
+            self.cache.mark_dirty(session)
+        return session.user.profile
+
+    async def add_block(self, username, kind, name):
+        session = await self.cache.get(username)
+        async with session.lock:
+            session.user.block(kind, name)
+            session.profile_dirty = True
+            self.cache.mark_dirty(session)
+        return session.user.profile["block_list"]
+
+    async def add_log(self, username, food, category, calories, date=None):
+        session = await self.cache.get(username)
+        async with session.lock:
+            entry = session.food_log.add_entry(
+                food, category, calories, date_str=date, flush=False
+            )
+            self.cache.mark_dirty(session)
+        return entry
+
+    async def log_range(self, username, start_date=None, end_date=None):
+        session = await self.cache.get(username)
+        return session.food_log.get_logs_in_date_range(start_date, end_date)
+
+    async def status(self, username, date=None):
+        session = await self.cache.get(username)
+        return session.analysis.calorie_status(session.user.profile, date)
+
+    async def report(self, username, end_date=None, days=7):
+        session = await self.cache.get(username)
+        return session.analysis.get_report(end_date=end_date, days=days)
+
+
+def rpc_error(request_id, code, message):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": code, "message": message},
+    }
+
+
+async def dispatch(service, body):
+    try:
+        request = json.loads(body)
+    except json.JSONDecodeError:
+        return rpc_error(None, -32700, "Parse error")
+    if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+        return rpc_error(None, -32600, "Invalid request")
+
+    request_id = request.get("id")
+    params = request.get("params") or {}
+    try:
+        result = await service.call(request["method"], params)
+    except KeyError as error:
+        if error.args and error.args[0] == request["method"]:
+            return rpc_error(request_id, -32601, "Method not found")
+        return rpc_error(request_id, -32602, f"Missing field: {error}")
+    except UserNotFound as error:
+        return rpc_error(request_id, -32001, f"Unknown user: {error}")
+    except (TypeError, ValueError) as error:
+        return rpc_error(request_id, -32602, str(error))
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+async def handle_connection(service, reader, writer):
+    # Minimal HTTP/1.1 with keep-alive: every POST body is one JSON-RPC request
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            body = await reader.readexactly(length) if length else b""
+            method, _, target = request_line.decode("latin-1").partition(" ")
+            content_type = "application/json"
+            if method == "GET" and target.split(" ", 1)[0] == "/metrics":
+                # Prometheus scrape endpoint
+                status, content_type = "200 OK", "text/plain; version=0.0.4"
+                data = metrics.to_prometheus().encode()
+            elif method != "POST":
+                status = "405 Method Not Allowed"
+                data = json.dumps(rpc_error(None, -32600, "Use POST")).encode()
+            else:
+                status = "200 OK"
+                data = json.dumps(await dispatch(service, body)).encode()
+
+            keep_alive = headers.get("connection", "").lower() != "close"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                + data
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=8080, cache_size=1024, flush_interval=1.0):
+    service = AssistantService(SessionCache(cache_size))
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port
+    )
+    flusher = asyncio.ensure_future(service.cache.run_flusher(flush_interval))
+    print(f"Serving on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        flusher.cancel()
+        # Persist everything still pending before shutting down
+        await service.cache.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-user JSON-RPC server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--metrics", action="store_true", help="Collect metrics for GET /metrics"
+    )
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+    try:
+        asyncio.run(serve(args.host, args.port, args.cache_size, args.flush_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+import contextlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+import metrics
+from persistence import durability
+
+
+def fsync_directory(path):
+    # Make a rename durable by syncing the directory entry (not supported on Windows)
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, write, fsync=True):
+    """Write `path` through a temp file and rename, so a crash never leaves a torn file.
+
+    Without `fsync` the rename is still atomic, but the data may not survive
+    a power loss.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        write(file)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        fsync_directory(path)
+
+
+class LogJournal:
+    """Append-only JSON-lines journal holding one food log entry per line."""
+
+    def __init__(self, path, legacy_path=None, fsync=True):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.fsync = fsync
+
+    @metrics.timed("storage.json.load_log")
+    def load(self):
+        if not os.path.exists(self.path):
+            return self.migrate_legacy()
+
+        entries, needs_compaction = self.read()
+        if needs_compaction:
+            self.compact(entries)
+        return entries
+
+    def read(self):
+        """Parse the journal without modifying it.
+
+        Returns the entries and whether a torn or corrupt line was skipped.
+        """
+        entries = []
+        needs_compaction = False
+        if not os.path.exists(self.path):
+            if self.legacy_path and os.path.exists(self.legacy_path):
+                with open(self.legacy_path, "r") as file:
+                    return json.load(file), False
+            return entries, False
+        with open(self.path, "r") as file:
+            for line in file:
+                if not line.endswith("\n"):
+                    # Torn tail from a crash mid-append
+                    needs_compaction = True
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    needs_compaction = True
+        return entries, needs_compaction
+
+    def append(self, entries):
+        if not entries:
+            return
+        self.append_lines("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    @metrics.timed("storage.json.append")
+    def append_lines(self, data):
+        # `data` is pre-serialized JSON lines, each ending in a newline
+        if not data:
+            return
+        metrics.increment("storage.json.bytes_appended", len(data))
+        with open(self.path, "a") as file:
+            if self._torn_tail():
+                # Keep a crashed append's fragment on its own line; the next
+                # load skips it and compacts it away
+                file.write("\n")
+            file.write(data)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _torn_tail(self):
+        try:
+            with open(self.path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                return file.read(1) != b"\n"
+        except OSError:
+            # Missing or empty file
+            return False
+
+    @metrics.timed("storage.json.compact")
+    def compact(self, entries):
+        atomic_write(
+            self.path,
+            lambda file: file.writelines(json.dumps(entry) + "\n" for entry in entries),
+            fsync=self.fsync,
+        )
+
+    def migrate_legacy(self):
+        # Convert an old full-document `<username>_food_log.json` into the journal once
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return []
+        with open(self.legacy_path, "r") as file:
+            entries = json.load(file)
+        self.compact(entries)
+        os.replace(self.legacy_path, f"{self.legacy_path}.bak")
+        return entries
+
+
+class Storage(ABC):
+    """Interface for persisting user profiles and food logs.
+
+    `log(username)` returns the user's entry log, which exposes the same
+    `load`/`append`/`append_lines`/`compact` methods as `LogJournal`.
+    """
+
+    @abstractmethod
+    def load_profile(self, username):
+        # Returns None when the user has no profile
+        ...
+
+    @abstractmethod
+    def save_profile(self, username, profile): ...
+
+    def profile_exists(self, username):
+        return self.load_profile(username) is not None
+
+    @abstractmethod
+    def log(self, username): ...
+
+    def append_entries(self, username, entries):
+        # Appends without loading the existing log
+        self.log(username).append(entries)
+
+    def transaction(self):
+        # Groups several writes into one atomic batch where the backend supports it
+        return contextlib.nullcontext()
+
+    def close(self):
+        pass
+
+
+class JSONFileStorage(Storage):
+    """`<username>_profile.json` documents and `<username>_food_log.jsonl` journals."""
+
+    def __init__(self, directory=".", fsync=True):
+        self.directory = directory
+        # False trades power-loss durability for cheaper writes
+        self.fsync = fsync
+
+    def profile_path(self, username):
+        return os.path.join(self.directory, f"{username}_profile.json")
+
+    @metrics.timed("storage.json.load_profile")
+    def load_profile(self, username):
+        try:
+            with open(self.profile_path(username), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    @metrics.timed("storage.json.save_profile")
+    def save_profile(self, username, profile):
+        atomic_write(
+            self.profile_path(username),
+            lambda file: json.dump(profile, file),
+            fsync=self.fsync,
+        )
+
+    def profile_exists(self, username):
+        return os.path.exists(self.profile_path(username))
+
+    def log(self, username):
+        # Pre-journal logs were stored as one JSON document; migrated on first load
+        return LogJournal(
+            os.path.join(self.directory, f"{username}_food_log.jsonl"),
+            legacy_path=os.path.join(self.directory, f"{username}_food_log.json"),
+            fsync=self.fsync,
+        )
+
+    def append_entries(self, username, entries):
+        journal = self.log(username)
+        if not os.path.exists(journal.path):
+            journal.migrate_legacy()
+        journal.append(entries)
+
+
+class SQLiteLog:
+    def __init__(self, storage, username):
+        self.storage = storage
+        self.username = username
+
+    @metrics.timed("storage.sqlite.load_log")
+    def load(self):
+        with self.storage.connection() as connection:
+            rows = connection.execute(
+                "SELECT date, food, category, calories FROM entries "
+                "WHERE username = ? ORDER BY id",
+                (self.username,),
+            ).fetchall()
+        return [
+            {"date": date, "food": food, "category": category, "calories": calories}
+            for date, food, category, calories in rows
+        ]
+
+    @metrics.timed("storage.sqlite.append")
+    def append(self, entries):
+        if not entries:
+            return
+        with self.storage.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO entries (username, date, food, category, calories) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        self.username,
+                        entry["date"],
+                        entry["food"],
+                        entry["category"],
+                        entry["calories"],
+                    )
+                    for entry in entries
+                ],
+            )
+
+    def append_lines(self, data):
+        self.append([json.loads(line) for line in data.splitlines() if line])
+
+    def compact(self, entries):
+        with self.storage.transaction() as connection:
+            connection.execute(
+                "DELETE FROM entries WHERE username = ?", (self.username,)
+            )
+            self.append(entries)
+
+
+class SQLiteStorage(Storage):
+    """One SQLite database in WAL mode shared through a small connection pool.
+
+    Each write runs in its own transaction unless it happens inside
+    `transaction()`, which batches everything on the current thread into a
+    single commit.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS profiles (
+            username TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            date TEXT NOT NULL,
+            food TEXT NOT NULL,
+            category TEXT NOT NULL,
+            calories INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_by_user ON entries (username, id);
+    """
+
+    def __init__(self, path="assistant.sqlite3", pool_size=4, timeout=30.0, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        # Every connection to ":memory:" would open a separate database
+        self.pool_size = 1 if path == ":memory:" else pool_size
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.executescript(self.SCHEMA)
+
+    def _connect(self):
+        # Autocommit mode; transactions are opened explicitly
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # NORMAL syncs the WAL at checkpoints; OFF leaves syncing to the OS
+        connection.execute(f"PRAGMA synchronous={'NORMAL' if self.fsync else 'OFF'}")
+        return connection
+
+    def _acquire(self):
+        with self._lock:
+            if self._pool.empty() and self._created < self.pool_size:
+                self._created += 1
+                return self._connect()
+        return self._pool.get()
+
+    @contextlib.contextmanager
+    def connection(self):
+        # Reuse the connection of an open transaction on this thread
+        current = getattr(self._local, "connection", None)
+        if current is not None:
+            yield current
+            return
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        current = getattr(self._local, "connection", None)
+        if current is not None:
+            yield current
+            return
+        with self.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._local.connection = connection
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            else:
+                connection.execute("COMMIT")
+            finally:
+                self._local.connection = None
+
+    @metrics.timed("storage.sqlite.load_profile")
+    def load_profile(self, username):
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT data FROM profiles WHERE username = ?", (username,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    @metrics.timed("storage.sqlite.save_profile")
+    def save_profile(self, username, profile):
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO profiles (username, data) VALUES (?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET data = excluded.data",
+                (username, json.dumps(profile)),
+            )
+
+    def log(self, username):
+        return SQLiteLog(self, username)
+
+    def close(self):
+        with self._lock:
+            while not self._pool.empty():
+                self._pool.get().close()
+            self._created = 0
+
+
+class MemoryLog:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def load(self):
+        return [dict(entry) for entry in self.entries]
+
+    def append(self, entries):
+        self.entries.extend(dict(entry) for entry in entries)
+
+    def append_lines(self, data):
+        self.append([json.loads(line) for line in data.splitlines() if line])
+
+    def compact(self, entries):
+        self.entries[:] = [dict(entry) for entry in entries]
+
+
+class MemoryStorage(Storage):
+    """Process-local storage for tests and benchmarks; nothing touches disk."""
+
+    def __init__(self):
+        self.profiles = {}
+        self.logs = defaultdict(list)
+
+    def load_profile(self, username):
+        profile = self.profiles.get(username)
+        # Copies, so callers cannot mutate the stored document
+        return None if profile is None else json.loads(profile)
+
+    def save_profile(self, username, profile):
+        self.profiles[username] = json.dumps(profile)
+
+    def log(self, username):
+        return MemoryLog(self.logs[username])
+
+
+STORAGE_ENV = "ASSISTANT_STORAGE"
+
+_default_storage = None
+_default_storage_lock = threading.Lock()
+
+
+def open_storage(spec, fsync=True):
+    """Open a backend from a spec: `json[:DIR]`, `sqlite[:PATH]` or `memory`."""
+    kind, _, location = spec.partition(":")
+    if kind == "json":
+        return JSONFileStorage(location or ".", fsync=fsync)
+    if kind == "sqlite":
+        return SQLiteStorage(location or "assistant.sqlite3", fsync=fsync)
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+def get_storage():
+    # Process-wide backend chosen by $ASSISTANT_STORAGE (JSON files by default)
+    global _default_storage
+    with _default_storage_lock:
+        if _default_storage is None:
+            _default_storage = open_storage(
+                os.getenv(STORAGE_ENV, "json"), fsync=durability() != "relaxed"
+            )
+    return _default_storage
+
+
+def set_storage(storage):
+    global _default_storage
+    with _default_storage_lock:
+        previous, _default_storage = _default_storage, storage
+    return previous
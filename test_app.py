@@ -1,9 +1,47 @@
+import asyncio
+import contextlib
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch
 from user import User
-from food_log import FoodLog
-from analysis import Analysis
+from food_log import FoodLog, make_entry, normalize_name
+from compact_log import CompactLog
+from analysis import Analysis, generate_schedules
+import llm_provider
+from llm_provider import LocalProvider
+import benchmark
+import cohort
+import dataset_preparation
+from dataset_preparation import clean_rows
+import main
+import metrics
+import persistence
+from persistence import Persister
+from food_catalog import FoodCatalog
+from llm_cache import ResponseCache, request_key
+from meal_planner import plan_day
+from recommend import BlockFilter, Recommender
+from trends import Trends
+from prompts import build_intake_summary, estimate_tokens
+from storage import (
+    JSONFileStorage,
+    MemoryStorage,
+    SQLiteStorage,
+    Storage,
+    open_storage,
+)
+from server import AssistantService, SessionCache, dispatch, handle_connection
 from datetime import datetime
+import numpy as np
+import openai
 import pandas as pd
 from datetime import timedelta
 
@@ -172,5 +210,2135 @@ class TestEatingHabitTracker(unittest.TestCase):
         pass
 
 
+class TestFoodLogStorage(unittest.TestCase):
+    def setUp(self):
+        # Run each test in a scratch directory since log paths are relative
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.entry = {
+            "date": "2024-01-01",
+            "food": "banana",
+            "category": "en:fruits",
+            "calories": 89,
+        }
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def test_log_food_appends_single_line(self):
+        food_log = FoodLog("alice")
+        with patch("builtins.input", side_effect=["apple", "fruit", "52"]):
+            with patch("builtins.print"):
+                food_log.log_food({})
+        with patch("builtins.input", side_effect=["egg", "eggs", "155"]):
+            with patch("builtins.print"):
+                food_log.log_food({})
+
+        with open("alice_food_log.jsonl") as file:
+            lines = file.readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])["food"], "egg")
+        self.assertEqual(FoodLog("alice").log, food_log.log)
+
+    def test_migrates_legacy_json_log(self):
+        with open("bob_food_log.json", "w") as file:
+            json.dump([self.entry], file)
+
+        food_log = FoodLog("bob")
+        self.assertEqual(food_log.log, [self.entry])
+        self.assertTrue(os.path.exists("bob_food_log.jsonl"))
+        self.assertFalse(os.path.exists("bob_food_log.json"))
+        self.assertEqual(FoodLog("bob").log, [self.entry])
+
+    def test_recovers_from_torn_append(self):
+        with open("carol_food_log.jsonl", "w") as file:
+            file.write(json.dumps(self.entry) + "\n")
+            file.write('{"date": "2024-01-02", "fo')
+
+        food_log = FoodLog("carol")
+        self.assertEqual(food_log.log, [self.entry])
+        food_log.append_entry(dict(self.entry, date="2024-01-02"))
+        self.assertEqual(len(FoodLog("carol").log), 2)
+
+    def test_append_after_crash_keeps_new_entry(self):
+        with open("erin_food_log.jsonl", "w") as file:
+            file.write(json.dumps(self.entry) + "\n")
+            file.write('{"date": "2024-01-02", "fo')
+
+        new_entry = dict(self.entry, date="2024-01-03")
+        JSONFileStorage(".").append_entries("erin", [new_entry])
+        self.assertEqual(FoodLog("erin").log, [self.entry, new_entry])
+        self.assertEqual(FoodLog("erin").log, [self.entry, new_entry])
+
+    def test_save_log_is_atomic_rewrite(self):
+        food_log = FoodLog("dave", log=[self.entry])
+        food_log.save_log()
+        self.assertFalse(os.path.exists("dave_food_log.jsonl.tmp"))
+        self.assertEqual(FoodLog("dave").log, [self.entry])
+
+
+class TestFoodLogBulk(unittest.TestCase):
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.food_log = FoodLog("bulk_user")
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def test_import_validates_and_dedupes(self):
+        rows = [
+            {
+                "date": "2024-01-02",
+                "food": " Egg ",
+                "category": "en:eggs",
+                "calories": 155,
+            },
+            {
+                "date": "2024-01-02",
+                "food": "egg",
+                "category": "en:eggs",
+                "calories": 155,
+            },
+            {
+                "date": "2024-01-01",
+                "food": "rice",
+                "category": "en:grains",
+                "calories": "112",
+            },
+            {
+                "date": "not a date",
+                "food": "rice",
+                "category": "en:grains",
+                "calories": 112,
+            },
+            {
+                "date": "2024-01-01",
+                "food": "",
+                "category": "en:grains",
+                "calories": 112,
+            },
+            {
+                "date": "2024-01-01",
+                "food": "water",
+                "category": "en:drinks",
+                "calories": 0,
+            },
+            {
+                "date": "2024-01-01",
+                "food": "oil",
+                "category": "en:fats",
+                "calories": 8.5,
+            },
+        ]
+        journal = self.food_log.journal
+        with patch.object(
+            journal, "append_lines", wraps=journal.append_lines
+        ) as append:
+            result = self.food_log.import_entries(rows)
+            self.assertEqual(append.call_count, 1)
+        self.assertEqual(result, {"imported": 2, "duplicates": 1, "invalid": 4})
+        self.assertEqual(self.food_log.get_daily_calories("2024-01-01"), 112)
+        self.assertEqual(FoodLog("bulk_user").log, self.food_log.log)
+
+        again = self.food_log.import_entries(pd.DataFrame(rows[:3]))
+        self.assertEqual(again, {"imported": 0, "duplicates": 3, "invalid": 0})
+
+    def test_round_trip_through_csv_and_jsonl(self):
+        rows = [
+            {
+                "date": f"2024-01-{day:02d}",
+                "food": "apple",
+                "category": "en:fruits",
+                "calories": 50 + day,
+            }
+            for day in range(1, 31)
+        ]
+        self.food_log.import_entries(rows)
+        for path in ("export.csv", "export.jsonl"):
+            self.assertEqual(self.food_log.export_entries(path), 30)
+            other = FoodLog(f"other_{path.split('.')[1]}")
+            self.assertEqual(other.import_entries(path)["imported"], 30)
+            self.assertEqual(other.log, self.food_log.log)
+
+        lines = list(self.food_log.iter_export("csv", "2024-01-10", "2024-01-11"))
+        self.assertEqual(lines[0].strip(), "date,food,category,calories")
+        self.assertEqual(len(lines), 3)
+
+    def test_large_batch_rebuilds_index_and_notifies(self):
+        analysis = Analysis(self.food_log)
+        rows = pd.DataFrame(
+            {
+                "date": [f"2024-02-{day % 28 + 1:02d}" for day in range(5000)],
+                "food": [f"food {i}" for i in range(5000)],
+                "category": "en:snacks",
+                "calories": 100,
+            }
+        )
+        self.assertEqual(self.food_log.import_entries(rows)["imported"], 5000)
+        report = analysis.get_report(end_date="2024-02-28", days=28)
+        self.assertEqual(report["total_entries"], 5000)
+        self.assertEqual(
+            len(self.food_log.get_logs_in_date_range("2024-02-01", "2024-02-01")), 179
+        )
+
+
+class TestFoodLogIndex(unittest.TestCase):
+    def setUp(self):
+        self.entries = [
+            {
+                "date": "2024-01-03",
+                "food": "egg",
+                "category": "en:eggs",
+                "calories": 155,
+            },
+            {
+                "date": "2024-01-01",
+                "food": "rice",
+                "category": "en:grains",
+                "calories": 112,
+            },
+            {
+                "date": "2024-01-02",
+                "food": "banana",
+                "category": "en:fruits",
+                "calories": 89,
+            },
+            {
+                "date": "2024-01-01",
+                "food": "banana",
+                "category": "en:fruits",
+                "calories": 89,
+            },
+        ]
+        self.food_log = FoodLog("index_user", log=list(self.entries))
+
+    def test_date_range_is_inclusive_and_sorted(self):
+        logs = self.food_log.get_logs_in_date_range("2024-01-01", "2024-01-02")
+        self.assertEqual(
+            [entry["date"] for entry in logs],
+            ["2024-01-01", "2024-01-01", "2024-01-02"],
+        )
+        self.assertEqual(self.food_log.get_logs_in_date_range("2024-01-04"), [])
+        self.assertEqual(len(self.food_log.get_logs_in_date_range()), 4)
+
+    def test_date_range_accepts_date_objects(self):
+        logs = self.food_log.get_logs_in_date_range(
+            datetime(2024, 1, 3).date(), datetime(2024, 1, 3)
+        )
+        self.assertEqual([entry["food"] for entry in logs], ["egg"])
+
+    def test_daily_totals_update_on_append(self):
+        self.assertEqual(self.food_log.get_daily_calories("2024-01-01"), 201)
+        with patch.object(self.food_log.journal, "append"):
+            self.food_log.append_entry(
+                {
+                    "date": "2024-01-02",
+                    "food": "egg",
+                    "category": "en:eggs",
+                    "calories": 155,
+                }
+            )
+        self.assertEqual(self.food_log.get_daily_calories("2024-01-02"), 244)
+        self.assertEqual(self.food_log.get_daily_calories("2023-12-31"), 0)
+        logs = self.food_log.get_logs_in_date_range("2024-01-02", "2024-01-02")
+        self.assertEqual(len(logs), 2)
+
+
+class TestCompactLog(unittest.TestCase):
+    def setUp(self):
+        self.entries = benchmark.make_entries(50, entries_per_day=4)
+
+    def test_behaves_like_a_list_of_entries(self):
+        log = CompactLog(self.entries)
+        self.assertEqual(len(log), 50)
+        self.assertEqual(log, self.entries)
+        self.assertEqual(log[-1], self.entries[-1])
+        self.assertEqual(log[2:5], self.entries[2:5])
+        self.assertEqual(json.loads(json.dumps(list(log))), self.entries)
+
+        edited = dict(log[0], calories=1)
+        log[0] = edited
+        log.insert(1, self.entries[3])
+        del log[2]
+        self.assertEqual(log.pop(), self.entries[-1])
+        self.assertEqual(log, [edited, self.entries[3]] + self.entries[2:-1])
+        with self.assertRaises(TypeError):
+            log.append(dict(self.entries[0], calories=8.5))
+        self.assertEqual(len(log.calories), len(log.dates))
+
+    def test_calories_beyond_int32(self):
+        entry = dict(self.entries[0], calories=3_000_000_000)
+        self.assertEqual(CompactLog([entry])[0], entry)
+        with self.assertRaises(ValueError):
+            make_entry("soda", "drinks", 2**63)
+
+    def test_names_are_dictionary_encoded(self):
+        log = CompactLog(self.entries)
+        self.assertEqual(len(log.food_names.names), len(benchmark.FOODS))
+        day = self.entries[0]["date"]
+        counts = log.daily_counts("food")
+        expected = {}
+        for entry in self.entries[:4]:
+            expected[entry["food"]] = expected.get(entry["food"], 0) + 1
+        self.assertEqual(dict(counts[day]), expected)
+
+    def test_food_log_edits_in_place(self):
+        food_log = FoodLog("compact_user", log=self.entries)
+        analysis = Analysis(food_log)
+        first = self.entries[0]
+        food_log.log[0] = dict(first, food="kale", calories=first["calories"] + 5)
+        with patch.object(food_log.journal, "compact"):
+            food_log.save_log()
+        self.assertEqual(
+            food_log.get_daily_calories(first["date"]),
+            sum(e["calories"] for e in self.entries[:4]) + 5,
+        )
+        report = analysis.get_report(end_date=first["date"], days=1)
+        self.assertIn(("kale", 1), report["foods"])
+
+    def test_uses_less_memory_than_dicts(self):
+        entries = benchmark.make_entries(20_000)
+
+        def journal_entries():
+            # Parsed like the journal: fresh strings in every entry
+            return [json.loads(json.dumps(entry)) for entry in entries]
+
+        dicts = benchmark.retained_bytes(journal_entries)
+        compact = benchmark.retained_bytes(lambda: CompactLog(journal_entries()))
+        self.assertLess(compact * 5, dicts)
+
+
+class TestWeeklyReportAggregates(unittest.TestCase):
+    def setUp(self):
+        entries = [
+            {
+                "date": "2024-01-01",
+                "food": "egg",
+                "category": "en:eggs",
+                "calories": 155,
+            },
+            {
+                "date": "2024-01-05",
+                "food": "egg",
+                "category": "en:eggs",
+                "calories": 155,
+            },
+            {
+                "date": "2024-01-07",
+                "food": "rice",
+                "category": "en:grains",
+                "calories": 112,
+            },
+            {
+                "date": "2024-01-09",
+                "food": "rice",
+                "category": "en:grains",
+                "calories": 112,
+            },
+        ]
+        self.food_log = FoodLog("report_user", log=entries)
+        self.analysis = Analysis(self.food_log)
+
+    def test_report_covers_only_window(self):
+        report = self.analysis.get_report(end_date="2024-01-07")
+        self.assertEqual(report["start_date"], "2024-01-01")
+        self.assertEqual(report["end_date"], "2024-01-07")
+        self.assertEqual(report["total_entries"], 3)
+        self.assertEqual(report["total_calories"], 422)
+        self.assertEqual(report["categories"], [("en:eggs", 2), ("en:grains", 1)])
+
+        report = self.analysis.get_report(end_date="2024-01-09", days=3)
+        self.assertEqual(report["foods"], [("rice", 2)])
+        with self.assertRaises(ValueError):
+            self.analysis.get_report(end_date="2024-01-09", days=0)
+
+    def test_report_is_cached_until_window_changes(self):
+        report = self.analysis.get_report(end_date="2024-01-07")
+        other = self.analysis.get_report(end_date="2024-01-20")
+        self.assertIs(self.analysis.get_report(end_date="2024-01-07"), report)
+
+        with patch.object(self.food_log.journal, "append"):
+            self.food_log.append_entry(
+                {
+                    "date": "2024-01-06",
+                    "food": "rice",
+                    "category": "en:grains",
+                    "calories": 112,
+                }
+            )
+        updated = self.analysis.get_report(end_date="2024-01-07")
+        self.assertEqual(updated["foods"], [("egg", 2), ("rice", 2)])
+        self.assertIs(self.analysis.get_report(end_date="2024-01-20"), other)
+
+    def test_report_cache_is_bounded(self):
+        self.analysis.report_cache_size = 3
+        first = self.analysis.get_report(end_date="2024-01-07")
+        for day in range(8, 12):
+            self.analysis.get_report(end_date=f"2024-01-{day:02d}")
+        self.assertEqual(len(self.analysis._report_cache), 3)
+        self.assertIsNot(self.analysis.get_report(end_date="2024-01-07"), first)
+
+    def test_save_log_rebuilds_counters(self):
+        self.food_log.log.pop()
+        with patch.object(self.food_log.journal, "compact"):
+            self.food_log.save_log()
+        report = self.analysis.get_report(end_date="2024-01-09", days=3)
+        self.assertEqual(report["foods"], [("rice", 1)])
+
+    def test_generate_weekly_report_returns_report(self):
+        with patch("builtins.print") as mock_print:
+            report = self.analysis.generate_weekly_report()
+        self.assertEqual(report["total_entries"], 0)
+        mock_print.assert_any_call("\nNo data available for the report.")
+
+
+class TestAssistantService(unittest.TestCase):
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def rpc(self, service, method, **params):
+        body = json.dumps(
+            {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        )
+        return asyncio.run(dispatch(service, body))
+
+    def test_write_behind_and_cached_reads(self):
+        service = AssistantService(SessionCache(capacity=4))
+        self.rpc(
+            service,
+            "profile.create",
+            username="erin",
+            weight=60,
+            height=165,
+            age=28,
+            daily_calorie_limit=1800,
+        )
+        self.rpc(
+            service,
+            "log.add",
+            username="erin",
+            food="Egg",
+            category="en:eggs",
+            calories=155,
+            date="2024-01-01",
+        )
+        self.rpc(service, "block.add", username="erin", kind="foods", name="Pizza")
+        self.assertFalse(os.path.exists("erin_food_log.jsonl"))
+
+        with patch("food_log.FoodLog.load_log") as load_log:
+            status = self.rpc(service, "status", username="erin", date="2024-01-01")
+            load_log.assert_not_called()
+        self.assertEqual(status["result"]["remaining"], 1645)
+
+        asyncio.run(service.cache.flush())
+        self.assertEqual(FoodLog("erin").log[0]["food"], "egg")
+        self.assertEqual(User("erin").profile["block_list"]["foods"], ["pizza"])
+
+    def test_lru_evicts_clean_sessions(self):
+        service = AssistantService(SessionCache(capacity=1))
+        for name in ("frank", "gina"):
+            self.rpc(
+                service,
+                "profile.create",
+                username=name,
+                weight=70,
+                height=170,
+                age=30,
+                daily_calorie_limit=2000,
+            )
+        self.assertEqual(list(service.cache.sessions), ["gina"])
+        profile = self.rpc(service, "profile.get", username="frank")["result"]
+        self.assertEqual(profile["daily_calorie_limit"], 2000)
+        self.assertEqual(list(service.cache.sessions), ["frank"])
+
+    def test_errors(self):
+        service = AssistantService()
+        self.assertEqual(self.rpc(service, "nope")["error"]["code"], -32601)
+        self.assertEqual(
+            self.rpc(service, "profile.get", username="nobody")["error"]["code"], -32001
+        )
+        self.assertEqual(asyncio.run(dispatch(service, "{"))["error"]["code"], -32700)
+        self.rpc(
+            service,
+            "profile.create",
+            username="hal",
+            weight=70,
+            height=170,
+            age=30,
+            daily_calorie_limit=2000,
+        )
+        response = self.rpc(
+            service,
+            "log.add",
+            username="hal",
+            food="egg",
+            category="en:eggs",
+            calories=-5,
+        )
+        self.assertEqual(response["error"]["code"], -32602)
+
+    def test_create_profile_uses_cache_storage_once(self):
+        storage = MemoryStorage()
+        service = AssistantService(SessionCache(storage=storage))
+        params = dict(weight=70, height=170, age=30, daily_calorie_limit=2000)
+
+        async def scenario():
+            return await asyncio.gather(
+                service.call("profile.create", dict(params, username="zed")),
+                service.call("profile.create", dict(params, username="zed")),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(scenario())
+        self.assertEqual(sum(isinstance(r, ValueError) for r in results), 1)
+        self.assertIn("zed", storage.profiles)
+        self.assertFalse(os.path.exists("zed_profile.json"))
+        session = service.cache.sessions["zed"]
+        self.assertIs(session.food_log.storage, storage)
+
+    def test_invalid_update_changes_nothing(self):
+        service = AssistantService(SessionCache(storage=MemoryStorage()))
+        self.rpc(
+            service,
+            "profile.create",
+            username="kim",
+            weight=70,
+            height=170,
+            age=30,
+            daily_calorie_limit=2000,
+        )
+        response = self.rpc(
+            service, "profile.update", username="kim", weight=80, age="x"
+        )
+        self.assertEqual(response["error"]["code"], -32602)
+        profile = self.rpc(service, "profile.get", username="kim")["result"]
+        self.assertEqual(profile["weight"], 70.0)
+        self.assertFalse(service.cache.dirty)
+
+    def test_rejects_unsafe_usernames(self):
+        service = AssistantService()
+        for username in ("../escape", "a/b", "..", ".hidden", "", 7):
+            with self.subTest(username=username):
+                response = self.rpc(
+                    service,
+                    "profile.create",
+                    username=username,
+                    weight=70,
+                    height=170,
+                    age=30,
+                    daily_calorie_limit=2000,
+                )
+                self.assertEqual(response["error"]["code"], -32602)
+        self.assertEqual(
+            os.listdir(os.path.dirname(os.getcwd())).count("escape_profile.json"), 0
+        )
+        self.assertEqual(os.listdir("."), [])
+
+    def test_failed_flush_stays_dirty(self):
+        storage = MemoryStorage()
+        service = AssistantService(SessionCache(storage=storage))
+        self.rpc(
+            service,
+            "profile.create",
+            username="ada",
+            weight=70,
+            height=170,
+            age=30,
+            daily_calorie_limit=2000,
+        )
+        self.rpc(service, "block.add", username="ada", kind="foods", name="Pizza")
+        with patch.object(storage, "save_profile", side_effect=OSError("disk full")):
+            asyncio.run(service.cache.flush())
+        session = service.cache.sessions["ada"]
+        self.assertIn(session, service.cache.dirty)
+        self.assertTrue(session.profile_dirty)
+
+        asyncio.run(service.cache.flush())
+        self.assertFalse(service.cache.dirty)
+        self.assertEqual(storage.load_profile("ada")["block_list"]["foods"], ["pizza"])
+
+    def test_http_round_trip(self):
+        async def scenario():
+            service = AssistantService()
+            server = await asyncio.start_server(
+                lambda reader, writer: handle_connection(service, reader, writer),
+                "127.0.0.1",
+                0,
+            )
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            body = json.dumps(
+                {"id": 7, "method": "profile.get", "params": {"username": "ivy"}}
+            ).encode()
+            writer.write(
+                b"POST / HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                % len(body)
+                + body
+            )
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        response = asyncio.run(scenario())
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        payload = json.loads(response.split(b"\r\n\r\n", 1)[1])
+        self.assertEqual(payload["id"], 7)
+        self.assertEqual(payload["error"]["code"], -32001)
+
+
+class StubChatCompletion:
+    """Local stand-in for `openai.ChatCompletion` that records every call."""
+
+    def __init__(self, delay=0.0, failures=0):
+        self.calls = []
+        self.delay = delay
+        self.failures = failures
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def create(self, model, messages, max_tokens, **options):
+        with self.lock:
+            self.calls.append(messages)
+            call_number = len(self.calls)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if call_number <= self.failures:
+            raise openai.error.RateLimitError("slow down")
+        content = f"schedule #{call_number}"
+        if options.get("stream"):
+            # Streamed responses arrive as chunks carrying content deltas
+            deltas = [{"role": "assistant"}, {"content": "schedule "}]
+            deltas.append({"content": f"#{call_number}"})
+            return iter(
+                type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})]})
+                for delta in deltas
+            )
+        message = {"content": content}
+        choice = type("Choice", (), {"message": message})
+        return type("Response", (), {"choices": [choice]})
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "cache.sqlite3")
+        self.profile = {
+            "weight": 70.0,
+            "height": 175.0,
+            "age": 30,
+            "daily_calorie_limit": 2000,
+            "block_list": {"foods": [], "categories": []},
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_ignores_whitespace_differences(self):
+        first = [{"role": "user", "content": "Create  a\n    schedule"}]
+        second = [{"role": "user", "content": "Create a schedule "}]
+        self.assertEqual(
+            request_key("gpt-4", first, 150), request_key("gpt-4", second, 150)
+        )
+        self.assertNotEqual(
+            request_key("gpt-4", first, 150), request_key("gpt-4", first, 300)
+        )
+
+    def test_identical_requests_hit_persistent_cache(self):
+        completion = StubChatCompletion()
+        cache = ResponseCache(self.path)
+        analysis = Analysis(FoodLog("cache_user", log=[]), response_cache=cache)
+        with patch("openai.ChatCompletion", completion):
+            with patch("builtins.input", return_value="no"), patch("builtins.print"):
+                first = analysis.generate_gym_schedule(self.profile)
+                second = analysis.generate_gym_schedule(self.profile)
+        self.assertEqual(first, second)
+        self.assertEqual(len(completion.calls), 1)
+        cache.close()
+
+        reopened = ResponseCache(self.path)
+        key = request_key("gpt-4", completion.calls[0], 150)
+        self.assertEqual(reopened.get(key), first)
+        reopened.close()
+
+    def test_ttl_and_size_bound(self):
+        cache = ResponseCache(self.path, ttl=60, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, key.upper())
+            time.sleep(0.01)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a"))
+        with patch("llm_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(cache.get("c"))
+        cache.close()
+
+    def test_concurrent_identical_requests_are_coalesced(self):
+        completion = StubChatCompletion(delay=0.2)
+        cache = ResponseCache(self.path)
+        messages = [{"role": "user", "content": "plan"}]
+        results = []
+
+        def worker():
+            results.append(
+                cache.get_or_create(
+                    "gpt-4",
+                    messages,
+                    150,
+                    lambda: completion.create("gpt-4", messages, 150)
+                    .choices[0]
+                    .message["content"],
+                )
+            )
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(completion.calls), 1)
+        self.assertEqual(set(results), {"schedule #1"})
+        cache.close()
+
+
+class TestAsyncSchedules(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.tmp_dir.name, "cache.sqlite3"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def profile(self, weight):
+        return {
+            "weight": weight,
+            "height": 175.0,
+            "age": 30,
+            "daily_calorie_limit": 2000,
+            "block_list": {"foods": ["pizza"], "categories": []},
+        }
+
+    def test_async_variants_are_non_interactive(self):
+        completion = StubChatCompletion()
+        analysis = Analysis(FoodLog("async_user", log=[]), response_cache=self.cache)
+        with patch("openai.ChatCompletion", completion):
+            with patch("builtins.input", side_effect=AssertionError("prompted")):
+                schedule = asyncio.run(
+                    analysis.agenerate_eating_schedule(self.profile(70), "no breakfast")
+                )
+        self.assertEqual(schedule, "schedule #1")
+        self.assertIn(
+            "Adjust as follows: no breakfast", completion.calls[0][1]["content"]
+        )
+
+    def test_batch_runs_concurrently_within_bound(self):
+        completion = StubChatCompletion(delay=0.1)
+        jobs = [
+            (
+                Analysis(FoodLog(f"user{i}", log=[]), response_cache=self.cache),
+                self.profile(60 + i),
+            )
+            for i in range(6)
+        ]
+        with patch("openai.ChatCompletion", completion):
+            started = time.perf_counter()
+            results = asyncio.run(generate_schedules(jobs, concurrency=3))
+            elapsed = time.perf_counter() - started
+        self.assertEqual(len(completion.calls), 6)
+        self.assertTrue(all("schedule" in result for result in results))
+        self.assertLessEqual(completion.max_active, 3)
+        self.assertLess(elapsed, 0.5)
+
+    def test_batch_retries_then_reports_errors(self):
+        completion = StubChatCompletion(failures=2)
+        jobs = [
+            (
+                Analysis(FoodLog("retry_user", log=[]), response_cache=self.cache),
+                self.profile(70),
+            )
+        ]
+        with patch("openai.ChatCompletion", completion):
+            results = asyncio.run(generate_schedules(jobs, retries=2, backoff=0.01))
+        self.assertEqual(results, [{"schedule": "schedule #3"}])
+
+        completion = StubChatCompletion(failures=5)
+        jobs = [
+            (
+                Analysis(FoodLog("retry_user", log=[]), response_cache=self.cache),
+                self.profile(71),
+            )
+        ]
+        with patch("openai.ChatCompletion", completion):
+            results = asyncio.run(generate_schedules(jobs, retries=1, backoff=0.01))
+        self.assertEqual(len(completion.calls), 2)
+        self.assertTrue(results[0]["error"].startswith("RateLimitError"))
+
+    def test_batch_times_out_slow_calls(self):
+        completion = StubChatCompletion(delay=0.3)
+        jobs = [
+            (
+                Analysis(FoodLog("slow_user", log=[]), response_cache=self.cache),
+                self.profile(70),
+            )
+        ]
+        with patch("openai.ChatCompletion", completion):
+            results = asyncio.run(
+                generate_schedules(jobs, retries=0, timeout=0.05, backoff=0.01)
+            )
+        self.assertTrue(results[0]["error"].startswith("TimeoutError"))
+
+
+class TestChatProviders(unittest.TestCase):
+    def setUp(self):
+        self.profile = {
+            "weight": 95.0,
+            "height": 170.0,
+            "age": 40,
+            "daily_calorie_limit": 1800,
+            "block_list": {"foods": ["oatmeal"], "categories": []},
+        }
+        self.analysis = Analysis(
+            FoodLog("provider_user", log=[]),
+            response_cache=ResponseCache(":memory:"),
+            provider=LocalProvider(),
+        )
+
+    def test_local_provider_is_deterministic_and_rule_based(self):
+        provider = LocalProvider()
+        messages = self.analysis.eating_schedule_messages(self.profile, "vegetarian")
+        schedule = provider.complete(messages, 300)
+        self.assertEqual(schedule, provider.complete(messages, 300))
+        self.assertIn("Eating schedule for 1800 kcal", schedule)
+        self.assertIn("Breakfast (450 kcal): greek yogurt", schedule)
+        self.assertNotIn("oatmeal", schedule)
+        self.assertTrue(schedule.endswith("Adjusted for: vegetarian\n"))
+
+        gym = provider.complete(self.analysis.gym_schedule_messages(self.profile), 150)
+        # BMI 32.9 gets the low-impact plan
+        self.assertIn("BMI 32.9", gym)
+        self.assertIn("swimming", gym)
+        short = provider.complete(self.analysis.gym_schedule_messages(self.profile), 20)
+        self.assertLess(estimate_tokens(short), 20)
+
+    def test_schedules_stream_line_by_line_and_cache(self):
+        chunks = list(self.analysis.stream_gym_schedule(self.profile))
+        self.assertEqual(len(chunks), 8)
+        self.assertTrue(chunks[0].startswith("Weekly gym schedule"))
+        cached = list(self.analysis.stream_gym_schedule(self.profile))
+        self.assertEqual(cached, ["".join(chunks)])
+
+        with patch("builtins.input", return_value="no"):
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                schedule = self.analysis.generate_eating_schedule(self.profile)
+        self.assertEqual(stdout.getvalue(), "Generated Eating Schedule:\n" + schedule)
+
+    def test_openai_stream_and_provider_selection(self):
+        analysis = Analysis(
+            FoodLog("provider_user", log=[]),
+            response_cache=ResponseCache(":memory:"),
+            provider=llm_provider.OpenAIProvider(),
+        )
+        with patch("openai.ChatCompletion", StubChatCompletion()):
+            chunks = list(analysis.stream_gym_schedule(self.profile))
+        self.assertEqual(chunks, ["schedule ", "#1"])
+
+        with patch.object(llm_provider, "_default_provider", None), patch.dict(
+            os.environ, {"ASSISTANT_LLM_PROVIDER": "local"}
+        ):
+            self.assertIsInstance(llm_provider.default_provider(), LocalProvider)
+        with self.assertRaises(ValueError):
+            llm_provider.open_provider("gpt-5")
+
+
+class TestEatingPromptBudget(unittest.TestCase):
+    profile = {
+        "weight": 70.0,
+        "height": 175.0,
+        "age": 30,
+        "daily_calorie_limit": 2000,
+        "block_list": {"foods": ["pizza"], "categories": ["dessert"]},
+    }
+
+    def make_analysis(self, days, entries_per_day=4):
+        today = datetime(2024, 6, 30)
+        log = [
+            {
+                "date": (today - timedelta(days=day)).strftime("%Y-%m-%d"),
+                "food": f"food {meal}",
+                "category": f"en:category-{meal}",
+                "calories": 100 + meal,
+            }
+            for day in range(days)
+            for meal in range(entries_per_day)
+        ]
+        return Analysis(FoodLog("prompt_user", log=log))
+
+    def prompt_tokens(self, analysis):
+        with patch("prompts.datetime") as mock_datetime:
+            mock_datetime.now.return_value = datetime(2024, 6, 30)
+            mock_datetime.strptime = datetime.strptime
+            prompt = analysis.eating_schedule_messages(self.profile)[1]["content"]
+        return estimate_tokens(prompt)
+
+    def test_prompt_size_constant_as_log_grows(self):
+        sizes = [
+            self.prompt_tokens(self.make_analysis(days)) for days in (60, 365, 3650)
+        ]
+        self.assertEqual(len(set(sizes)), 1)
+
+    def test_recent_window_and_history_summary(self):
+        analysis = self.make_analysis(40, entries_per_day=2)
+        summary = build_intake_summary(analysis, today="2024-06-30")
+        self.assertIn("Last 7 days:", summary)
+        self.assertIn("- 2024-06-24: food 0 (100 kcal)", summary)
+        self.assertNotIn("- 2024-06-23: food 0", summary)
+        self.assertIn(
+            "- 2024-06-23: 201 kcal total; en:category-0 x1, en:category-1 x1", summary
+        )
+        self.assertNotIn("2024-05-25", summary)
+
+    def test_token_budget_is_enforced(self):
+        analysis = self.make_analysis(30, entries_per_day=50)
+        summary = build_intake_summary(analysis, today="2024-06-30", token_budget=200)
+        self.assertLessEqual(estimate_tokens(summary), 200 + 20)
+        self.assertIn("earlier entries omitted", summary)
+        self.assertIn("- 2024-06-30: food 49 (149 kcal)", summary)
+
+    def test_empty_log(self):
+        analysis = Analysis(FoodLog("prompt_user", log=[]))
+        self.assertEqual(build_intake_summary(analysis), "No food logged recently.")
+
+
+class TestDatasetPreparation(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "products.csv")
+        with open(self.source, "w") as file:
+            file.write("code\tproduct_name\tmain_category\tenergy_100g\n")
+            for i in range(250):
+                name = "" if i % 10 == 0 else f" Product {i} "
+                energy = -1 if i % 25 == 1 else i * 10
+                file.write(f"{i}\t{name}\ten:Cat{i % 3}\t{energy}\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_streams_chunks_into_shards(self):
+        out_dir = os.path.join(self.tmp_dir.name, "shards")
+        stats = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=2, sample_size=20
+        )
+        self.assertEqual(stats["rows_read"], 250)
+        self.assertEqual(stats["rows_written"], 215)
+        self.assertEqual(stats["shards"], 5)
+        self.assertEqual(len(glob.glob(os.path.join(out_dir, "part-*.jsonl"))), 5)
+        self.assertGreater(stats["rows_per_second"], 0)
+
+        shard = pd.read_json(os.path.join(out_dir, "part-00000.jsonl"), lines=True)
+        self.assertEqual(
+            list(shard.columns), ["Key", "Code", "Food", "Category", "Calories"]
+        )
+        self.assertEqual(shard["Food"].iloc[0], "product 2")
+        self.assertEqual(shard["Code"].iloc[0], 2)
+
+        sample = stats["sample"]
+        self.assertEqual(len(sample), 20)
+        self.assertFalse(sample["Food"].duplicated().any())
+
+    def test_sample_is_deterministic_and_catalog_written(self):
+        out_dir = os.path.join(self.tmp_dir.name, "shards")
+        first = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=2, sample_size=20
+        )
+        second = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=1, sample_size=20
+        )
+        self.assertEqual(list(first["sample"]["Food"]), list(second["sample"]["Food"]))
+
+        csv_path = os.path.join(self.tmp_dir.name, "catalog.csv")
+        json_path = os.path.join(self.tmp_dir.name, "catalog.json")
+        meta_path = os.path.join(self.tmp_dir.name, "catalog.meta.json")
+        data = dataset_preparation.build_catalog(
+            first["sample"], csv_path, json_path, meta_path
+        )
+        self.assertEqual(len(data), 30)
+        self.assertIn("greek yogurt", set(pd.read_json(json_path)["Food"]))
+
+        # Rebuilding the same sample leaves every catalog file untouched
+        for path in (csv_path, json_path, meta_path):
+            os.utime(path, ns=(0, 0))
+        dataset_preparation.build_catalog(
+            second["sample"], csv_path, json_path, meta_path
+        )
+        for path in (csv_path, json_path, meta_path):
+            self.assertEqual(os.stat(path).st_mtime_ns, 0)
+
+    def test_refresh_only_processes_changed_rows(self):
+        out_dir = os.path.join(self.tmp_dir.name, "shards")
+        dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=2, sample_size=20
+        )
+        with open(self.source) as file:
+            lines = file.readlines()
+        lines[3] = "2\t Product 2 \ten:Cat2\t999\n"  # changed
+        del lines[4]  # product 3 removed
+        lines[5] = "5\t Product 5 \ten:Cat2\t-7\n"  # changed and now invalid
+        lines.append("777\tNew Product\ten:Cat1\t100\n")
+        with open(self.source, "w") as file:
+            file.writelines(lines)
+
+        refresh = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=2, sample_size=20
+        )
+        self.assertEqual(refresh["generation"], 1)
+        self.assertEqual(refresh["rows_changed"], 3)
+        self.assertEqual(refresh["rows_written"], 2)
+        self.assertEqual(refresh["rows_deleted"], 2)
+        deltas = sorted(glob.glob(os.path.join(out_dir, "delta-0001-*.jsonl")))
+        self.assertEqual(len(deltas), 3)
+        delta = pd.concat(pd.read_json(path, lines=True) for path in deltas)
+        self.assertEqual(
+            set(delta.loc[~delta["Deleted"], "Food"]), {"product 2", "new product"}
+        )
+        self.assertEqual(set(delta.loc[delta["Deleted"], "Code"].dropna()), {5})
+
+        rebuilt = dataset_preparation.prepare(
+            self.source,
+            os.path.join(self.tmp_dir.name, "rebuilt"),
+            chunk_size=60,
+            workers=1,
+            sample_size=20,
+        )
+        pd.testing.assert_frame_equal(refresh["sample"], rebuilt["sample"])
+
+        def applied(directory):
+            shards = sorted(glob.glob(os.path.join(directory, "part-*.jsonl")))
+            shards += sorted(glob.glob(os.path.join(directory, "delta-*.jsonl")))
+            rows = pd.concat(pd.read_json(path, lines=True) for path in shards)
+            rows = rows.drop_duplicates("Key", keep="last")
+            if "Deleted" in rows.columns:
+                rows = rows[~rows["Deleted"].eq(True)].drop(columns="Deleted")
+            return rows.sort_values("Key").reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(
+            applied(out_dir),
+            applied(os.path.join(self.tmp_dir.name, "rebuilt")),
+            check_dtype=False,
+        )
+        manifest = dataset_preparation.load_manifest(os.path.join(out_dir, "manifest"))
+        self.assertEqual(manifest["products"], 250)
+
+        # In a worker, only changed rows and unchanged sample candidates are cleaned
+        chunk = pd.read_csv(self.source, sep="\t", dtype={"code": str}, nrows=60)
+        dataset_preparation._init_worker(os.path.join(out_dir, "manifest"))
+        try:
+            with patch("dataset_preparation.clean_rows", wraps=clean_rows) as cleaned:
+                result = dataset_preparation.process_chunk(
+                    0, chunk, self.tmp_dir.name, "jsonl", 5, 42, "check"
+                )
+        finally:
+            dataset_preparation._init_worker(None)
+        self.assertEqual(result["rows_changed"], 0)
+        self.assertEqual(sum(len(call.args[0]) for call in cleaned.call_args_list), 5)
+        self.assertEqual(len(result["sample"]), 5)
+
+        again = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=1, sample_size=20
+        )
+        self.assertEqual((again["rows_changed"], again["shards"]), (0, 0))
+        full = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=60, workers=1, full=True
+        )
+        self.assertEqual(full["generation"], 0)
+        self.assertEqual(glob.glob(os.path.join(out_dir, "delta-*")), [])
+
+    def test_calories_stay_in_kcal_with_persisted_scaler(self):
+        out_dir = os.path.join(self.tmp_dir.name, "shards")
+        stats = dataset_preparation.prepare(
+            self.source, out_dir, chunk_size=100, workers=1, sample_size=5
+        )
+        shard = pd.read_json(os.path.join(out_dir, "part-00000.jsonl"), lines=True)
+        # Product 2 has 20 kJ per 100 g
+        self.assertAlmostEqual(shard["Calories"].iloc[0], 4.8)
+
+        csv_path = os.path.join(self.tmp_dir.name, "catalog.csv")
+        json_path = os.path.join(self.tmp_dir.name, "catalog.json")
+        meta_path = os.path.join(self.tmp_dir.name, "catalog.meta.json")
+        data = dataset_preparation.build_catalog(
+            stats["sample"], csv_path, json_path, meta_path
+        )
+        almonds = data[data["Food"] == "almonds"].iloc[0]
+        self.assertEqual(almonds["Calories"], 579)
+        with open(meta_path) as file:
+            scaler = json.load(file)["calories_scaler"]
+        self.assertAlmostEqual(
+            almonds["CaloriesScaled"],
+            (579 - scaler["min"]) / (scaler["max"] - scaler["min"]),
+        )
+
+        # A later delta reuses the stored parameters instead of refitting
+        delta = pd.DataFrame(
+            {"Food": ["lard"], "Category": ["en:fats"], "Calories": [902.0]}
+        )
+        data = dataset_preparation.build_catalog(delta, csv_path, json_path, meta_path)
+        lard = data[data["Food"] == "lard"].iloc[0]
+        self.assertAlmostEqual(
+            lard["CaloriesScaled"],
+            (902 - scaler["min"]) / (scaler["max"] - scaler["min"]),
+        )
+
+    def test_shipped_catalog_holds_kcal(self):
+        data = pd.read_csv("cleaned_sampled_food_dataset.csv")
+        self.assertEqual(data.loc[data["Food"] == "banana", "Calories"].iloc[-1], 89)
+        self.assertGreater(data["Calories"].median(), 1)
+        self.assertTrue(data["CaloriesScaled"].between(0, 1).all())
+
+    def test_names_are_normalized_and_deduplicated(self):
+        self.assertEqual(normalize_name("  Greek\tYOGURT  "), "greek yogurt")
+        data = pd.DataFrame(
+            {
+                "Food": ["fruit gummies", "fruit gummies", "apple", "apple"],
+                "Category": ["en:candies", "en:candies", "en:fruits", "en:snacks"],
+                "Calories": [300.0, 320.0, 52.0, 60.0],
+            }
+        )
+        deduped = dataset_preparation.dedupe_foods(data)
+        self.assertEqual(len(deduped), 3)
+        self.assertEqual(deduped["Calories"].iloc[0], 310.0)
+        catalog = pd.read_csv("cleaned_sampled_food_dataset.csv")
+        self.assertFalse(catalog.duplicated(["Food", "Category"]).any())
+
+
+class TestFoodCatalog(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.catalog = FoodCatalog.build_from_csv(
+            "cleaned_sampled_food_dataset.csv",
+            os.path.join(cls.tmp_dir.name, "catalog"),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_reopen_maps_same_data(self):
+        reopened = FoodCatalog(self.catalog.path)
+        self.assertEqual(
+            len(reopened), len(pd.read_csv("cleaned_sampled_food_dataset.csv"))
+        )
+        self.assertEqual(reopened.lookup("banana"), self.catalog.lookup("banana"))
+
+    def test_exact_lookup(self):
+        entry = self.catalog.lookup("salmon fillet")
+        self.assertEqual(entry["category"], "en:fish")
+        self.assertIsNone(self.catalog.lookup("greek yog"))
+        self.assertIsNone(self.catalog.calories_for("no such food"))
+
+    def test_prefix_is_sorted_and_distinct(self):
+        results = [entry["food"] for entry in self.catalog.prefix("fruit", limit=50)]
+        self.assertIn("fruit gummies", results)
+        self.assertEqual(results, sorted(set(results)))
+        self.assertTrue(all(name.startswith("fruit") for name in results))
+        self.assertEqual(
+            self.catalog.prefix("  FRUIT", limit=50),
+            self.catalog.prefix("fruit", limit=50),
+        )
+        self.assertEqual(self.catalog.prefix("Greek"), self.catalog.prefix("greek"))
+        self.assertTrue(self.catalog.prefix("Greek"))
+        self.assertTrue(
+            all(" " in entry["food"] for entry in self.catalog.prefix("Fruit "))
+        )
+
+    def test_trigram_search_tolerates_typos(self):
+        results = [entry["food"] for entry in self.catalog.search("salmon filet")]
+        self.assertEqual(results[0], "salmon fillet")
+        self.assertEqual(
+            self.catalog.search("Salmon  Filet")[0]["food"], "salmon fillet"
+        )
+        self.assertEqual(self.catalog.search(""), [])
+
+    def test_category_index(self):
+        fruits = {entry["food"] for entry in self.catalog.by_category("en:fruits")}
+        self.assertTrue({"banana", "avocado"} <= fruits)
+        self.assertEqual(self.catalog.by_category("en:unknown"), [])
+
+    def test_fuzzy_match_to_canonical_names(self):
+        match = self.catalog.match("Greek  Yoghurt ")
+        self.assertEqual(match["food"], "greek yogurt")
+        self.assertGreaterEqual(match["similarity"], 0.5)
+        self.assertEqual(self.catalog.match("BANANA")["similarity"], 1.0)
+        self.assertEqual(
+            self.catalog.canonical_name("grilled chiken breast"),
+            "grilled chicken breast",
+        )
+        self.assertIsNone(self.catalog.match("zzqx"))
+        self.assertEqual(self.catalog.canonical_name("Zzqx  Bar"), "zzqx bar")
+
+    def test_food_log_stores_canonical_names(self):
+        food_log = FoodLog("match_user", log=[], catalog=self.catalog)
+        with patch.object(food_log.journal, "append_lines"):
+            food_log.add_entry("greek yoghurt ", "en:dairy", 100, date_str="2024-01-01")
+            food_log.import_entries(
+                [
+                    {
+                        "date": "2024-01-02",
+                        "food": "Greek Yogurt",
+                        "category": "en:dairy",
+                        "calories": 120,
+                    },
+                    {
+                        "date": "2024-01-02",
+                        "food": "bananna",
+                        "category": "en:fruits",
+                        "calories": 89,
+                    },
+                ]
+            )
+        analysis = Analysis(food_log)
+        report = analysis.get_report("2024-01-07")
+        self.assertEqual(report["foods"][0], ("greek yogurt", 2))
+        self.assertIn(("banana", 1), report["foods"])
+
+
+class TestRecommender(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        data = pd.DataFrame(
+            {
+                "Food": ["apple", "apple", "cake", "rice", "steak", "salad", "lard"],
+                "Category": [
+                    "en:fruits",
+                    "en:fruits",
+                    "en:desserts",
+                    "en:grains",
+                    "en:meats",
+                    "en:vegetables",
+                    "en:fats",
+                ],
+                "Calories": [52, 52, 350, 130, 270, 20, 900],
+            }
+        )
+        cls.catalog = FoodCatalog.build(data, os.path.join(cls.tmp_dir.name, "catalog"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def profile(self, foods=(), categories=()):
+        return {
+            "daily_calorie_limit": 2000,
+            "block_list": {"foods": list(foods), "categories": list(categories)},
+        }
+
+    def test_block_filter_dedupes_and_masks(self):
+        block_filter = BlockFilter(
+            {"foods": ["Rice ", "rice"], "categories": ["EN:Desserts"]}
+        )
+        self.assertEqual(block_filter.foods, {"rice"})
+        self.assertFalse(block_filter.allows("cake", "en:desserts"))
+        mask = block_filter.mask(self.catalog)
+        blocked = {self.catalog.name(row) for row in np.flatnonzero(~mask)}
+        self.assertEqual(blocked, {"rice", "cake"})
+
+    def test_recommend_fits_remaining_and_skips_blocked(self):
+        recommender = Recommender(self.catalog)
+        results = recommender.recommend(
+            self.profile(["steak"], ["en:desserts"]), 300, k=3
+        )
+        # Closest portion to 300 kcal, lighter foods first at a similar fit
+        self.assertEqual(
+            [entry["food"] for entry in results], ["rice", "apple", "salad"]
+        )
+        self.assertEqual(
+            (results[0]["grams"], results[0]["portion_calories"]), (200, 260.0)
+        )
+        # Dense foods rank last even when a small portion fills the target
+        ranked = recommender.recommend(self.profile(), 500)
+        self.assertEqual(ranked[0]["food"], "rice")
+        self.assertEqual(ranked[-1]["food"], "lard")
+        self.assertEqual(recommender.recommend(self.profile(), 5), [])
+        fruits = recommender.recommend(self.profile(), 500, category="en:fruits")
+        self.assertEqual([entry["food"] for entry in fruits], ["apple"])
+
+    def test_masks_are_cached_per_block_list(self):
+        recommender = Recommender(self.catalog)
+        first = recommender.allowed_mask({"foods": ["apple"], "categories": []})
+        second = recommender.allowed_mask(
+            {"foods": ["apple", "apple"], "categories": []}
+        )
+        self.assertIs(first, second)
+
+    def test_analysis_suggests_within_remaining_calories(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        food_log = FoodLog(
+            "suggest_user",
+            log=[{"date": today, "food": "x", "category": "y", "calories": 1750}],
+        )
+        suggestions = Analysis(food_log).suggest_foods(
+            self.profile(), Recommender(self.catalog), k=2
+        )
+        self.assertEqual({entry["food"] for entry in suggestions}, {"rice", "apple"})
+        self.assertTrue(all(entry["portion_calories"] <= 250 for entry in suggestions))
+
+
+class TestMealPlanner(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.catalog = FoodCatalog.build_from_csv(
+            "cleaned_sampled_food_dataset.csv",
+            os.path.join(cls.tmp_dir.name, "catalog"),
+        )
+        cls.recommender = Recommender(cls.catalog)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def profile(self, limit=2000, foods=(), categories=()):
+        return {
+            "weight": 70.0,
+            "height": 175.0,
+            "age": 30,
+            "daily_calorie_limit": limit,
+            "block_list": {"foods": list(foods), "categories": list(categories)},
+        }
+
+    def test_plan_meets_limit_and_avoids_blocked(self):
+        for limit in (1200, 2000, 2600):
+            plan = plan_day(
+                self.recommender, self.profile(limit, categories=["en:breads"])
+            )
+            self.assertEqual(len(plan["meals"]), 4)
+            self.assertLessEqual(plan["total_calories"], limit)
+            self.assertGreaterEqual(plan["total_calories"], limit * 0.95)
+            self.assertNotIn("en:breads", [meal["category"] for meal in plan["meals"]])
+            self.assertEqual(len({meal["category"] for meal in plan["meals"]}), 4)
+
+    def test_plan_is_deterministic_and_varies_from_history(self):
+        first = plan_day(self.recommender, self.profile())
+        self.assertEqual(first, plan_day(self.recommender, self.profile()))
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        log = [
+            {
+                "date": today,
+                "food": meal["food"],
+                "category": meal["category"],
+                "calories": 100,
+            }
+            for meal in first["meals"]
+        ]
+        second = plan_day(
+            self.recommender, self.profile(), FoodLog("planner_user", log=log)
+        )
+        eaten = {meal["food"] for meal in first["meals"]}
+        self.assertFalse(eaten & {meal["food"] for meal in second["meals"]})
+
+    def test_runs_fast_on_large_catalog(self):
+        rng = np.random.default_rng(0)
+        size = 100_000
+        data = pd.DataFrame(
+            {
+                "Food": [f"food {i}" for i in range(size)],
+                "Category": [f"en:category-{i % 300}" for i in range(size)],
+                "Calories": rng.random(size) * 900,
+            }
+        )
+        catalog = FoodCatalog.build(data, os.path.join(self.tmp_dir.name, "large"))
+        recommender = Recommender(catalog)
+        plan_day(recommender, self.profile())
+        started = time.perf_counter()
+        plan = plan_day(recommender, self.profile())
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertTrue(1990 <= plan["total_calories"] <= 2000)
+
+    def test_eating_schedule_falls_back_offline(self):
+        analysis = Analysis(
+            FoodLog("planner_user", log=[]),
+            response_cache=ResponseCache(":memory:"),
+            recommender=self.recommender,
+        )
+        failing = StubChatCompletion(failures=10)
+        with patch("openai.ChatCompletion", failing):
+            with patch("builtins.input", return_value="no"), patch("builtins.print"):
+                schedule = analysis.generate_eating_schedule(self.profile())
+        self.assertIn("Breakfast:", schedule)
+        self.assertIn("of 2000 kcal", schedule)
+
+
+class TestTrends(unittest.TestCase):
+    def setUp(self):
+        days = [(1, 2500), (2, 2500), (3, 1000), (5, 3000), (6, 100), (13, 1900)]
+        log = [
+            {
+                "date": f"2024-01-{day:02d}",
+                "food": "meal",
+                "category": f"en:c{day % 2}",
+                "calories": kcal,
+            }
+            for day, kcal in days
+        ]
+        self.profile = {"daily_calorie_limit": 2000}
+        self.food_log = FoodLog("trend_user", log=log)
+        self.trends = Trends(self.food_log, self.profile)
+
+    def test_daily_totals_fill_gaps(self):
+        daily = self.trends.daily_totals()
+        self.assertEqual(len(daily), 13)
+        self.assertEqual(daily.loc["2024-01-04", "total"], 0)
+        self.assertEqual(daily.loc["2024-01-05", "difference"], 1000)
+        self.assertEqual(int(daily["over_limit"].sum()), 3)
+
+    def test_large_calories_do_not_wrap(self):
+        self.food_log.add_entry(
+            "feast", "en:c0", 3_000_000_000, date_str="2024-01-14", flush=False
+        )
+        daily = self.trends.daily_totals()
+        self.assertEqual(daily.loc["2024-01-14", "total"], 3_000_000_000)
+        self.assertTrue(daily.loc["2024-01-14", "over_limit"])
+
+    def test_rolling_averages(self):
+        averages = self.trends.rolling_averages()
+        self.assertAlmostEqual(averages.loc["2024-01-03", "avg_7d"], 2000)
+        self.assertAlmostEqual(averages.loc["2024-01-13", "avg_7d"], 1900 / 7)
+        self.assertAlmostEqual(averages.loc["2024-01-13", "avg_30d"], 11000 / 13)
+
+    def test_streaks(self):
+        streaks = self.trends.over_limit_streaks()
+        self.assertEqual(list(streaks["days"]), [2, 1])
+        self.assertEqual(streaks.loc[0, "start"], pd.Timestamp("2024-01-01"))
+        self.assertEqual(self.trends.current_streak(), 0)
+
+    def test_category_share(self):
+        share = self.trends.category_share()
+        self.assertTrue(np.allclose(share.sum(axis=1), 1.0))
+        self.assertAlmostEqual(share.iloc[0]["en:c1"], 6500 / 9100)
+
+    def test_frame_is_cached_and_extended_on_append(self):
+        frame = self.trends.frame
+        totals = self.trends.daily_totals()
+        self.assertIs(self.trends.frame, frame)
+        self.assertIs(self.trends.daily_totals(), totals)
+
+        with patch.object(self.food_log.journal, "append_lines"):
+            self.food_log.add_entry("cake", "en:c1", 600, date_str="2024-01-13")
+        self.assertEqual(len(self.trends.frame), 7)
+        self.assertEqual(self.trends.daily_totals().loc["2024-01-13", "total"], 2500)
+        self.assertEqual(self.trends.current_streak(), 1)
+
+        self.profile["daily_calorie_limit"] = 3000
+        self.assertEqual(self.trends.current_streak(), 0)
+
+
+class TestCohort(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        directory = self.tmp_dir.name
+
+        def write_profile(username, limit, foods=(), categories=()):
+            with open(os.path.join(directory, f"{username}_profile.json"), "w") as file:
+                json.dump(
+                    {
+                        "weight": 70,
+                        "height": 175,
+                        "age": 30,
+                        "daily_calorie_limit": limit,
+                        "block_list": {
+                            "foods": list(foods),
+                            "categories": list(categories),
+                        },
+                    },
+                    file,
+                )
+
+        write_profile("alice", 2000, foods=["cake"])
+        write_profile("bob", 1500, categories=["snack"])
+        with open(os.path.join(directory, "alice_food_log.jsonl"), "w") as file:
+            for date, food, category, calories in [
+                ("2024-01-01", "cake", "dessert", 2500),
+                ("2024-01-02", "apple", "fruit", 100),
+            ]:
+                file.write(
+                    json.dumps(
+                        {
+                            "date": date,
+                            "food": food,
+                            "category": category,
+                            "calories": calories,
+                        }
+                    )
+                    + "\n"
+                )
+        # Legacy single-document log, read without being migrated
+        self.legacy_path = os.path.join(directory, "bob_food_log.json")
+        with open(self.legacy_path, "w") as file:
+            json.dump(
+                [
+                    {
+                        "date": "2024-01-01",
+                        "food": "chips",
+                        "category": "snack",
+                        "calories": 800,
+                    },
+                    {
+                        "date": "2024-01-01",
+                        "food": "pear",
+                        "category": "fruit",
+                        "calories": 90,
+                    },
+                ],
+                file,
+            )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_discover_users(self):
+        self.assertEqual(cohort.discover_users(self.tmp_dir.name), ["alice", "bob"])
+
+    def test_analyze_user_is_read_only(self):
+        result = cohort.analyze_user(self.tmp_dir.name, "bob")
+        self.assertEqual(result["entries"], 2)
+        self.assertEqual(result["days_over_limit"], 0)
+        self.assertEqual(result["blocked_violations"], 1)
+        self.assertTrue(os.path.exists(self.legacy_path))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmp_dir.name, "bob_food_log.jsonl"))
+        )
+
+    def test_cohort_report(self):
+        report = cohort.cohort_report(self.tmp_dir.name, workers=2, top=2)
+        self.assertEqual(report["users"], 2)
+        self.assertEqual(report["users_with_profile"], 2)
+        self.assertEqual(report["entries"], 4)
+        self.assertEqual(report["total_calories"], 3490)
+        self.assertEqual(report["days_over_limit"], 1)
+        self.assertEqual(report["blocked_violations"], 2)
+        self.assertEqual(report["users_with_violations"], 2)
+        self.assertAlmostEqual(report["overall_adherence"], 2 / 3)
+        self.assertAlmostEqual(report["mean_user_adherence"], 0.75)
+        self.assertEqual(report["top_categories"][0], ("fruit", 2))
+        self.assertEqual(report["failed_users"], {})
+
+    def test_bad_user_files_do_not_abort_the_report(self):
+        directory = self.tmp_dir.name
+        with open(os.path.join(directory, "carl_profile.json"), "w") as file:
+            file.write('{"weight": 70, "daily_')
+        with open(os.path.join(directory, "dana_profile.json"), "w") as file:
+            json.dump({"daily_calorie_limit": 2000}, file)
+        with open(os.path.join(directory, "dana_food_log.jsonl"), "w") as file:
+            file.write(
+                json.dumps(
+                    {"date": "2024-01-01", "food": "x", "category": "y", "calories": 1}
+                )
+                + "\n"
+            )
+
+        report = cohort.cohort_report(directory, workers=2)
+        self.assertEqual(report["users"], 2)
+        self.assertEqual(sorted(report["failed_users"]), ["carl", "dana"])
+        self.assertTrue(report["failed_users"]["carl"].startswith("JSONDecodeError"))
+        self.assertTrue(report["failed_users"]["dana"].startswith("KeyError"))
+
+
+class TestPersistence(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = JSONFileStorage(self.tmp_dir.name)
+        self.profile = {
+            "weight": 70.0,
+            "height": 175.0,
+            "age": 30,
+            "daily_calorie_limit": 2000,
+            "block_list": {"foods": [], "categories": []},
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_burst_of_edits_is_one_write_after_the_debounce(self):
+        persister = Persister(delay=0.2)
+        writes = []
+        for value in range(50):
+            persister.mark_dirty("key", lambda value=value: writes.append(value))
+        self.assertEqual(writes, [])
+        self.wait_for(lambda: writes)
+        self.assertEqual(writes, [49])
+
+        # Continuous marking is still written after max_delay
+        persister.max_delay = 0.3
+        started = time.monotonic()
+        while not writes[1:]:
+            self.assertLess(time.monotonic() - started, 5.0)
+            persister.mark_dirty("key", lambda: writes.append("busy"))
+            time.sleep(0.02)
+        persister.close()
+        with self.assertRaises(RuntimeError):
+            persister.mark_dirty("key", lambda: None)
+
+    def test_failed_writes_are_retried(self):
+        persister = Persister(delay=60)
+        attempts = []
+
+        def write():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise OSError("disk full")
+
+        persister.mark_dirty("key", write)
+        persister.mark_dirty("other", lambda: attempts.append(2))
+        with self.assertRaises(OSError):
+            persister.flush()
+        self.assertEqual(attempts, [1, 2])
+        persister.close()
+        self.assertEqual(attempts, [1, 2, 1])
+
+    def test_block_list_sync_coalesces_profile_writes(self):
+        persister = Persister(delay=60)
+        user = User(
+            "sync_user", profile=self.profile, storage=self.storage, persister=persister
+        )
+        with patch.object(
+            self.storage, "save_profile", wraps=self.storage.save_profile
+        ) as save:
+            for index in range(20):
+                user.block("foods", f"food {index}")
+                user.save_later()
+            self.assertFalse(self.storage.profile_exists("sync_user"))
+            persister.close()
+        self.assertEqual(save.call_count, 1)
+        saved = self.storage.load_profile("sync_user")
+        self.assertEqual(len(saved["block_list"]["foods"]), 20)
+
+    def test_log_instances_flush_independently(self):
+        persister = Persister(delay=60)
+        logs = [
+            FoodLog("shared_user", storage=self.storage, persister=persister)
+            for _ in range(2)
+        ]
+        for food_log, food in zip(logs, ("egg", "rice")):
+            food_log.append_entry(make_entry(food, "en:food", 100), flush=False)
+            food_log.flush_later()
+        persister.close()
+        foods = {
+            entry["food"] for entry in FoodLog("shared_user", storage=self.storage).log
+        }
+        self.assertEqual(foods, {"egg", "rice"})
+
+    def test_logged_food_is_appended_in_one_batch(self):
+        persister = Persister(delay=60)
+        food_log = FoodLog("batch_user", storage=self.storage, persister=persister)
+        answers = ["egg", "en:eggs", "155"] * 3
+        with patch("builtins.input", side_effect=answers), patch("builtins.print"):
+            for _ in range(3):
+                food_log.log_food({})
+        with patch.object(
+            food_log.journal, "append", wraps=food_log.journal.append
+        ) as append:
+            persister.close()
+        append.assert_called_once()
+        self.assertEqual(len(FoodLog("batch_user", storage=self.storage).log), 3)
+
+    def test_durability_modes(self):
+        with patch.dict(os.environ, {"ASSISTANT_DURABILITY": "strict"}):
+            self.assertIsNone(persistence.get_persister())
+        with patch.dict(os.environ, {"ASSISTANT_DURABILITY": "eventually"}):
+            with self.assertRaises(ValueError):
+                persistence.durability()
+
+        relaxed = open_storage(f"json:{self.tmp_dir.name}", fsync=False)
+        with patch("os.fsync") as fsync:
+            relaxed.save_profile("fast_user", self.profile)
+            relaxed.append_entries("fast_user", [make_entry("egg", "en:eggs", 155)])
+            fsync.assert_not_called()
+            self.storage.save_profile("safe_user", self.profile)
+            fsync.assert_called()
+        self.assertEqual(relaxed.load_profile("fast_user"), self.profile)
+
+
+class TestStorageBackends(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.entries = [
+            {
+                "date": "2024-01-01",
+                "food": "egg",
+                "category": "en:eggs",
+                "calories": 155,
+            },
+            {
+                "date": "2024-01-02",
+                "food": "rice",
+                "category": "en:grains",
+                "calories": 130,
+            },
+        ]
+        self.profile = {
+            "weight": 70.0,
+            "height": 175.0,
+            "age": 30,
+            "daily_calorie_limit": 2000,
+            "block_list": {"foods": [], "categories": []},
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def backends(self):
+        sqlite_storage = SQLiteStorage(os.path.join(self.tmp_dir.name, "db.sqlite3"))
+        self.addCleanup(sqlite_storage.close)
+        return [
+            JSONFileStorage(self.tmp_dir.name),
+            sqlite_storage,
+            MemoryStorage(),
+        ]
+
+    def test_profiles_and_logs_round_trip(self):
+        for storage in self.backends():
+            with self.subTest(storage=type(storage).__name__):
+                self.assertIsNone(storage.load_profile("alice"))
+                self.assertFalse(storage.profile_exists("alice"))
+                storage.save_profile("alice", self.profile)
+                self.assertEqual(storage.load_profile("alice"), self.profile)
+                self.assertTrue(storage.profile_exists("alice"))
+
+                storage.append_entries("alice", self.entries[:1])
+                storage.log("alice").append_lines(json.dumps(self.entries[1]) + "\n")
+                self.assertEqual(storage.log("alice").load(), self.entries)
+                storage.log("alice").compact(self.entries[1:])
+                self.assertEqual(storage.log("alice").load(), self.entries[1:])
+                self.assertEqual(storage.log("bob").load(), [])
+
+    def test_user_and_food_log_use_the_backend(self):
+        for storage in self.backends():
+            with self.subTest(storage=type(storage).__name__):
+                profile = json.loads(json.dumps(self.profile))
+                user = User("carol", profile=profile, storage=storage)
+                user.block("foods", "Cake")
+                user.save_profile()
+                food_log = FoodLog("carol", storage=storage)
+                food_log.add_entry("egg", "en:eggs", 155, date_str="2024-01-01")
+
+                reloaded = FoodLog("carol", storage=storage)
+                self.assertEqual(reloaded.get_daily_calories("2024-01-01"), 155)
+                self.assertEqual(
+                    User("carol", storage=storage).profile["block_list"]["foods"],
+                    ["cake"],
+                )
+
+    def test_sqlite_transaction_is_atomic(self):
+        storage = SQLiteStorage(os.path.join(self.tmp_dir.name, "db.sqlite3"))
+        self.addCleanup(storage.close)
+        with self.assertRaises(RuntimeError):
+            with storage.transaction():
+                storage.save_profile("dave", self.profile)
+                storage.append_entries("dave", self.entries)
+                raise RuntimeError("crash mid-batch")
+        self.assertIsNone(storage.load_profile("dave"))
+        self.assertEqual(storage.log("dave").load(), [])
+
+        with storage.transaction():
+            storage.save_profile("dave", self.profile)
+            storage.append_entries("dave", self.entries)
+        self.assertEqual(storage.log("dave").load(), self.entries)
+
+    def test_sqlite_pool_serves_concurrent_writers(self):
+        storage = SQLiteStorage(
+            os.path.join(self.tmp_dir.name, "db.sqlite3"), pool_size=2
+        )
+        self.addCleanup(storage.close)
+
+        def write(index):
+            for entry in self.entries:
+                storage.append_entries(f"user{index}", [entry])
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(storage._created, 2)
+        for index in range(6):
+            self.assertEqual(storage.log(f"user{index}").load(), self.entries)
+
+    def test_open_storage_specs(self):
+        self.assertIsInstance(open_storage("memory"), MemoryStorage)
+        json_storage = open_storage(f"json:{self.tmp_dir.name}")
+        self.assertEqual(json_storage.directory, self.tmp_dir.name)
+        sqlite_storage = open_storage(f"sqlite:{self.tmp_dir.name}/a.sqlite3")
+        self.addCleanup(sqlite_storage.close)
+        self.assertIsInstance(sqlite_storage, SQLiteStorage)
+        with self.assertRaises(ValueError):
+            open_storage("redis")
+
+    def test_incomplete_backend_fails_on_creation(self):
+        class ProfilesOnly(Storage):
+            def load_profile(self, username):
+                return None
+
+            def save_profile(self, username, profile):
+                pass
+
+        with self.assertRaises(TypeError):
+            ProfilesOnly()
+        with self.assertRaises(TypeError):
+            llm_provider.ChatProvider()
+
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def run_cli(self, *argv):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            code = main.main(list(argv))
+        output = stdout.getvalue() or stderr.getvalue()
+        return code, json.loads(output)
+
+    def create_profile(self):
+        return self.run_cli(
+            "-u",
+            "cli_user",
+            "profile",
+            "set",
+            "--weight",
+            "70",
+            "--height",
+            "175",
+            "--age",
+            "30",
+            "--daily-calorie-limit",
+            "2000",
+        )
+
+    def test_profile_set_creates_then_updates(self):
+        code, profile = self.create_profile()
+        self.assertEqual(code, main.EXIT_OK)
+        self.assertEqual(profile["daily_calorie_limit"], 2000)
+
+        code, profile = self.run_cli(
+            "-u", "cli_user", "profile", "set", "--daily-calorie-limit", "1800"
+        )
+        self.assertEqual(profile["daily_calorie_limit"], 1800)
+        self.assertEqual(profile["weight"], 70.0)
+        with open("cli_user_profile.json") as file:
+            self.assertEqual(json.load(file)["daily_calorie_limit"], 1800)
+
+        code, error = self.run_cli("-u", "new_user", "profile", "set", "--age", "30")
+        self.assertEqual(code, main.EXIT_ERROR)
+        self.assertIn("--weight", error["error"])
+
+    def test_log_status_and_report(self):
+        self.create_profile()
+        code, entry = self.run_cli(
+            "-u", "cli_user", "log", "Apple", "Fruit", "95", "--date", "2024-01-02"
+        )
+        self.assertEqual(code, main.EXIT_OK)
+        self.assertEqual(entry["food"], "apple")
+        self.run_cli("-u", "cli_user", "log", "cake", "dessert", "2100")
+
+        code, status = self.run_cli("-u", "cli_user", "status")
+        self.assertEqual(code, main.EXIT_OK)
+        self.assertTrue(status["exceeded"])
+        self.assertEqual(status["remaining"], -100)
+
+        code, report = self.run_cli(
+            "-u", "cli_user", "report", "--end-date", "2024-01-07"
+        )
+        self.assertEqual(report["total_calories"], 95)
+        self.assertEqual(report["foods"], [["apple", 1]])
+        code, _ = self.run_cli("-u", "cli_user", "report", "--days", "0")
+        self.assertEqual(code, main.EXIT_ERROR)
+
+    def test_status_does_not_build_analysis(self):
+        self.create_profile()
+        self.run_cli("-u", "cli_user", "log", "pear", "fruit", "57")
+        with patch("analysis.Analysis") as analysis:
+            code, status = self.run_cli("-u", "cli_user", "status")
+        self.assertEqual(code, main.EXIT_OK)
+        analysis.assert_not_called()
+        self.assertEqual(status["total_calories"], 57)
+
+    def test_log_does_not_read_existing_log(self):
+        self.create_profile()
+        with patch("food_log.FoodLog.load_log") as load_log:
+            code, _ = self.run_cli("-u", "cli_user", "log", "pear", "fruit", "57")
+        self.assertEqual(code, main.EXIT_OK)
+        load_log.assert_not_called()
+        self.assertEqual(len(FoodLog("cli_user").log), 1)
+
+    def test_block_add_and_import(self):
+        self.create_profile()
+        code, block_list = self.run_cli(
+            "-u", "cli_user", "block", "add", "food", "Cake"
+        )
+        self.assertEqual(block_list["foods"], ["cake"])
+
+        with open("entries.csv", "w") as file:
+            file.write("date,food,category,calories\n")
+            file.write("2024-01-01,apple,fruit,95\n")
+            file.write("2024-01-01,bad,fruit,-5\n")
+        code, counts = self.run_cli("-u", "cli_user", "import", "entries.csv")
+        self.assertEqual(code, main.EXIT_OK)
+        self.assertEqual(counts["imported"], 1)
+        self.assertEqual(counts["invalid"], 1)
+
+    def test_exit_codes(self):
+        code, error = self.run_cli("-u", "ghost", "status")
+        self.assertEqual(code, main.EXIT_NOT_FOUND)
+        self.assertIn("ghost", error["error"])
+
+        self.create_profile()
+        code, _ = self.run_cli("-u", "cli_user", "log", "apple", "fruit", "0")
+        self.assertEqual(code, main.EXIT_ERROR)
+
+        failing = StubChatCompletion(failures=10)
+        with patch("openai.ChatCompletion", failing):
+            with patch(
+                "analysis.default_response_cache", lambda: ResponseCache(":memory:")
+            ):
+                code, error = self.run_cli("-u", "cli_user", "schedule", "gym")
+        self.assertEqual(code, main.EXIT_UNAVAILABLE)
+        self.assertIn("RateLimitError", error["error"])
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit) as raised:
+                main.main(["-u", "cli_user", "unknown"])
+        self.assertEqual(raised.exception.code, 2)
+
+    def test_schedule_streams_plain_text(self):
+        self.create_profile()
+        stdout = io.StringIO()
+        with patch(
+            "analysis.default_response_cache", lambda: ResponseCache(":memory:")
+        ), contextlib.redirect_stdout(stdout):
+            code = main.main(
+                ["-u", "cli_user", "schedule", "eating", "--provider", "local"]
+                + ["--stream"]
+            )
+        self.assertEqual(code, main.EXIT_OK)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], "Eating schedule for 2000 kcal:")
+        self.assertEqual(len(lines), 5)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_suite_reports_machine_readable_results(self):
+        report = benchmark.run_suite(log_sizes=(100,), only={"queries", "analysis"})
+        names = {row["name"] for row in report["results"]}
+        self.assertIn("food_log.get_daily_calories", names)
+        self.assertIn("analysis.generate_weekly_report", names)
+        for row in report["results"]:
+            self.assertEqual(row["params"], {"entries": 100})
+            self.assertGreater(row["seconds"], 0)
+        json.dumps(report)
+
+    def test_compare_flags_regressions(self):
+        def report(seconds):
+            return {
+                "results": [
+                    {"name": "a", "params": {"entries": 10}, "seconds": seconds},
+                    {"name": "b", "params": {"entries": 10}, "seconds": 1.0},
+                ]
+            }
+
+        rows = benchmark.compare(report(1.0), report(1.5), threshold=0.2)
+        self.assertEqual([row["name"] for row in rows], ["a", "b"])
+        self.assertTrue(rows[0]["regressed"])
+        self.assertAlmostEqual(rows[0]["ratio"], 1.5)
+        self.assertFalse(rows[1]["regressed"])
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.reset()
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def test_disabled_registry_records_nothing(self):
+        registry = metrics.Metrics()
+
+        @registry.timed("work")
+        def work(value):
+            return value * 2
+
+        self.assertEqual(work(21), 42)
+        with registry.timer("block"):
+            registry.increment("calls")
+        self.assertEqual(registry.snapshot(), {"counters": {}, "timers": {}})
+
+    def test_timers_counters_and_prometheus_export(self):
+        registry = metrics.Metrics(enabled=True)
+
+        @registry.timed("food_log.load_log")
+        def load():
+            return []
+
+        load()
+        load()
+        registry.increment("llm_cache.hits", 3)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["timers"]["food_log.load_log"]["count"], 2)
+        self.assertEqual(snapshot["counters"]["llm_cache.hits"], 3)
+
+        text = registry.to_prometheus()
+        self.assertIn("# TYPE assistant_llm_cache_hits_total counter", text)
+        self.assertIn("assistant_llm_cache_hits_total 3\n", text)
+        self.assertIn("assistant_food_log_load_log_seconds_count 2\n", text)
+
+    def test_storage_analysis_and_llm_are_instrumented(self):
+        food_log = FoodLog("metrics_user")
+        food_log.add_entry("egg", "en:eggs", 155, date_str="2024-01-01")
+        FoodLog("metrics_user")
+        analysis = Analysis(food_log, response_cache=ResponseCache(":memory:"))
+        analysis.get_report("2024-01-07")
+        analysis.get_report("2024-01-07")
+
+        profile = {
+            "weight": 70.0,
+            "height": 175.0,
+            "age": 30,
+            "daily_calorie_limit": 2000,
+            "block_list": {"foods": [], "categories": []},
+        }
+        with patch("openai.ChatCompletion", StubChatCompletion()):
+            with patch("builtins.input", return_value="no"), patch("builtins.print"):
+                analysis.generate_gym_schedule(profile)
+                analysis.generate_gym_schedule(profile)
+
+        snapshot = metrics.snapshot()
+        counters, timers = snapshot["counters"], snapshot["timers"]
+        self.assertEqual(timers["storage.json.append"]["count"], 1)
+        self.assertEqual(timers["food_log.load_log"]["count"], 2)
+        self.assertEqual(counters["analysis.report_cache.hits"], 1)
+        self.assertEqual(counters["analysis.report_cache.misses"], 1)
+        self.assertEqual(counters["llm.requests"], 1)
+        self.assertEqual(counters["llm_cache.misses"], 1)
+        self.assertEqual(counters["llm_cache.hits"], 1)
+        self.assertGreater(counters["llm.prompt_tokens"], 0)
+        self.assertIn("llm.request", timers)
+
+    def test_cli_writes_metrics_and_profile(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.main(
+                [
+                    "-u",
+                    "cli_user",
+                    "--metrics",
+                    "metrics.prom",
+                    "--profile",
+                    "command.pstats",
+                    "profile",
+                    "set",
+                    "--weight",
+                    "70",
+                    "--height",
+                    "175",
+                    "--age",
+                    "30",
+                    "--daily-calorie-limit",
+                    "2000",
+                ]
+            )
+        with open("metrics.prom") as file:
+            self.assertIn(
+                "assistant_storage_json_save_profile_seconds_count 1", file.read()
+            )
+        import pstats
+
+        self.assertGreater(pstats.Stats("command.pstats").total_calls, 0)
+
+    def test_server_exposes_prometheus_endpoint(self):
+        metrics.increment("llm.requests")
+
+        async def scenario():
+            service = AssistantService()
+            server = await asyncio.start_server(
+                lambda reader, writer: handle_connection(service, reader, writer),
+                "127.0.0.1",
+                0,
+            )
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        response = asyncio.run(scenario())
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"Content-Type: text/plain", response)
+        self.assertIn(b"assistant_llm_requests_total 1", response)
+
+
+class TestStartup(unittest.TestCase):
+    # Cumulative import time allowed for `main`, in microseconds
+    IMPORT_BUDGET_US = 250_000
+
+    def test_main_imports_without_llm_or_dataframe_stack(self):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        timings = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                timings[module.strip()] = int(cumulative)
+        self.assertIn("main", timings)
+        for heavy in ("openai", "dotenv", "numpy", "pandas"):
+            self.assertNotIn(heavy, timings)
+        self.assertLess(timings["main"], self.IMPORT_BUDGET_US)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,128 @@
+import pandas as pd
+
+
+class Trends:
+    """Multi-week analytics over a FoodLog using a cached columnar frame.
+
+    The log is converted to a typed DataFrame once. Appended entries are
+    buffered through a FoodLog listener and concatenated on the next query,
+    and derived results are cached until the frame or the calorie limit
+    changes.
+    """
+
+    def __init__(self, food_log, user_profile):
+        self.food_log = food_log
+        self.user_profile = user_profile
+        self._frame = None
+        self._pending = []
+        self._cache = {}
+        food_log.add_listener(self._on_log_entry)
+
+    def _on_log_entry(self, entry):
+        if entry is None:
+            self._frame = None
+            self._pending = []
+        else:
+            self._pending.append(entry)
+        self._cache.clear()
+
+    @staticmethod
+    def _to_frame(entries):
+        frame = pd.DataFrame(entries, columns=["date", "food", "category", "calories"])
+        return frame.astype(
+            {
+                "date": "datetime64[ns]",
+                "food": "category",
+                "category": "category",
+                "calories": "int64",
+            }
+        )
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            self._frame = self._to_frame(self.food_log.log)
+            self._pending = []
+        elif self._pending:
+            new_rows = self._to_frame(self._pending)
+            self._pending = []
+            frame = pd.concat([self._frame, new_rows], ignore_index=True)
+            # Concatenating categoricals with different categories yields objects
+            self._frame = frame.astype({"food": "category", "category": "category"})
+        return self._frame
+
+    def _cached(self, key, compute):
+        key = (key, self.user_profile["daily_calorie_limit"])
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def daily_totals(self):
+        """Calories per calendar day (missing days are 0) against the limit."""
+
+        def compute():
+            totals = self.frame.groupby("date")["calories"].sum()
+            if len(totals):
+                totals = totals.asfreq("D", fill_value=0)
+            limit = self.user_profile["daily_calorie_limit"]
+            daily = totals.astype("int64").to_frame("total")
+            daily["limit"] = limit
+            daily["over_limit"] = daily["total"] > limit
+            daily["difference"] = daily["total"] - limit
+            return daily
+
+        return self._cached("daily_totals", compute)
+
+    def rolling_averages(self, windows=(7, 30)):
+        def compute():
+            totals = self.daily_totals()["total"]
+            return pd.DataFrame(
+                {
+                    f"avg_{window}d": totals.rolling(window, min_periods=1).mean()
+                    for window in windows
+                }
+            )
+
+        return self._cached(("rolling", tuple(windows)), compute)
+
+    def over_limit_streaks(self):
+        """Runs of consecutive days over the limit, longest first."""
+
+        def compute():
+            over = self.daily_totals()["over_limit"]
+            run_ids = (over != over.shift()).cumsum()
+            dates = over.index.to_series()
+            runs = pd.DataFrame(
+                {
+                    "start": dates.groupby(run_ids).min(),
+                    "end": dates.groupby(run_ids).max(),
+                    "over_limit": over.groupby(run_ids).first(),
+                }
+            )
+            runs = runs[runs["over_limit"].astype(bool)].drop(columns="over_limit")
+            runs["days"] = (runs["end"] - runs["start"]).dt.days + 1
+            runs = runs.sort_values(["days", "start"], ascending=[False, True])
+            return runs.reset_index(drop=True)
+
+        return self._cached("streaks", compute)
+
+    def current_streak(self):
+        over = self.daily_totals()["over_limit"]
+        if not len(over) or not over.iloc[-1]:
+            return 0
+        # Days since the last day that was within the limit
+        within = (~over).to_numpy().nonzero()[0]
+        return len(over) if not len(within) else len(over) - 1 - within[-1]
+
+    def category_share(self, freq="W"):
+        """Share of calories per category for each period (rows sum to 1)."""
+
+        def compute():
+            frame = self.frame
+            calories = frame.groupby(
+                [pd.Grouper(key="date", freq=freq), "category"], observed=True
+            )["calories"].sum()
+            table = calories.unstack(fill_value=0)
+            return table.div(table.sum(axis=1), axis=0).fillna(0.0)
+
+        return self._cached(("category_share", freq), compute)
@@ -1,11 +1,46 @@
 import json
-import os
+
+from persistence import get_persister
+from storage import get_storage
+
+PROFILE_FIELDS = {
+    "weight": float,
+    "height": float,
+    "age": int,
+    "daily_calorie_limit": int,
+}
+
+
+class UserNotFound(Exception):
+    pass
+
+
+def new_profile(weight, height, age, daily_calorie_limit):
+    return {
+        "weight": float(weight),
+        "height": float(height),
+        "age": int(age),
+        "daily_calorie_limit": int(daily_calorie_limit),
+        "block_list": {"foods": [], "categories": []},
+    }
+
+
+def load_user(username, storage=None):
+    # Non-interactive load; never prompts to create a missing profile
+    if storage is None:
+        storage = get_storage()
+    profile = storage.load_profile(username)
+    if profile is None:
+        raise UserNotFound(username)
+    return User(username, profile=profile, storage=storage)
 
 
 class User:
-    def __init__(self, username, profile=None):
+    def __init__(self, username, profile=None, storage=None, persister=None):
         self.username = username
-        self.profile_path = f"{self.username}_profile.json"
+        self.storage = get_storage() if storage is None else storage
+        # Write-behind for interactive edits; None saves every edit immediately
+        self.persister = get_persister() if persister is None else persister
 
         if profile is not None:
             # Use the provided profile (useful for testing)
@@ -14,11 +49,10 @@ class User:
             self.profile = self.load_profile()
 
     def load_profile(self):
-        if os.path.exists(self.profile_path):
-            with open(self.profile_path, "r") as file:
-                return json.load(file)
-        else:
+        profile = self.storage.load_profile(self.username)
+        if profile is None:
             return self.create_profile()
+        return profile
 
     def create_profile(self):
         print("Creating a new user profile.")
@@ -26,23 +60,46 @@ class User:
         height = float(input("Enter your height (cm): "))
         age = int(input("Enter your age: "))
         daily_calorie_limit = int(input("Set your daily calorie limit (kcal): "))
-        block_list = {"foods": [], "categories": []}
-
-        profile = {
-            "weight": weight,
-            "height": height,
-            "age": age,
-            "daily_calorie_limit": daily_calorie_limit,
-            "block_list": block_list,
-        }
+
+        profile = new_profile(weight, height, age, daily_calorie_limit)
         self.save_profile(profile)
         return profile
 
     def save_profile(self, profile=None):
         if profile is None:
             profile = self.profile
-        with open(self.profile_path, "w") as file:
-            json.dump(profile, file)
+        self.storage.save_profile(self.username, profile)
+
+    def save_later(self):
+        """Save now, or coalesce with other edits when a persister is set."""
+        if self.persister is None:
+            self.save_profile()
+            return
+        # A copy, so edits made before the write cannot race the writer thread
+        snapshot = json.loads(json.dumps(self.profile))
+        self.persister.mark_dirty(
+            (self.storage, "profile", self.username),
+            lambda: self.save_profile(snapshot),
+        )
+
+    def set_fields(self, **fields):
+        # Non-interactive counterpart of update_profile; does not save.
+        # Every field is converted before any is assigned, so a bad value
+        # leaves the profile unchanged
+        converted = {}
+        for name, value in fields.items():
+            if name not in PROFILE_FIELDS:
+                raise ValueError(f"Unknown profile field: {name}")
+            converted[name] = PROFILE_FIELDS[name](value)
+        self.profile.update(converted)
+
+    def block(self, kind, name):
+        # Non-interactive counterpart of add_to_block_list; does not save
+        if kind not in ("foods", "categories"):
+            raise ValueError(f"Unknown block list: {kind}")
+        name = name.strip().lower()
+        self.profile["block_list"][kind].append(name)
+        return name
 
     def update_profile(self):
         print("\nUpdating profile:")
@@ -52,7 +109,7 @@ class User:
         self.profile["daily_calorie_limit"] = int(
             input("Set your daily calorie limit (kcal): ")
         )
-        self.save_profile()
+        self.save_later()
         print("Profile updated successfully.")
 
     def add_to_block_list(self):
@@ -62,14 +119,14 @@ class User:
         choice = input("Choose an option: ")
 
         if choice == "1":
-            food = input("Enter the food name to block: ").strip().lower()
-            self.profile["block_list"]["foods"].append(food)
+            food = self.block("foods", input("Enter the food name to block: "))
             print(f"'{food}' added to food block list.")
         elif choice == "2":
-            category = input("Enter the category name to block: ").strip().lower()
-            self.profile["block_list"]["categories"].append(category)
+            category = self.block(
+                "categories", input("Enter the category name to block: ")
+            )
             print(f"'{category}' added to category block list.")
         else:
             print("Invalid choice.")
             return
-        self.save_profile()
+        self.save_later()